@@ -0,0 +1,134 @@
+"""
+elb-log-parser.py 的行为测试: 手写分词器与 grok 等价正则的一致性、t-digest 分位数精度
+
+运行方法:
+    python3 -m pytest -q elb-log-deployment/tests
+"""
+
+import sys
+import json
+import bisect
+import random
+import itertools
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+TOOLS_DIR = Path(__file__).resolve().parent.parent / 'tools'
+
+def _load_parser():
+    if 'elb_log_parser' in sys.modules:
+        return sys.modules['elb_log_parser']
+    spec = importlib.util.spec_from_file_location('elb_log_parser', TOOLS_DIR / 'elb-log-parser.py')
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['elb_log_parser'] = module
+    spec.loader.exec_module(module)
+    return module
+
+elp = _load_parser()
+
+def elb_line(request: str = 'GET https://api.example.com:443/api/v1/users?id=7 HTTP/1.1',
+             user_agent: str = 'curl/8.4.0', client: str = '203.0.113.10:51234',
+             target: str = '10.0.1.20:8080', status: str = '200') -> str:
+    return (
+        f'https 2024-01-15T10:00:00.123456Z app/prod-alb/50dc6c495c0c9188 {client} {target} '
+        f'0.000 0.052 0.000 {status} {status} 512 2048 "{request}" "{user_agent}" '
+        f'ECDHE-RSA-AES128-GCM-SHA256 TLSv1.2 arn:aws:elasticloadbalancing:us-east-1:123456789012:targetgroup/tg/1 '
+        f'"Root=1-65a4f3b1-0123456789abcdef01234567" "api.example.com" "session-reused" 1 '
+        f'2024-01-15T10:00:00.071000Z "forward" "-" "-" "{target}" "{status}" "-" "-" TID_0123456789abcdef'
+    )
+
+@pytest.fixture(scope='module')
+def parsers():
+    return elp.ElbLogParser(), elp.ElbLogRegexParser()
+
+def test_synthetic_lines_match_regex_parser(parsers):
+    fast, regex = parsers
+    for line in itertools.islice(elp.synthetic_lines(seed=3), 2000):
+        assert fast.parse_line(line) == regex.parse_line(line), line
+
+@pytest.mark.parametrize('line, slow', [
+    (elb_line(), False),
+    (elb_line(target='-', status='-'), False),
+    (elb_line(request='GET https://[2001:db8::1]:443/health HTTP/1.1', client='[2001:db8::2]:40000'), False),
+    (elb_line(request='- - -'), False),
+    # 引号字段中有转义引号，走慢路径
+    (elb_line(user_agent='Mozilla/5.0 (compatible; \\"Bot\\"/1.0)'), True),
+    (elb_line(request='GET https://api.example.com:443/search?q=\\"a b\\" HTTP/1.1'), True),
+    (elb_line(user_agent='ends with backslash \\\\'), True),
+])
+def test_edge_cases_match_regex_parser(parsers, monkeypatch, line, slow):
+    fast, regex = parsers
+    calls = []
+    slow_path = fast._tokenize_slow
+    monkeypatch.setattr(fast, '_tokenize_slow', lambda text: calls.append(text) or slow_path(text))
+
+    assert fast.tokenize(line) == regex.tokenize(line)
+    assert fast.parse_line(line) == regex.parse_line(line)
+    assert bool(calls) == slow
+
+def test_slow_path_handles_escaped_quotes(parsers):
+    fast, _ = parsers
+    record = fast.parse_line(elb_line(user_agent='say \\"hi\\" there'))
+    assert record['user_agent'] == 'say \\"hi\\" there'
+    assert record['domain_name'] == 'api.example.com'
+    assert record['conn_trace_id'] == 'TID_0123456789abcdef'
+
+TRUNCATED = elb_line(user_agent='x \\"y')
+
+@pytest.mark.parametrize('line', [
+    elb_line()[:120],
+    # 慢路径中引号未闭合
+    TRUNCATED[:TRUNCATED.index('x \\"y') + 5],
+])
+def test_malformed_lines_are_rejected(parsers, line):
+    fast, _ = parsers
+    with pytest.raises(ValueError):
+        fast.parse_line(line)
+
+def rank_error(values: list, estimate: float, q: float) -> float:
+    return abs(bisect.bisect_left(values, estimate) / len(values) - q)
+
+@pytest.fixture(scope='module')
+def latencies():
+    rng = random.Random(5)
+    return [rng.expovariate(10) for _ in range(50000)]
+
+def build_digest(values) -> 'elp.TDigest':
+    digest = elp.TDigest()
+    for value in values:
+        digest.add(value)
+    return digest
+
+@pytest.mark.parametrize('parts', [1, 10])
+def test_tdigest_quantiles_are_accurate(latencies, parts):
+    digest = elp.TDigest()
+    for part in range(parts):
+        # 按文件/进程拆分后合并的精度与直接构建相当
+        digest.merge(build_digest(latencies[part::parts]))
+    expected = sorted(latencies)
+
+    assert digest.count == len(latencies)
+    assert len(digest.centroids) <= digest.compression
+    for q in (0.01, 0.25, 0.5, 0.75, 0.9, 0.95):
+        assert rank_error(expected, digest.quantile(q), q) < 0.005, q
+    # 尾部分位数的误差更小
+    for q in (0.99, 0.999):
+        assert rank_error(expected, digest.quantile(q), q) < 0.0015, q
+    assert digest.quantile(0) == expected[0]
+    assert digest.quantile(1) == expected[-1]
+
+def test_tdigest_round_trips_through_json(latencies):
+    digest = build_digest(latencies)
+    restored = elp.TDigest.from_dict(json.loads(json.dumps(digest.to_dict())))
+
+    assert restored.count == digest.count
+    for q in (0.5, 0.95, 0.99):
+        assert restored.quantile(q) == digest.quantile(q)
+
+def test_tdigest_small_inputs():
+    assert elp.TDigest().quantile(0.5) is None
+    assert build_digest([0.25]).quantile(0.99) == 0.25
+    digest = build_digest([1.0, 2.0, 3.0, 4.0])
+    assert 1.0 <= digest.quantile(0.5) <= 4.0
@@ -0,0 +1,978 @@
+#!/usr/bin/env python3
+"""
+ELB 访问日志文件解析和验证工具
+
+功能:
+1. 下载和解析 S3 中的 ELB 访问日志文件
+2. 验证文件格式
+3. 生成统计报告
+4. 转换为不同格式 (JSON, CSV, Parquet)
+5. 与等价的正则实现对比解析吞吐 (benchmark 子命令)
+6. 按目标组、域名和 URL 路径流式统计延迟分位数和 4xx/5xx 比例，部分结果可合并 (merge 子命令)
+
+解析得到的字段与 OSI 管道 (dashborad-script/osi-elb-logs-fixed.yml) 中 grok 提取的字段一致。
+
+使用方法:
+    python3 elb-log-parser.py --s3-file my-bucket AWSLogs/123456789012/elasticloadbalancing/us-east-1/2024/01/15/file.log.gz
+    python3 elb-log-parser.py --local-file /path/to/file.log.gz --format json
+    python3 elb-log-parser.py --s3-prefix my-bucket AWSLogs/123456789012/elasticloadbalancing/us-east-1/2024/01/15/ --stats
+    python3 elb-log-parser.py --s3-prefix my-bucket AWSLogs/123456789012/elasticloadbalancing/us-east-1/2024/01/15/ --latency-stats --workers 8 --partial-output 2024-01-15.json
+    python3 elb-log-parser.py merge 2024-01-14.json 2024-01-15.json --rollup 86400
+    python3 elb-log-parser.py benchmark --synthetic-mb 2048
+
+依赖:
+    pip install boto3 pandas pyarrow
+"""
+
+import os
+import re
+import sys
+import time
+import gzip
+import json
+import math
+import random
+import argparse
+import tempfile
+import boto3
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Iterator, Tuple
+import logging
+from pathlib import Path
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class ElbLogParser:
+    """
+    ELB 访问日志解析器
+
+    使用手写的分词器代替 grok/正则: 前 12 个字段不含空格，直接用 str.split 切分；
+    剩余部分按双引号切分后，引号内外的片段交替出现，位置固定。只有引号字段中出现转义
+    引号 (\\") 时才退回逐个字段扫描的慢路径，整个过程没有正则回溯。
+    """
+
+    # 字段定义 (按 ALB 访问日志顺序，与 grok 模式一致)
+    FIELD_NAMES = [
+        'type', 'elb_timestamp', 'elb', 'client_port', 'target_port',
+        'request_processing_time', 'target_processing_time', 'response_processing_time',
+        'elb_status_code', 'target_status_code', 'received_bytes', 'sent_bytes',
+        'request', 'user_agent', 'ssl_cipher', 'ssl_protocol', 'target_group_arn',
+        'trace_id', 'domain_name', 'chosen_cert_arn', 'matched_rule_priority',
+        'request_creation_time', 'actions_executed', 'redirect_url', 'error_reason',
+        'target_port_list', 'target_status_code_list', 'classification',
+        'classification_reason', 'conn_trace_id'
+    ]
+
+    # 数值字段
+    FLOAT_FIELDS = ('request_processing_time', 'target_processing_time', 'response_processing_time')
+    INT_FIELDS = ('elb_status_code', 'received_bytes', 'sent_bytes', 'matched_rule_priority')
+
+    # 前 12 个字段 (type 到 sent_bytes) 不含引号和空格
+    HEAD_FIELDS = 12
+
+    def __init__(self):
+        self.s3_client = boto3.client('s3')
+
+    def download_from_s3(self, bucket: str, key: str, local_path: Optional[str] = None) -> str:
+        """从 S3 下载文件"""
+        if local_path is None:
+            local_path = f"/tmp/{Path(key).name}"
+
+        logger.info(f"下载 s3://{bucket}/{key} 到 {local_path}")
+        self.s3_client.download_file(bucket, key, local_path)
+        return local_path
+
+    def parse_file(self, file_path: str) -> Iterator[Dict]:
+        """解析 ELB 访问日志文件"""
+        logger.info(f"解析文件: {file_path}")
+
+        # 判断是否为压缩文件
+        if file_path.endswith('.gz'):
+            open_func = gzip.open
+            mode = 'rt'
+        else:
+            open_func = open
+            mode = 'r'
+
+        line_count = 0
+        error_count = 0
+
+        with open_func(file_path, mode, encoding='utf-8') as f:
+            for line_num, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+
+                try:
+                    record = self.parse_line(line)
+                    if record:
+                        yield record
+                        line_count += 1
+                except Exception as e:
+                    error_count += 1
+                    logger.warning(f"解析第 {line_num} 行失败: {e}")
+
+        logger.info(f"解析完成: {line_count} 条记录, {error_count} 个错误")
+
+    def tokenize(self, line: str) -> List[str]:
+        """把一行切分为 30 个原始字段 (引号字段去掉引号)"""
+        head = line.split(' ', self.HEAD_FIELDS)
+        if len(head) <= self.HEAD_FIELDS:
+            raise ValueError(f"字段数量不足: {len(head)}")
+        rest = head.pop()
+
+        # 引号内外交替: ['', request, ' ', user_agent, ' cipher protocol target_group ', trace_id, ...]
+        if '\\"' not in rest:
+            parts = rest.split('"')
+            if len(parts) == 25 and not parts[0]:
+                unquoted = parts[4].split(' ')
+                middle = parts[10].split(' ')
+                tail = parts[24].split(' ')
+                if len(unquoted) == 5 and len(middle) == 4 and len(tail) >= 2:
+                    return head + [
+                        parts[1], parts[3], unquoted[1], unquoted[2], unquoted[3],
+                        parts[5], parts[7], parts[9], middle[1], middle[2],
+                        parts[11], parts[13], parts[15], parts[17], parts[19], parts[21], parts[23],
+                        tail[1]
+                    ]
+
+        return head + self._tokenize_slow(rest)
+
+    def _tokenize_slow(self, text: str) -> List[str]:
+        """逐个字段扫描，处理引号字段中的转义引号"""
+        fields = []
+        expected = len(self.FIELD_NAMES) - self.HEAD_FIELDS
+        pos = 0
+        length = len(text)
+
+        while pos < length and len(fields) < expected:
+            if text[pos] == '"':
+                end = pos + 1
+                while True:
+                    end = text.find('"', end)
+                    if end == -1:
+                        raise ValueError("引号未闭合")
+                    # 前面有奇数个反斜杠时是转义引号
+                    backslashes = 0
+                    while text[end - 1 - backslashes] == '\\':
+                        backslashes += 1
+                    if backslashes % 2 == 0:
+                        break
+                    end += 1
+                fields.append(text[pos + 1:end])
+                pos = end + 2
+            else:
+                end = text.find(' ', pos)
+                if end == -1:
+                    end = length
+                fields.append(text[pos:end])
+                pos = end + 1
+
+        if len(fields) != expected:
+            raise ValueError(f"字段数量不匹配: 期望 {len(self.FIELD_NAMES)}, 实际 {len(fields) + self.HEAD_FIELDS}")
+        return fields
+
+    def split_address(self, value: Optional[str]) -> Tuple[Optional[str], Optional[int]]:
+        """拆分 ip:port，IPv6 地址按最后一个冒号拆分"""
+        if value is None:
+            return None, None
+        ip, sep, port = value.rpartition(':')
+        if not sep or not port.isdigit():
+            return None, None
+        return ip, int(port)
+
+    def split_request(self, request: Optional[str]) -> Tuple:
+        """拆分请求行: (verb, proto, host, port, url, params, http_version)"""
+        if request is None:
+            return (None,) * 7
+        parts = request.split(' ')
+        if len(parts) != 3:
+            return (None,) * 7
+        verb, uri, version = parts
+
+        proto, sep, rest = uri.partition('://')
+        if not sep:
+            return verb, None, None, None, None, None, version
+        authority, slash, path = rest.partition('/')
+        path, question, query = (slash + path).partition('?')
+
+        host, port = authority, None
+        if not authority.endswith(']'):
+            candidate, colon, port_text = authority.rpartition(':')
+            if colon and port_text.isdigit():
+                host, port = candidate, int(port_text)
+
+        return verb, proto, host, port, path or None, (question + query) or None, version
+
+    @staticmethod
+    def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+        """解析 ISO 8601 时间戳 (2024-01-15T10:00:00.123456Z)"""
+        if value is None:
+            return None
+        if value.endswith('Z'):
+            return datetime.fromisoformat(value[:-1]).replace(tzinfo=timezone.utc)
+        return datetime.fromisoformat(value)
+
+    def parse_line(self, line: str) -> Optional[Dict]:
+        """解析单行记录"""
+        fields = self.tokenize(line)
+
+        record = {}
+        for field_name, value in zip(self.FIELD_NAMES, fields):
+            # 处理缺失值
+            record[field_name] = None if value == '-' or value == '' else value
+
+        for field_name in self.FLOAT_FIELDS:
+            value = record[field_name]
+            if value is not None:
+                record[field_name] = float(value)
+        for field_name in self.INT_FIELDS:
+            value = record[field_name]
+            if value is not None:
+                record[field_name] = int(value)
+
+        # 添加计算字段
+        record['client_ip'], record['client_port_parsed'] = self.split_address(record['client_port'])
+        record['target_ip'], record['target_port_parsed'] = self.split_address(record['target_port'])
+        (record['request_verb'], record['request_proto'], record['request_host'], record['request_port'],
+         record['request_url'], record['request_params'], record['http_version']) = self.split_request(record['request'])
+        record['timestamp'] = self.parse_timestamp(record['elb_timestamp'])
+        record['request_creation_time'] = self.parse_timestamp(record['request_creation_time'])
+
+        return record
+
+    def generate_stats(self, records: List[Dict]) -> Dict:
+        """生成统计报告"""
+        if not records:
+            return {}
+
+        df = pd.DataFrame(records)
+        status_class = (df['elb_status_code'] // 100).value_counts()
+
+        stats = {
+            'total_records': len(records),
+            'time_range': {
+                'start': df['timestamp'].min().isoformat(),
+                'end': df['timestamp'].max().isoformat(),
+            },
+            'traffic_summary': {
+                'received_bytes': int(df['received_bytes'].sum()),
+                'sent_bytes': int(df['sent_bytes'].sum()),
+                'unique_clients': df['client_ip'].nunique(),
+                'unique_targets': df['target_ip'].nunique(),
+            },
+            'status_breakdown': {f"{int(code)}xx": int(count) for code, count in status_class.sort_index().items()},
+            'type_breakdown': df['type'].value_counts().to_dict(),
+            'top_domains': df['domain_name'].value_counts().head(10).to_dict(),
+            'top_clients': df['client_ip'].value_counts().head(10).to_dict(),
+            'top_urls': df['request_url'].value_counts().head(10).to_dict(),
+            'top_errors': df['error_reason'].value_counts().head(10).to_dict(),
+        }
+
+        return stats
+
+    def save_as_json(self, records: List[Dict], output_path: str):
+        """保存为 JSON 格式"""
+        logger.info(f"保存为 JSON: {output_path}")
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(records, f, indent=2, default=str)
+
+    def save_as_csv(self, records: List[Dict], output_path: str):
+        """保存为 CSV 格式"""
+        logger.info(f"保存为 CSV: {output_path}")
+        df = pd.DataFrame(records)
+        df.to_csv(output_path, index=False)
+
+    def save_as_parquet(self, records: List[Dict], output_path: str):
+        """保存为 Parquet 格式"""
+        logger.info(f"保存为 Parquet: {output_path}")
+        df = pd.DataFrame(records)
+        df.to_parquet(output_path, index=False)
+
+    def iter_s3_files(self, bucket: str, prefix: str) -> Iterator[str]:
+        """逐个下载前缀下的文件，调用方处理完后删除本地副本，磁盘占用只有一个文件"""
+        for key in self.list_s3_files(bucket, prefix):
+            fd, local_path = tempfile.mkstemp(suffix=Path(key).name)
+            os.close(fd)
+            self.download_from_s3(bucket, key, local_path)
+            try:
+                yield local_path
+            finally:
+                os.remove(local_path)
+
+    def list_s3_files(self, bucket: str, prefix: str) -> List[str]:
+        """列出 S3 中的文件"""
+        logger.info(f"列出 s3://{bucket}/{prefix} 中的文件")
+
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        files = []
+
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                if obj['Key'].endswith('.gz'):
+                    files.append(obj['Key'])
+
+        logger.info(f"找到 {len(files)} 个文件")
+        return files
+
+class TDigest:
+    """
+    可合并的 t-digest 分位数草图 (merging 变体，k1 尺度函数)
+
+    质心数量由 compression 决定 (约 compression 个)，与输入量无关；两端的质心更小，
+    所以 p99 等尾部分位数的误差远小于中位数附近。两个 digest 合并后的精度与直接在
+    全部数据上构建相当，可以跨进程、跨文件和跨小时合并。
+    """
+
+    def __init__(self, compression: float = 100):
+        self.compression = compression
+        self.centroids: List[List[float]] = []
+        self.buffer: List[float] = []
+        self.pending: List[List[float]] = []
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        self.buffer.append(value)
+        self.count += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if len(self.buffer) >= self.compression * 5:
+            self._compress()
+
+    def merge(self, other: 'TDigest'):
+        other._compress()
+        self.pending.extend([mean, weight] for mean, weight in other.centroids)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if len(self.pending) >= self.compression * 5:
+            self._compress()
+
+    def _k(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _q(self, k: float) -> float:
+        k = min(max(k, -self.compression / 4), self.compression / 4)
+        return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+
+    def _compress(self):
+        if not self.buffer and not self.pending:
+            return
+        items = self.centroids + self.pending + [[value, 1.0] for value in self.buffer]
+        items.sort(key=lambda item: item[0])
+        self.buffer = []
+        self.pending = []
+
+        total = sum(weight for _, weight in items)
+        merged = []
+        mean, weight = items[0]
+        cumulative = 0.0
+        limit = total * self._q(self._k(0.0) + 1)
+        for item_mean, item_weight in items[1:]:
+            if cumulative + weight + item_weight <= limit:
+                # 加权合并到当前质心
+                weight += item_weight
+                mean += (item_mean - mean) * item_weight / weight
+            else:
+                merged.append([mean, weight])
+                cumulative += weight
+                limit = total * self._q(self._k(cumulative / total) + 1)
+                mean, weight = item_mean, item_weight
+        merged.append([mean, weight])
+        self.centroids = merged
+
+    def quantile(self, q: float) -> Optional[float]:
+        """估计第 q 分位数 (0 <= q <= 1)"""
+        self._compress()
+        if not self.centroids:
+            return None
+        if len(self.centroids) == 1:
+            return self.centroids[0][0]
+
+        total = sum(weight for _, weight in self.centroids)
+        index = q * total
+        first_mean, first_weight = self.centroids[0]
+        if index < first_weight / 2:
+            return self.min + (first_mean - self.min) * index / (first_weight / 2)
+
+        cumulative = 0.0
+        for (left_mean, left_weight), (right_mean, right_weight) in zip(self.centroids, self.centroids[1:]):
+            left_center = cumulative + left_weight / 2
+            right_center = cumulative + left_weight + right_weight / 2
+            if index < right_center:
+                return left_mean + (right_mean - left_mean) * (index - left_center) / (right_center - left_center)
+            cumulative += left_weight
+
+        last_mean, last_weight = self.centroids[-1]
+        tail = total - last_weight / 2
+        return last_mean + (self.max - last_mean) * min((index - tail) / (last_weight / 2), 1.0)
+
+    def to_dict(self) -> Dict:
+        self._compress()
+        return {'compression': self.compression, 'count': self.count,
+                'min': self.min if self.count else None, 'max': self.max if self.count else None,
+                'centroids': self.centroids}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'TDigest':
+        digest = cls(data['compression'])
+        digest.centroids = [list(centroid) for centroid in data['centroids']]
+        digest.count = data['count']
+        if digest.count:
+            digest.min, digest.max = data['min'], data['max']
+        return digest
+
+class ElbLatencyStats:
+    """
+    按时间桶和维度流式汇总 ELB 延迟分位数、4xx/5xx 比例和字节数
+
+    每个 (时间桶, 维度, 取值) 保存请求数、状态码计数、字节数和一个 t-digest，内存只与
+    分组数量有关；每个维度在一个时间桶内最多保留 max_keys 个取值，超出的归入 __other__。
+    部分结果可以序列化为 JSON，在多个进程、多个文件或多个小时之间合并，也可以汇总到更粗的时间桶。
+    """
+
+    DIMENSIONS = ('all', 'target_group', 'domain', 'path')
+    OTHER = '__other__'
+
+    # 延迟字段在 tokenize 结果中的位置，total 为三段之和
+    LATENCY_FIELDS = {'request': 5, 'target': 6, 'response': 7, 'total': None}
+
+    def __init__(self, interval: int = 3600, dimensions: Tuple[str, ...] = DIMENSIONS, max_keys: int = 1000,
+                 path_depth: int = 0, latency_field: str = 'total', compression: float = 100):
+        self.interval = interval
+        self.dimensions = tuple(dimensions)
+        self.max_keys = max_keys
+        self.path_depth = path_depth
+        self.latency_field = latency_field
+        self.compression = compression
+        self.groups: Dict[Tuple[int, str, str], Dict] = {}
+        self.key_counts: Dict[Tuple[int, str], int] = {}
+        self.errors = 0
+
+    def options(self) -> Dict:
+        return {'interval': self.interval, 'dimensions': list(self.dimensions), 'max_keys': self.max_keys,
+                'path_depth': self.path_depth, 'latency_field': self.latency_field,
+                'compression': self.compression}
+
+    def _group(self, bucket: int, dimension: str, value: Optional[str]) -> Dict:
+        key = (bucket, dimension, value or '-')
+        group = self.groups.get(key)
+        if group is None:
+            count_key = (bucket, dimension)
+            if self.key_counts.get(count_key, 0) >= self.max_keys:
+                key = (bucket, dimension, self.OTHER)
+                group = self.groups.get(key)
+            if group is None:
+                group = {'requests': 0, '4xx': 0, '5xx': 0, 'received_bytes': 0, 'sent_bytes': 0,
+                         'digest': TDigest(self.compression)}
+                self.groups[key] = group
+                self.key_counts[count_key] = self.key_counts.get(count_key, 0) + 1
+        return group
+
+    def _path(self, url: Optional[str]) -> Optional[str]:
+        if url is None or not self.path_depth:
+            return url
+        segments = url.split('/', self.path_depth + 1)
+        return '/'.join(segments[:self.path_depth + 1])
+
+    def add_line(self, parser: ElbLogParser, line: str):
+        fields = parser.tokenize(line)
+        timestamp = parser.parse_timestamp(fields[1])
+        bucket = int(timestamp.timestamp()) // self.interval * self.interval
+
+        if self.latency_field == 'total':
+            parts = [float(fields[5]), float(fields[6]), float(fields[7])]
+            # -1 表示请求没有到达目标或连接中断，不计入延迟
+            latency = sum(parts) if min(parts) >= 0 else None
+        else:
+            latency = float(fields[self.LATENCY_FIELDS[self.latency_field]])
+            latency = latency if latency >= 0 else None
+
+        status = fields[8]
+        status_class = status[0] if status != '-' else None
+        received = int(fields[10])
+        sent = int(fields[11])
+
+        for dimension in self.dimensions:
+            if dimension == 'all':
+                value = '*'
+            elif dimension == 'target_group':
+                value = fields[16]
+            elif dimension == 'domain':
+                value = fields[18]
+            else:
+                value = self._path(parser.split_request(fields[12])[4])
+            group = self._group(bucket, dimension, value)
+            group['requests'] += 1
+            if status_class == '4':
+                group['4xx'] += 1
+            elif status_class == '5':
+                group['5xx'] += 1
+            group['received_bytes'] += received
+            group['sent_bytes'] += sent
+            if latency is not None:
+                group['digest'].add(latency)
+
+    def add_file(self, parser: ElbLogParser, file_path: str):
+        """流式读取一个文件，不保留逐行记录"""
+        open_func = gzip.open if file_path.endswith('.gz') else open
+        with open_func(file_path, 'rt', encoding='utf-8') as f:
+            for line_num, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    self.add_line(parser, line)
+                except Exception as e:
+                    self.errors += 1
+                    logger.warning(f"{file_path} 第 {line_num} 行解析失败: {e}")
+
+    def _merge_group(self, key: Tuple[int, str, str], other_group: Dict):
+        group = self._group(*key)
+        for name in ('requests', '4xx', '5xx', 'received_bytes', 'sent_bytes'):
+            group[name] += other_group[name]
+        group['digest'].merge(other_group['digest'])
+
+    def merge(self, other: 'ElbLatencyStats'):
+        """合并另一个部分结果 (相同的时间桶和分组会累加)"""
+        if other.interval != self.interval or other.latency_field != self.latency_field:
+            raise ValueError("部分结果的时间桶或延迟字段不一致，无法合并")
+        for key, other_group in other.groups.items():
+            self._merge_group(key, other_group)
+        self.errors += other.errors
+
+    def rollup(self, interval: int) -> 'ElbLatencyStats':
+        """汇总到更粗的时间桶 (如小时汇总为天)"""
+        if interval % self.interval:
+            raise ValueError(f"汇总间隔必须是 {self.interval} 秒的整数倍")
+        options = self.options()
+        options['interval'] = interval
+        result = ElbLatencyStats(**options)
+        for (bucket, dimension, value), group in self.groups.items():
+            result._merge_group((bucket // interval * interval, dimension, value), group)
+        result.errors = self.errors
+        return result
+
+    def to_dict(self) -> Dict:
+        return {
+            'options': self.options(),
+            'errors': self.errors,
+            'groups': [
+                {'bucket': bucket, 'dimension': dimension, 'value': value,
+                 **{name: group[name] for name in ('requests', '4xx', '5xx', 'received_bytes', 'sent_bytes')},
+                 'digest': group['digest'].to_dict()}
+                for (bucket, dimension, value), group in self.groups.items()
+            ]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'ElbLatencyStats':
+        options = dict(data['options'])
+        options['dimensions'] = tuple(options['dimensions'])
+        stats = cls(**options)
+        stats.errors = data['errors']
+        for item in data['groups']:
+            key = (item['bucket'], item['dimension'], item['value'])
+            stats.groups[key] = {name: item[name] for name in ('requests', '4xx', '5xx', 'received_bytes', 'sent_bytes')}
+            stats.groups[key]['digest'] = TDigest.from_dict(item['digest'])
+            count_key = key[:2]
+            stats.key_counts[count_key] = stats.key_counts.get(count_key, 0) + 1
+        return stats
+
+    def report(self, quantiles: Tuple[float, ...] = (0.5, 0.95, 0.99)) -> pd.DataFrame:
+        """每个分组一行: 请求数、4xx/5xx 比例、字节数和延迟分位数 (秒)"""
+        rows = []
+        for (bucket, dimension, value), group in sorted(self.groups.items(), key=lambda item: (item[0][0], item[0][1], -item[1]['requests'])):
+            row = {
+                'time': datetime.fromtimestamp(bucket, timezone.utc).isoformat(),
+                'dimension': dimension,
+                'value': value,
+                'requests': group['requests'],
+                '4xx_rate': group['4xx'] / group['requests'] if group['requests'] else 0.0,
+                '5xx_rate': group['5xx'] / group['requests'] if group['requests'] else 0.0,
+                'received_bytes': group['received_bytes'],
+                'sent_bytes': group['sent_bytes'],
+            }
+            for q in quantiles:
+                row[f"p{q * 100:g}"] = group['digest'].quantile(q)
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+class ElbLogRegexParser(ElbLogParser):
+    """
+    与 OSI grok 模式等价的正则实现，仅用于 benchmark 对比
+
+    grok 中的 NOTSPACE、QS、NUMBER、TIMESTAMP_ISO8601 按 logstash 的定义展开，
+    client:port 和请求行同样使用 grok 的子模式拆分，记录构建与 ElbLogParser 共用。
+    """
+
+    NOTSPACE = r'\S+'
+    QS = r'"((?:[^"\\]|\\.)*)"'
+    NUMBER = r'[+-]?(?:\d+(?:\.\d+)?|\.\d+)'
+    TIMESTAMP = r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:?\d{2})?'
+
+    LINE_PATTERN = re.compile(' '.join([
+        f'({NOTSPACE})', f'({TIMESTAMP})', f'({NOTSPACE})', f'({NOTSPACE})', f'({NOTSPACE})',
+        f'({NUMBER})', f'({NUMBER})', f'({NUMBER})', r'(\d+|-)', f'({NOTSPACE})',
+        f'({NUMBER})', f'({NUMBER})', QS, QS, f'({NOTSPACE})', f'({NOTSPACE})', f'({NOTSPACE})',
+        QS, QS, QS, r'(\d+|-)', f'({TIMESTAMP})', QS, QS, QS, QS, QS, QS, QS, f'({NOTSPACE})'
+    ]))
+    ADDRESS_PATTERN = re.compile(r'^(.+):(\d+)$')
+    REQUEST_PATTERN = re.compile(
+        r'^(\w+) ([A-Za-z][A-Za-z0-9+\-.]*)://((?:\[[0-9A-Fa-f:.]+\])|[^/?:#\s]+)(?::(\d+))?'
+        r'(/[^?#\s]*)?(\?[^#\s]*)? (\S+)$'
+    )
+
+    def tokenize(self, line: str) -> List[str]:
+        match = self.LINE_PATTERN.match(line)
+        if match is None:
+            raise ValueError("与 grok 模式不匹配")
+        return list(match.groups())
+
+    def split_address(self, value: Optional[str]) -> Tuple[Optional[str], Optional[int]]:
+        if value is None:
+            return None, None
+        match = self.ADDRESS_PATTERN.match(value)
+        if match is None:
+            return None, None
+        return match.group(1), int(match.group(2))
+
+    def split_request(self, request: Optional[str]) -> Tuple:
+        if request is None:
+            return (None,) * 7
+        match = self.REQUEST_PATTERN.match(request)
+        if match is None:
+            parts = request.split(' ')
+            return (parts[0], None, None, None, None, None, parts[2]) if len(parts) == 3 else (None,) * 7
+        verb, proto, host, port, path, params, version = match.groups()
+        return verb, proto, host, int(port) if port else None, path, params, version
+
+def synthetic_lines(seed: int = 0) -> Iterator[str]:
+    """生成格式与真实 ALB 访问日志一致的样例行 (无限序列)"""
+    rng = random.Random(seed)
+    domains = ['api.example.com', 'www.example.com', 'static.example.com', 'auth.example.com']
+    paths = ['/', '/api/v1/users', '/api/v1/orders', '/login', '/static/app.js', '/health', '/api/v2/search']
+    agents = ['Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+              'curl/8.4.0', 'python-requests/2.31.0', 'Mozilla/5.0 (compatible; \\"Bot\\"/1.0)']
+    target_groups = [f'arn:aws:elasticloadbalancing:us-east-1:123456789012:targetgroup/tg-{i}/{i:016x}' for i in range(4)]
+    while True:
+        domain = rng.choice(domains)
+        status = rng.choices([200, 301, 404, 500, 502], weights=[90, 3, 4, 2, 1])[0]
+        has_target = status != 502
+        ts = f"2024-01-15T{rng.randrange(24):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}.{rng.randrange(10**6):06d}Z"
+        query = f"?id={rng.randrange(10000)}" if rng.random() < 0.3 else ''
+        target = f"10.0.{rng.randrange(4)}.{rng.randrange(256)}:8080" if has_target else '-'
+        yield (
+            f"https {ts} app/prod-alb/50dc6c495c0c9188 203.0.113.{rng.randrange(256)}:{rng.randrange(1024, 65536)} "
+            f"{target} 0.000 {rng.random():.3f} 0.000 {status} {status if has_target else '-'} "
+            f"{rng.randrange(100, 2000)} {rng.randrange(200, 200000)} "
+            f"\"GET https://{domain}:443{rng.choice(paths)}{query} HTTP/1.1\" \"{rng.choice(agents)}\" "
+            f"ECDHE-RSA-AES128-GCM-SHA256 TLSv1.2 {rng.choice(target_groups)} "
+            f"\"Root=1-65a4f3b1-{rng.randrange(16**24):024x}\" \"{domain}\" "
+            f"\"arn:aws:acm:us-east-1:123456789012:certificate/12345678-1234-1234-1234-123456789012\" "
+            f"{rng.randrange(1, 10)} {ts} \"forward\" \"-\" \"-\" \"{target}\" \"{status if has_target else '-'}\" "
+            f"\"-\" \"-\" TID_{rng.randrange(16**16):016x}"
+        )
+
+def run_benchmark(args):
+    """
+    对比手写分词器与正则实现的吞吐
+
+    两个实现依次流式读取同一输入，内存占用与输入大小无关，可用于数 GB 的文件。
+    先在样本上确认两者解析结果一致，再分别计时分词和完整解析。
+    """
+    if args.local_file or args.local_dir:
+        files = [args.local_file] if args.local_file else sorted(str(path) for path in Path(args.local_dir).rglob('*.gz'))
+
+        def lines() -> Iterator[str]:
+            for file_path in files:
+                open_func = gzip.open if file_path.endswith('.gz') else open
+                with open_func(file_path, 'rt', encoding='utf-8') as f:
+                    for line in f:
+                        line = line.strip()
+                        if line:
+                            yield line
+    else:
+        limit = args.synthetic_mb * 1024 * 1024
+
+        def lines() -> Iterator[str]:
+            # 预生成一批样例行后循环使用，避免生成成本计入解析时间
+            sample = [line for line, _ in zip(synthetic_lines(), range(20000))]
+            size = 0
+            while True:
+                for line in sample:
+                    if size >= limit:
+                        return
+                    size += len(line) + 1
+                    yield line
+
+    # 逐行告警会干扰计时，只保留错误日志
+    logger.setLevel(logging.ERROR)
+    fast, regex = ElbLogParser(), ElbLogRegexParser()
+
+    for index, line in enumerate(lines()):
+        if index >= 10000:
+            break
+        if fast.parse_line(line) != regex.parse_line(line):
+            raise AssertionError(f"两种实现的解析结果不一致: {line}")
+
+    def measure(func: Callable[[str], object]) -> Tuple[int, int, float]:
+        count = size = 0
+        start = time.perf_counter()
+        for line in lines():
+            func(line)
+            count += 1
+            size += len(line) + 1
+        return count, size, time.perf_counter() - start
+
+    results = []
+    for stage in args.stages:
+        for name, parser in (('hand-written', fast), ('regex', regex)):
+            count, size, elapsed = measure(parser.tokenize if stage == 'tokenize' else parser.parse_line)
+            results.append((stage, name, count, size, elapsed))
+
+    print(f"\n=== ELB 解析吞吐 ===")
+    print(f"{'阶段':<10}{'实现':<14}{'行数':>12}{'MB':>10}{'秒':>10}{'MB/s':>10}{'行/秒':>12}")
+    for stage, name, count, size, elapsed in results:
+        print(f"{stage:<10}{name:<14}{count:>12,}{size / 1048576:>10.1f}{elapsed:>10.2f}"
+              f"{size / 1048576 / elapsed:>10.1f}{count / elapsed:>12,.0f}")
+    for stage in args.stages:
+        timings = {name: elapsed for s, name, _, _, elapsed in results if s == stage}
+        print(f"{stage} 加速比: {timings['regex'] / timings['hand-written']:.2f}x")
+
+def benchmark_main(argv: List[str]):
+    """benchmark 子命令入口"""
+    parser = argparse.ArgumentParser(prog='elb-log-parser.py benchmark', description='对比手写分词器与正则实现的解析吞吐')
+    input_group = parser.add_mutually_exclusive_group()
+    input_group.add_argument('--local-file', help='本地文件路径')
+    input_group.add_argument('--local-dir', help='本地目录 (使用其中所有 .gz 文件)')
+    input_group.add_argument('--synthetic-mb', type=int, default=512, help='不指定文件时生成的样例数据大小 (MB)')
+    parser.add_argument('--stages', nargs='+', choices=['tokenize', 'parse'], default=['tokenize', 'parse'],
+                        help='计时的阶段: 只分词或完整解析')
+
+    run_benchmark(parser.parse_args(argv))
+
+def collect_latency_stats(source, options: Dict) -> ElbLatencyStats:
+    """汇总一个文件，source 为本地路径或 (bucket, key)"""
+    parser = ElbLogParser()
+    stats = ElbLatencyStats(**options)
+    if isinstance(source, str):
+        stats.add_file(parser, source)
+    else:
+        bucket, key = source
+        fd, local_path = tempfile.mkstemp(suffix=Path(key).name)
+        os.close(fd)
+        try:
+            parser.download_from_s3(bucket, key, local_path)
+            stats.add_file(parser, local_path)
+        finally:
+            os.remove(local_path)
+    return stats
+
+def _collect_latency_stats_in_worker(source, options: Dict) -> Dict:
+    """worker 进程入口，部分结果序列化后返回给父进程"""
+    return collect_latency_stats(source, options).to_dict()
+
+def run_latency_stats(args, files: List) -> ElbLatencyStats:
+    """延迟统计模式: 多进程按文件汇总，再合并部分结果"""
+    options = {
+        'interval': args.interval,
+        'dimensions': tuple(args.dimensions.split(',')),
+        'max_keys': args.max_keys,
+        'path_depth': args.path_depth,
+        'latency_field': args.latency_field,
+        'compression': args.compression,
+    }
+    stats = ElbLatencyStats(**options)
+
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            for partial in executor.map(_collect_latency_stats_in_worker, files, [options] * len(files)):
+                stats.merge(ElbLatencyStats.from_dict(partial))
+    else:
+        for source in files:
+            stats.merge(collect_latency_stats(source, options))
+
+    logger.info(f"延迟统计完成: {len(files)} 个文件, {len(stats.groups)} 个分组, {stats.errors} 个错误")
+    return stats
+
+def write_latency_report(stats: ElbLatencyStats, args):
+    """输出部分结果和报表"""
+    if args.partial_output:
+        with open(args.partial_output, 'w', encoding='utf-8') as f:
+            json.dump(stats.to_dict(), f)
+        logger.info(f"部分结果已保存到: {args.partial_output}")
+
+    report = stats.report()
+    if report.empty:
+        return
+    if args.top:
+        print(report.head(args.top).to_string(index=False))
+
+    output_path = args.output or 'elb_latency_stats.csv'
+    if output_path.endswith('.json'):
+        report.to_json(output_path, orient='records', indent=2, force_ascii=False)
+    else:
+        report.to_csv(output_path, index=False)
+    logger.info(f"延迟报表已保存到: {output_path}")
+
+def merge_main(argv: List[str]):
+    """merge 子命令入口: 合并多个部分结果"""
+    parser = argparse.ArgumentParser(prog='elb-log-parser.py merge', description='合并 --latency-stats 产生的部分结果')
+    parser.add_argument('partials', nargs='+', help='部分结果 JSON 文件')
+    parser.add_argument('--rollup', type=int, help='汇总到更粗的时间桶 (秒)，如 86400')
+    parser.add_argument('--partial-output', help='合并后的部分结果输出路径')
+    parser.add_argument('--output', help='报表输出路径 (.csv 或 .json)')
+    parser.add_argument('--top', type=int, default=50, help='终端打印的行数')
+    args = parser.parse_args(argv)
+
+    stats = None
+    for path in args.partials:
+        with open(path, encoding='utf-8') as f:
+            partial = ElbLatencyStats.from_dict(json.load(f))
+        if stats is None:
+            stats = partial
+        else:
+            stats.merge(partial)
+
+    if args.rollup:
+        stats = stats.rollup(args.rollup)
+    write_latency_report(stats, args)
+
+def main():
+    # 子命令
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        return benchmark_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == 'merge':
+        return merge_main(sys.argv[2:])
+
+    parser = argparse.ArgumentParser(description='ELB 访问日志解析工具')
+
+    # 输入选项
+    input_group = parser.add_mutually_exclusive_group(required=True)
+    input_group.add_argument('--local-file', help='本地文件路径')
+    input_group.add_argument('--s3-file', nargs=2, metavar=('BUCKET', 'KEY'), help='S3 文件 (bucket key)')
+    input_group.add_argument('--s3-prefix', nargs=2, metavar=('BUCKET', 'PREFIX'), help='S3 前缀 (处理多个文件)')
+    input_group.add_argument('--local-dir', help='本地目录 (处理其中所有 .gz 文件)')
+
+    # 输出选项
+    parser.add_argument('--format', choices=['json', 'csv', 'parquet'], default='json', help='输出格式')
+    parser.add_argument('--output', help='输出文件路径')
+    parser.add_argument('--stats', action='store_true', help='生成统计报告')
+    parser.add_argument('--stats-only', action='store_true', help='只生成统计报告')
+    parser.add_argument('--limit', type=int, help='限制处理的记录数量')
+
+    # 延迟统计选项
+    parser.add_argument('--latency-stats', action='store_true', help='流式统计各维度的延迟分位数、4xx/5xx 比例和字节数')
+    parser.add_argument('--interval', type=int, default=3600, help='统计时间桶 (秒)')
+    parser.add_argument('--dimensions', default=','.join(ElbLatencyStats.DIMENSIONS), help='统计维度 (逗号分隔): all,target_group,domain,path')
+    parser.add_argument('--latency-field', choices=list(ElbLatencyStats.LATENCY_FIELDS), default='total', help='统计的延迟字段')
+    parser.add_argument('--path-depth', type=int, default=0, help='URL 路径只保留前 N 段 (0 表示完整路径)')
+    parser.add_argument('--max-keys', type=int, default=1000, help='每个时间桶每个维度最多保留的取值数，超出的归入 __other__')
+    parser.add_argument('--compression', type=float, default=100, help='t-digest 压缩参数，越大越精确')
+    parser.add_argument('--workers', type=int, default=1, help='并行处理文件的进程数')
+    parser.add_argument('--partial-output', help='部分结果 (JSON) 输出路径，可用 merge 子命令合并')
+    parser.add_argument('--top', type=int, default=50, help='终端打印的行数')
+
+    args = parser.parse_args()
+
+    parser_tool = ElbLogParser()
+    all_records = []
+
+    try:
+        if args.latency_stats:
+            if args.local_file:
+                sources = [args.local_file]
+            elif args.local_dir:
+                sources = sorted(str(path) for path in Path(args.local_dir).rglob('*.gz'))
+            elif args.s3_file:
+                sources = [tuple(args.s3_file)]
+            else:
+                bucket, prefix = args.s3_prefix
+                sources = [(bucket, key) for key in parser_tool.list_s3_files(bucket, prefix)]
+            write_latency_report(run_latency_stats(args, sources), args)
+            return
+
+        # 处理输入
+        if args.local_file:
+            files_to_process = [args.local_file]
+        elif args.s3_file:
+            bucket, key = args.s3_file
+            files_to_process = [parser_tool.download_from_s3(bucket, key)]
+        elif args.s3_prefix:
+            # 逐个下载，处理完即删除本地副本
+            files_to_process = parser_tool.iter_s3_files(*args.s3_prefix)
+        elif args.local_dir:
+            files_to_process = sorted(str(path) for path in Path(args.local_dir).rglob('*.gz'))
+
+        # 解析文件
+        for file_path in files_to_process:
+            logger.info(f"处理文件: {file_path}")
+
+            for record in parser_tool.parse_file(file_path):
+                all_records.append(record)
+
+                if args.limit and len(all_records) >= args.limit:
+                    logger.info(f"达到记录限制: {args.limit}")
+                    break
+
+            if args.limit and len(all_records) >= args.limit:
+                break
+
+        logger.info(f"总共解析了 {len(all_records)} 条记录")
+
+        # 生成统计报告
+        if args.stats or args.stats_only:
+            stats = parser_tool.generate_stats(all_records)
+            stats_output = args.output.replace('.json', '_stats.json') if args.output else 'elb_log_stats.json'
+
+            with open(stats_output, 'w', encoding='utf-8') as f:
+                json.dump(stats, f, indent=2, default=str)
+
+            logger.info(f"统计报告已保存到: {stats_output}")
+
+            # 打印简要统计
+            if stats:
+                print(f"\n=== ELB 访问日志统计报告 ===")
+                print(f"总请求数: {stats['total_records']:,}")
+                print(f"接收字节: {stats['traffic_summary']['received_bytes']:,}")
+                print(f"发送字节: {stats['traffic_summary']['sent_bytes']:,}")
+                print(f"唯一客户端: {stats['traffic_summary']['unique_clients']:,}")
+
+                if stats['status_breakdown']:
+                    print(f"\n状态码分布:")
+                    for status, count in stats['status_breakdown'].items():
+                        print(f"  {status}: {count:,}")
+
+                if stats['top_domains']:
+                    print(f"\n请求最多的域名:")
+                    for domain, count in stats['top_domains'].items():
+                        print(f"  {domain}: {count:,}")
+
+        # 保存解析结果
+        if not args.stats_only and all_records:
+            output_path = args.output or f'elb_logs.{args.format}'
+
+            if args.format == 'json':
+                parser_tool.save_as_json(all_records, output_path)
+            elif args.format == 'csv':
+                parser_tool.save_as_csv(all_records, output_path)
+            elif args.format == 'parquet':
+                parser_tool.save_as_parquet(all_records, output_path)
+
+            logger.info(f"解析结果已保存到: {output_path}")
+
+    except Exception as e:
+        logger.error(f"处理失败: {e}")
+        raise
+
+if __name__ == '__main__':
+    main()
@@ -7,19 +7,42 @@ VPC Flow Logs SQS 消息处理示例
 
 使用方法:
     python3 sqs-message-processor.py --queue-url <SQS_QUEUE_URL> [--format auto]
+    python3 sqs-message-processor.py --queue-url <SQS_QUEUE_URL> --receivers 2 --workers 8
+    python3 sqs-message-processor.py --queue-url <SQS_QUEUE_URL> --processes 4 --max-processes 16
+    python3 sqs-message-processor.py --queue-url <SQS_QUEUE_URL> --window-output /tmp/flow-windows.json
+    python3 sqs-message-processor.py --queue-url <SQS_QUEUE_URL> --metrics-port 9108
 
 依赖:
     pip install boto3 pandas pyarrow
 """
 
+import io
+import os
 import json
 import gzip
+import math
+import bisect
+import time
+import queue
+import sqlite3
+import threading
+import functools
+import multiprocessing
+import urllib.request
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import boto3
 import argparse
 import logging
 from urllib.parse import unquote_plus
-from typing import Dict, List, Optional
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 
 # 配置日志
 logging.basicConfig(
@@ -28,18 +51,553 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class NotificationDeduplicator:
+    """
+    S3 事件通知去重缓存
+    
+    S3 事件通知至少投递一次，同一对象可能收到多条通知。以
+    bucket/key/ETag/sequencer 作为对象标识，先查有界的内存 LRU，
+    再查可选的 SQLite 持久化存储 (按过期时间清理)，重复通知无需下载对象。
+    对象开始处理时只登记一个短租约，由心跳续期；处理成功后才改为保留
+    TTL，进程崩溃后租约过期，重新投递的通知可以再次处理。
+    所有操作都由锁保护，可在多个处理线程之间共享。
+    """
+    
+    def __init__(self, capacity: int = 100000, ttl: float = 86400, db_path: Optional[str] = None,
+                 purge_interval: int = 1000, lease: float = 150):
+        """
+        初始化去重缓存
+        
+        Args:
+            capacity: 内存 LRU 的最大条目数
+            ttl: 处理成功的标识的保留时间（秒）
+            db_path: SQLite 数据库路径，为空时只使用内存缓存
+            purge_interval: 每多少次查询清理一次 SQLite 中的过期条目
+            lease: 处理中标识的租约时长（秒），需短于消息的可见性超时
+        """
+        self.capacity = capacity
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.lease = lease
+        self._entries: 'OrderedDict[str, float]' = OrderedDict()
+        self._leased: set = set()
+        self._lock = threading.Lock()
+        self._lookups = 0
+        self._hits = 0
+        
+        self._db = None
+        if db_path:
+            # WAL 模式允许多个轮询进程共享同一个数据库文件
+            self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS processed_objects '
+                '(identity TEXT PRIMARY KEY, expires_at REAL NOT NULL)'
+            )
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS processed_objects_expires ON processed_objects (expires_at)'
+            )
+            self._db.commit()
+
+    @staticmethod
+    def record_identity(record: Dict) -> Optional[str]:
+        """
+        从 S3 事件记录生成对象标识
+        
+        Args:
+            record: S3 事件记录
+            
+        Returns:
+            对象标识，记录中既没有 ETag 也没有 sequencer 时返回 None (不去重)
+        """
+        s3_object = record['s3']['object']
+        etag = s3_object.get('eTag', '')
+        sequencer = s3_object.get('sequencer', '')
+        if not etag and not sequencer:
+            return None
+        return f"{record['s3']['bucket']['name']}/{s3_object['key']}/{etag}/{sequencer}"
+
+    def claim(self, identity: str) -> bool:
+        """
+        以租约登记对象标识，租约过期的标识可以重新登记
+        
+        Args:
+            identity: 对象标识
+            
+        Returns:
+            首次出现或租约已过期返回 True，已处理或正在处理返回 False
+        """
+        now = time.time()
+        with self._lock:
+            self._lookups += 1
+            
+            expires_at = self._entries.get(identity)
+            if expires_at is not None and expires_at > now:
+                self._entries.move_to_end(identity)
+                self._hits += 1
+                return False
+            
+            if self._db is not None:
+                held_until = self._claim_persistent(identity, now)
+                if held_until is not None:
+                    # 其他实例已处理或正在处理，按其记录的过期时间缓存
+                    self._hits += 1
+                    self._remember(identity, held_until)
+                    return False
+            
+            self._remember(identity, now + self.lease)
+            self._leased.add(identity)
+            return True
+
+    def extend(self) -> int:
+        """为本实例持有的所有租约续期，由轮询器心跳调用，返回续期的标识数"""
+        with self._lock:
+            if not self._leased:
+                return 0
+            expires_at = time.time() + self.lease
+            for identity in self._leased:
+                self._remember(identity, expires_at)
+            if self._db is not None:
+                self._db.executemany(
+                    'UPDATE processed_objects SET expires_at = ? WHERE identity = ?',
+                    [(expires_at, identity) for identity in self._leased]
+                )
+                self._db.commit()
+            return len(self._leased)
+
+    def complete(self, identity: str):
+        """处理成功后把租约改为完整的保留 TTL"""
+        with self._lock:
+            self._leased.discard(identity)
+            expires_at = time.time() + self.ttl
+            self._remember(identity, expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO processed_objects (identity, expires_at) VALUES (?, ?)',
+                    (identity, expires_at)
+                )
+                self._db.commit()
+
+    def release(self, identity: str):
+        """处理失败时撤销登记，使后续重新投递的通知可以被处理"""
+        with self._lock:
+            self._leased.discard(identity)
+            self._entries.pop(identity, None)
+            if self._db is not None:
+                self._db.execute('DELETE FROM processed_objects WHERE identity = ?', (identity,))
+                self._db.commit()
+
+    def _remember(self, identity: str, expires_at: float):
+        self._entries[identity] = expires_at
+        self._entries.move_to_end(identity)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def _claim_persistent(self, identity: str, now: float) -> Optional[float]:
+        """在 SQLite 中登记租约，标识已被持有时返回其过期时间"""
+        if self._lookups % self.purge_interval == 0:
+            self._db.execute('DELETE FROM processed_objects WHERE expires_at <= ?', (now,))
+        
+        self._db.execute(
+            'DELETE FROM processed_objects WHERE identity = ? AND expires_at <= ?', (identity, now)
+        )
+        cursor = self._db.execute(
+            'INSERT OR IGNORE INTO processed_objects (identity, expires_at) VALUES (?, ?)',
+            (identity, now + self.lease)
+        )
+        held_until = None
+        if cursor.rowcount != 1:
+            row = self._db.execute(
+                'SELECT expires_at FROM processed_objects WHERE identity = ?', (identity,)
+            ).fetchone()
+            held_until = row[0] if row else now + self.lease
+        self._db.commit()
+        return held_until
+
+    def stats(self) -> Dict:
+        """返回查询次数、命中次数和命中率"""
+        with self._lock:
+            return {
+                'lookups': self._lookups,
+                'hits': self._hits,
+                'hit_rate': round(self._hits / self._lookups, 4) if self._lookups else 0.0,
+                'size': len(self._entries),
+                'leased': len(self._leased)
+            }
+
+class SlidingWindowAggregator:
+    """
+    按事件时间维护的滚动流量窗口
+    
+    流记录按 windowstart 落入固定宽度的时间桶，时间桶存放在环形缓冲区中，
+    覆盖最长窗口后自动复用；每个时间桶只保留字节数最多的若干源地址，
+    因此无论运行多久内存占用都是有界的。各窗口 (如 1m/5m/1h) 的快照由
+    水位线 (已见到的最新事件时间) 向前若干个时间桶汇总得到。
+    """
+    
+    def __init__(self, windows: Tuple[int, ...] = (60, 300, 3600), bucket_seconds: int = 10,
+                 top_k: int = 10, bucket_capacity: Optional[int] = None):
+        """
+        初始化窗口聚合器
+        
+        Args:
+            windows: 窗口长度列表（秒）
+            bucket_seconds: 时间桶宽度（秒）
+            top_k: 快照中输出的热门源地址数量
+            bucket_capacity: 每个时间桶保留的源地址数量上限 (默认 top_k 的 4 倍)
+        """
+        self.windows = tuple(sorted(windows))
+        self.bucket_seconds = bucket_seconds
+        self.top_k = top_k
+        self.bucket_capacity = bucket_capacity or top_k * 4
+        self.max_window = self.windows[-1]
+        
+        self._ring: List[Optional[Dict]] = [None] * (math.ceil(self.max_window / bucket_seconds) + 1)
+        self._watermark: Optional[int] = None
+        self._late_flows = 0
+        self._lock = threading.Lock()
+        
+        self._emit_stop = threading.Event()
+        self._emitter: Optional[threading.Thread] = None
+        self._emit_args: Tuple[Optional[str], Optional[str]] = (None, None)
+
+    def __getstate__(self) -> Dict:
+        # 传给 worker 进程时只携带配置，worker 只负责生成时间桶汇总
+        return {
+            'windows': self.windows,
+            'bucket_seconds': self.bucket_seconds,
+            'top_k': self.top_k,
+            'bucket_capacity': self.bucket_capacity
+        }
+
+    def __setstate__(self, state: Dict):
+        self.__init__(**state)
+
+    def summarize_frame(self, df: pd.DataFrame) -> Dict[int, Dict]:
+        """
+        把单个文件的 DataFrame 汇总为按时间桶划分的精简结果
+        
+        Args:
+            df: Flow Logs DataFrame
+            
+        Returns:
+            时间桶起始时间 -> 汇总结果
+        """
+        required = {'windowstart', 'srcaddr', 'bytes', 'packets', 'action'}
+        if df.empty or not required.issubset(df.columns):
+            return {}
+        
+        frame = df[list(required)].dropna(subset=['windowstart'])
+        bucket = (frame['windowstart'] - frame['windowstart'] % self.bucket_seconds).rename('bucket')
+        
+        grouped = frame.groupby(bucket)
+        totals = grouped[['bytes', 'packets']].sum()
+        totals['flows'] = grouped.size()
+        totals['accept'] = (frame['action'] == 'ACCEPT').groupby(bucket).sum()
+        totals['reject'] = (frame['action'] == 'REJECT').groupby(bucket).sum()
+        
+        # 每个时间桶只保留字节数最多的源地址
+        sources = (frame.groupby([bucket, 'srcaddr'], observed=True)['bytes'].sum()
+                   .sort_values(ascending=False)
+                   .groupby(level=0).head(self.bucket_capacity))
+        
+        summary = {}
+        for bucket_start, row in totals.iterrows():
+            summary[int(bucket_start)] = {
+                'flows': int(row['flows']), 'bytes': int(row['bytes']), 'packets': int(row['packets']),
+                'accept': int(row['accept']), 'reject': int(row['reject']), 'sources': {}
+            }
+        for (bucket_start, srcaddr), value in sources.items():
+            summary[int(bucket_start)]['sources'][srcaddr] = int(value)
+        return summary
+
+    def merge(self, summary: Dict[int, Dict]):
+        """
+        合并时间桶汇总，超出最长窗口的迟到数据被丢弃
+        
+        Args:
+            summary: summarize_frame 的结果
+        """
+        with self._lock:
+            if summary:
+                latest = max(summary)
+                if self._watermark is None or latest > self._watermark:
+                    self._watermark = latest
+            
+            for bucket_start, part in summary.items():
+                if bucket_start <= self._watermark - self.max_window:
+                    self._late_flows += part['flows']
+                    continue
+                
+                index = (bucket_start // self.bucket_seconds) % len(self._ring)
+                slot = self._ring[index]
+                if slot is None or slot['start'] < bucket_start:
+                    # 复用已过期的时间桶
+                    slot = {'start': bucket_start, 'flows': 0, 'bytes': 0, 'packets': 0,
+                            'accept': 0, 'reject': 0, 'sources': {}}
+                    self._ring[index] = slot
+                
+                for field in ('flows', 'bytes', 'packets', 'accept', 'reject'):
+                    slot[field] += part[field]
+                sources = slot['sources']
+                for srcaddr, value in part['sources'].items():
+                    sources[srcaddr] = sources.get(srcaddr, 0) + value
+                if len(sources) > self.bucket_capacity:
+                    slot['sources'] = dict(sorted(sources.items(), key=lambda x: x[1],
+                                                  reverse=True)[:self.bucket_capacity])
+
+    def add_frame(self, df: pd.DataFrame):
+        """汇总并合并单个文件的 DataFrame"""
+        self.merge(self.summarize_frame(df))
+
+    @staticmethod
+    def _label(seconds: int) -> str:
+        for unit, size in (('h', 3600), ('m', 60)):
+            if seconds % size == 0:
+                return f"{seconds // size}{unit}"
+        return f"{seconds}s"
+
+    def snapshot(self) -> Dict:
+        """返回各窗口的流量快照"""
+        with self._lock:
+            watermark = self._watermark
+            slots = [dict(slot, sources=dict(slot['sources'])) for slot in self._ring if slot]
+            late_flows = self._late_flows
+        
+        windows = {}
+        for window in self.windows:
+            totals = {'flows': 0, 'bytes': 0, 'packets': 0, 'accept': 0, 'reject': 0}
+            sources: Dict[str, int] = {}
+            if watermark is not None:
+                for slot in slots:
+                    if watermark - window < slot['start'] <= watermark:
+                        for field in totals:
+                            totals[field] += slot[field]
+                        for srcaddr, value in slot['sources'].items():
+                            sources[srcaddr] = sources.get(srcaddr, 0) + value
+            
+            top_sources = sorted(sources.items(), key=lambda x: x[1], reverse=True)[:self.top_k]
+            windows[self._label(window)] = dict(
+                totals,
+                start=watermark - window + self.bucket_seconds if watermark is not None else None,
+                end=watermark + self.bucket_seconds if watermark is not None else None,
+                top_sources=[{'srcaddr': srcaddr, 'bytes': value} for srcaddr, value in top_sources]
+            )
+        
+        return {
+            'generated_at': datetime.now(timezone.utc).isoformat(),
+            'watermark': watermark,
+            'late_flows': late_flows,
+            'windows': windows
+        }
+
+    def emit(self, output_path: Optional[str] = None, url: Optional[str] = None):
+        """
+        输出一次窗口快照
+        
+        Args:
+            output_path: 快照文件路径 (先写临时文件再替换，读取方不会读到半个文件)
+            url: 以 JSON POST 快照的 HTTP 地址
+        """
+        payload = json.dumps(self.snapshot(), default=str, ensure_ascii=False)
+        
+        if output_path:
+            tmp_path = f"{output_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(tmp_path, output_path)
+        
+        if url:
+            request = urllib.request.Request(
+                url, data=payload.encode('utf-8'), headers={'Content-Type': 'application/json'}
+            )
+            with urllib.request.urlopen(request, timeout=10):
+                pass
+
+    def start_emitting(self, interval: float = 30, output_path: Optional[str] = None,
+                       url: Optional[str] = None):
+        """启动后台线程定期输出窗口快照"""
+        def emit_loop():
+            while not self._emit_stop.wait(interval):
+                try:
+                    self.emit(output_path, url)
+                except Exception as e:
+                    logger.warning(f"输出窗口快照失败: {e}")
+        
+        self._emit_args = (output_path, url)
+        self._emitter = threading.Thread(target=emit_loop, name='window-emitter', daemon=True)
+        self._emitter.start()
+
+    def stop_emitting(self):
+        """停止后台输出并写出最后一次快照"""
+        if self._emitter is None:
+            return
+        self._emit_stop.set()
+        self._emitter.join()
+        self._emitter = None
+        try:
+            self.emit(*self._emit_args)
+        except Exception as e:
+            logger.warning(f"输出窗口快照失败: {e}")
+
+class PollerMetrics:
+    """
+    轮询器运行指标
+    
+    计数器和各处理阶段的耗时直方图保存在内存中，由内嵌的 HTTP 服务以
+    Prometheus 文本格式输出。更新操作只做一次加锁的加法或二分查找，
+    可以在满负载下常开；速率 (如每秒记录数) 由 Prometheus 的 rate() 计算。
+    """
+    
+    PREFIX = 'vpcflow_poller'
+    
+    COUNTERS = {
+        'messages_received_total': '接收的 SQS 消息数',
+        'messages_processed_total': '处理完成的 SQS 消息数',
+        'messages_failed_total': '处理失败的 SQS 消息数',
+        'messages_deleted_total': '删除的 SQS 消息数',
+        'messages_extended_total': '延长可见性超时的次数',
+        'files_processed_total': '处理的 S3 文件数',
+        'bytes_processed_total': '下载的 S3 对象字节数',
+        'records_processed_total': '解析的 Flow Log 记录数',
+    }
+    
+    STAGES = ('receive', 's3_get', 'decompress', 'parse', 'analyze', 'delete')
+    
+    # 直方图上界（秒）
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {name: 0 for name in self.COUNTERS}
+        self._histograms = {stage: [0] * (len(self.BUCKETS) + 1) for stage in self.STAGES}
+        self._sums = {stage: 0.0 for stage in self.STAGES}
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def inc(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def counter(self, name: str) -> float:
+        """读取计数器的当前值"""
+        with self._lock:
+            return self._counters[name]
+
+    def observe(self, stage: str, seconds: float):
+        index = bisect.bisect_left(self.BUCKETS, seconds)
+        with self._lock:
+            self._histograms[stage][index] += 1
+            self._sums[stage] += seconds
+
+    def gauge(self, name: str, help_text: str, callback: Callable[[], float]):
+        """注册在输出时才计算的瞬时指标"""
+        self._gauges[name] = (help_text, callback)
+
+    def render(self) -> str:
+        """输出 Prometheus 文本格式"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {stage: list(counts) for stage, counts in self._histograms.items()}
+            sums = dict(self._sums)
+        
+        lines = []
+        for name, value in counters.items():
+            metric = f"{self.PREFIX}_{name}"
+            lines += [f"# HELP {metric} {self.COUNTERS[name]}", f"# TYPE {metric} counter",
+                      f"{metric} {value}"]
+        
+        metric = f"{self.PREFIX}_stage_duration_seconds"
+        lines += [f"# HELP {metric} 各处理阶段耗时", f"# TYPE {metric} histogram"]
+        for stage, counts in histograms.items():
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS, counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines += [f'{metric}_bucket{{stage="{stage}",le="+Inf"}} {cumulative}',
+                      f'{metric}_sum{{stage="{stage}"}} {sums[stage]}',
+                      f'{metric}_count{{stage="{stage}"}} {cumulative}']
+        
+        for name, (help_text, callback) in self._gauges.items():
+            metric = f"{self.PREFIX}_{name}"
+            try:
+                value = callback()
+            except Exception as e:
+                logger.warning(f"计算指标 {metric} 失败: {e}")
+                continue
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge", f"{metric} {value}"]
+        
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int, host: str = '0.0.0.0'):
+        """在后台线程中启动 /metrics HTTP 服务"""
+        metrics = self
+        
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+        
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='metrics-server', daemon=True).start()
+        logger.info(f"指标服务已启动: http://{host}:{self._server.server_port}/metrics")
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
 class VPCFlowLogsProcessor:
-    def __init__(self, queue_url: str, region: str = None):
+    # 紧凑列类型对应的 Arrow 类型 (category 以字典编码读取)
+    ARROW_TYPES = {
+        'UInt8': pa.uint8(), 'UInt16': pa.uint16(), 'Int64': pa.int64(),
+        'category': pa.dictionary(pa.int32(), pa.string()), 'string': pa.string()
+    }
+    
+    # Arrow 整数列转换为 pandas 可空整数类型
+    PANDAS_TYPES = {
+        pa.uint8(): pd.UInt8Dtype(), pa.uint16(): pd.UInt16Dtype(), pa.int64(): pd.Int64Dtype()
+    }
+    
+    # Parquet 格式的 Flow Logs 按字段名命名列 (连字符替换为下划线)，与 Text 格式的列名不同
+    PARQUET_COLUMNS = {'start': 'windowstart', 'end': 'windowend', 'log_status': 'flowlogstatus'}
+    
+    def __init__(self, queue_url: str, region: str = None, sqs_client=None, s3_client=None,
+                 deduplicator: Optional[NotificationDeduplicator] = None,
+                 windows: Optional[SlidingWindowAggregator] = None,
+                 metrics: Optional[PollerMetrics] = None):
         """
         初始化 VPC Flow Logs 处理器
         
         Args:
             queue_url: SQS 队列 URL
             region: AWS 区域
+            sqs_client: 可选的 SQS 客户端 (默认按 region 创建 boto3 客户端，可传入本地替身用于测试)
+            s3_client: 可选的 S3 客户端 (同上)
+            deduplicator: 可选的重复通知去重缓存
+            windows: 可选的滚动窗口聚合器
+            metrics: 可选的运行指标
         """
         self.queue_url = queue_url
-        self.sqs = boto3.client('sqs', region_name=region)
-        self.s3 = boto3.client('s3', region_name=region)
+        self.region = region
+        self.deduplicator = deduplicator
+        self.windows = windows
+        self.metrics = metrics
+        self.sqs = sqs_client or boto3.client('sqs', region_name=region)
+        self.s3 = s3_client or boto3.client('s3', region_name=region)
         
         # VPC Flow Logs 字段定义
         self.flow_log_columns = [
@@ -51,6 +609,20 @@ class VPCFlowLogsProcessor:
             'sublocation_type', 'sublocation_id', 'pkt_src_aws_service',
             'pkt_dst_aws_service', 'flow_direction', 'traffic_path'
         ]
+        
+        # 紧凑的列类型: 低基数字符串使用 category，端口/协议使用窄整数；
+        # 缺失值 '-' 需要表示为 NA，因此数值列使用可空整数类型
+        self.column_dtypes = {
+            'version': 'UInt8', 'srcport': 'UInt16', 'dstport': 'UInt16', 'protocol': 'UInt8',
+            'packets': 'Int64', 'bytes': 'Int64', 'windowstart': 'Int64', 'windowend': 'Int64',
+            'tcp_flags': 'UInt16', 'traffic_path': 'UInt8',
+            'account_id': 'category', 'interface_id': 'category', 'action': 'category',
+            'flowlogstatus': 'category', 'vpc_id': 'category', 'subnet_id': 'category',
+            'instance_id': 'category', 'type': 'category', 'region': 'category',
+            'az_id': 'category', 'sublocation_type': 'category', 'sublocation_id': 'category',
+            'pkt_src_aws_service': 'category', 'pkt_dst_aws_service': 'category',
+            'flow_direction': 'category'
+        }
 
     def detect_file_format(self, file_key: str) -> str:
         """
@@ -70,50 +642,38 @@ class VPCFlowLogsProcessor:
             logger.warning(f"未知文件格式: {file_key}")
             return 'unknown'
 
-    def process_text_file(self, bucket: str, key: str) -> pd.DataFrame:
+    def process_text_file(self, bucket: str, key: str,
+                          timings: Optional[Dict[str, float]] = None) -> pd.DataFrame:
         """
         处理 Text 格式的 VPC Flow Logs 文件
         
         Args:
             bucket: S3 存储桶名称
             key: S3 文件键
+            timings: 可选，用于记录各阶段耗时和对象大小
             
         Returns:
             处理后的 DataFrame
         """
         logger.info(f"处理 Text 格式文件: s3://{bucket}/{key}")
+        timings = {} if timings is None else timings
         
         try:
             # 下载并解压文件
+            started = time.perf_counter()
             response = self.s3.get_object(Bucket=bucket, Key=key)
+            body = response['Body'].read()
+            timings['s3_get'] = time.perf_counter() - started
+            timings['bytes'] = len(body)
             
-            with gzip.GzipFile(fileobj=response['Body']) as gz_file:
-                content = gz_file.read().decode('utf-8')
-            
-            # 解析每一行
-            lines = content.strip().split('\n')
-            data = []
-            
-            for line in lines:
-                if line.strip():
-                    fields = line.split(' ')
-                    # 确保字段数量正确
-                    if len(fields) >= len(self.flow_log_columns):
-                        data.append(fields[:len(self.flow_log_columns)])
-                    else:
-                        logger.warning(f"字段数量不足的行: {line[:100]}...")
-            
-            # 创建 DataFrame
-            df = pd.DataFrame(data, columns=self.flow_log_columns)
-            
-            # 数据类型转换
-            numeric_columns = ['version', 'srcport', 'dstport', 'protocol', 
-                             'packets', 'bytes', 'windowstart', 'windowend', 
-                             'tcp_flags', 'traffic_path']
+            started = time.perf_counter()
+            content = gzip.decompress(body)
+            del body
+            timings['decompress'] = time.perf_counter() - started
             
-            for col in numeric_columns:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
+            started = time.perf_counter()
+            df = self.build_frame(content)
+            timings['parse'] = time.perf_counter() - started
             
             logger.info(f"成功处理 {len(df)} 条记录")
             return df
@@ -122,23 +682,102 @@ class VPCFlowLogsProcessor:
             logger.error(f"处理 Text 文件失败: {e}")
             raise
 
-    def process_parquet_file(self, bucket: str, key: str) -> pd.DataFrame:
+    def build_frame(self, content: bytes) -> pd.DataFrame:
+        """
+        把解压后的 Text 格式内容解析为使用紧凑列类型的 DataFrame
+        
+        Args:
+            content: 解压后的文件内容
+            
+        Returns:
+            处理后的 DataFrame
+        """
+        def skip_invalid_row(row) -> str:
+            logger.warning(f"字段数量不匹配的行: {row.text[:100]}...")
+            return 'skip'
+        
+        # 字段拆分和类型转换由 pyarrow 一次完成，不再构造逐行的字符串列表
+        column_types = {col: self.ARROW_TYPES[self.column_dtypes.get(col, 'string')]
+                        for col in self.flow_log_columns}
+        read_options = pacsv.ReadOptions(
+            column_names=self.flow_log_columns,
+            skip_rows=1 if content.startswith(b'version ') else 0
+        )
+        parse_options = pacsv.ParseOptions(delimiter=' ', invalid_row_handler=skip_invalid_row)
+        
+        try:
+            table = pacsv.read_csv(
+                io.BytesIO(content),
+                read_options=read_options,
+                parse_options=parse_options,
+                convert_options=pacsv.ConvertOptions(
+                    column_types=column_types, null_values=['-'], strings_can_be_null=True
+                )
+            )
+        except pa.ArrowInvalid as e:
+            if 'Empty CSV file' in str(e):
+                return pd.DataFrame({
+                    col: pd.Series(dtype=self.column_dtypes.get(col, 'object'))
+                    for col in self.flow_log_columns
+                })
+            # 数值列中有无法解析的值: 按字符串读取后逐列转换，无效值记为缺失
+            logger.warning(f"按紧凑类型解析失败，回退为逐列转换: {e}")
+            table = pacsv.read_csv(
+                io.BytesIO(content),
+                read_options=read_options,
+                parse_options=parse_options,
+                convert_options=pacsv.ConvertOptions(
+                    column_types={col: pa.string() for col in self.flow_log_columns},
+                    null_values=['-'], strings_can_be_null=True
+                )
+            )
+            df = table.to_pandas()
+            for col, dtype in self.column_dtypes.items():
+                if dtype == 'category':
+                    df[col] = df[col].astype('category')
+                else:
+                    # 超出窄整数范围的值同样记为缺失，保持与正常路径一致的紧凑类型
+                    values = pd.to_numeric(df[col], errors='coerce')
+                    info = np.iinfo(dtype.lower())
+                    values = values.where((values >= info.min) & (values <= info.max))
+                    df[col] = values.round().astype(dtype)
+            return df
+        
+        return table.to_pandas(types_mapper=self.PANDAS_TYPES.get)
+
+    def process_parquet_file(self, bucket: str, key: str,
+                             timings: Optional[Dict[str, float]] = None) -> pd.DataFrame:
         """
         处理 Parquet 格式的 VPC Flow Logs 文件
         
         Args:
             bucket: S3 存储桶名称
             key: S3 文件键
+            timings: 可选，用于记录各阶段耗时和对象大小
             
         Returns:
             处理后的 DataFrame
         """
         logger.info(f"处理 Parquet 格式文件: s3://{bucket}/{key}")
+        timings = {} if timings is None else timings
         
         try:
-            # 直接从 S3 读取 Parquet 文件
-            s3_path = f"s3://{bucket}/{key}"
-            df = pd.read_parquet(s3_path)
+            # 通过 S3 客户端读取 Parquet 文件 (不依赖 s3fs)
+            started = time.perf_counter()
+            response = self.s3.get_object(Bucket=bucket, Key=key)
+            body = response['Body'].read()
+            timings['s3_get'] = time.perf_counter() - started
+            timings['bytes'] = len(body)
+            
+            started = time.perf_counter()
+            df = pd.read_parquet(io.BytesIO(body))
+            df = df.rename(columns=self.PARQUET_COLUMNS)
+            
+            # 字符串维度列转为 category 以降低内存占用
+            for col in df.columns:
+                if self.column_dtypes.get(col) == 'category':
+                    df[col] = df[col].astype('category')
+            timings['parse'] = time.perf_counter() - started
             
             logger.info(f"成功处理 {len(df)} 条记录")
             return df
@@ -160,28 +799,156 @@ class VPCFlowLogsProcessor:
         if df.empty:
             return {"error": "没有数据可分析"}
         
+        columns = set(df.columns)
+        value_columns = [col for col in ('bytes', 'packets') if col in columns]
+        
+        # 按 (action, protocol) 分组一次得到流数、字节数和数据包数，按动作的统计、
+        # 协议分布和总量都由这一次分组的结果汇总
+        keys = [col for col in ('action', 'protocol') if col in columns]
+        if keys:
+            grouped = df.groupby(keys, observed=True, dropna=False)
+            by_key = grouped[value_columns].sum()
+            by_key['flows'] = grouped.size()
+        else:
+            by_key = df[value_columns].sum().to_frame().T
+            by_key['flows'] = len(df)
+        
+        if 'action' in keys:
+            by_action = by_key.groupby(level='action', observed=True, dropna=False).sum()
+        else:
+            by_action = by_key.sum().to_frame().T
+        
+        protocols = {}
+        if 'protocol' in keys:
+            protocols = (by_key['flows'].groupby(level='protocol', observed=True).sum()
+                         .sort_values(ascending=False, kind='stable').to_dict())
+        
+        def action_flows(action: str) -> int:
+            return int(by_action['flows'].get(action, 0))
+        
+        time_columns = {col: agg for col, agg in (('windowstart', 'min'), ('windowend', 'max'))
+                        if col in columns}
+        time_range = df.agg(time_columns) if time_columns else {}
+        
         analysis = {
             "总记录数": len(df),
             "时间范围": {
-                "开始": df['windowstart'].min() if 'windowstart' in df.columns else None,
-                "结束": df['windowend'].max() if 'windowend' in df.columns else None
+                "开始": time_range.get('windowstart'),
+                "结束": time_range.get('windowend')
             },
             "流量统计": {
-                "总字节数": df['bytes'].sum() if 'bytes' in df.columns else 0,
-                "总数据包数": df['packets'].sum() if 'packets' in df.columns else 0,
-                "ACCEPT流量": len(df[df['action'] == 'ACCEPT']) if 'action' in df.columns else 0,
-                "REJECT流量": len(df[df['action'] == 'REJECT']) if 'action' in df.columns else 0
+                "总字节数": by_action['bytes'].sum() if 'bytes' in by_action else 0,
+                "总数据包数": by_action['packets'].sum() if 'packets' in by_action else 0,
+                "ACCEPT流量": action_flows('ACCEPT'),
+                "REJECT流量": action_flows('REJECT')
             },
-            "协议分布": df['protocol'].value_counts().to_dict() if 'protocol' in df.columns else {},
-            "热门源IP": df['srcaddr'].value_counts().head(5).to_dict() if 'srcaddr' in df.columns else {},
-            "热门目标IP": df['dstaddr'].value_counts().head(5).to_dict() if 'dstaddr' in df.columns else {}
+            "协议分布": protocols,
+            "热门源IP": df['srcaddr'].value_counts().head(5).to_dict() if 'srcaddr' in columns else {},
+            "热门目标IP": df['dstaddr'].value_counts().head(5).to_dict() if 'dstaddr' in columns else {}
         }
         
         return analysis
 
+    def process_s3_object(self, bucket: str, key: str) -> Optional[Dict]:
+        """
+        处理单个 S3 对象
+        
+        Args:
+            bucket: S3 存储桶名称
+            key: S3 文件键 (已解码)
+            
+        Returns:
+            处理结果，未知格式的文件返回 None
+        """
+        logger.info(f"处理文件: s3://{bucket}/{key}")
+        
+        # 检测文件格式
+        file_format = self.detect_file_format(key)
+        timings: Dict[str, float] = {}
+        
+        if file_format == 'text':
+            df = self.process_text_file(bucket, key, timings)
+        elif file_format == 'parquet':
+            df = self.process_parquet_file(bucket, key, timings)
+        else:
+            logger.warning(f"跳过未知格式文件: {key}")
+            return None
+        
+        # 分析数据
+        started = time.perf_counter()
+        analysis = self.analyze_flow_logs(df)
+        timings['analyze'] = time.perf_counter() - started
+        
+        result = {
+            "文件": f"s3://{bucket}/{key}",
+            "格式": file_format,
+            "分析结果": analysis,
+            "阶段耗时": timings
+        }
+        
+        # 时间桶汇总随结果返回，在轮询进程中合并到滚动窗口
+        if self.windows is not None:
+            result["窗口汇总"] = self.windows.summarize_frame(df)
+        
+        return result
+
+    def extract_s3_objects(self, message_body: str) -> List[Tuple[str, str, Optional[str]]]:
+        """
+        从 S3 事件通知消息中提取对象列表
+        
+        Args:
+            message_body: SQS 消息体
+            
+        Returns:
+            (bucket, key, 对象标识) 列表
+        """
+        # 解析 S3 事件通知
+        notification = json.loads(message_body)
+        
+        # 处理可能的 SNS 包装
+        if 'Message' in notification:
+            s3_event = json.loads(notification['Message'])
+        else:
+            s3_event = notification
+        
+        objects = []
+        for record in s3_event.get('Records', []):
+            if record.get('eventSource') == 'aws:s3':
+                bucket = record['s3']['bucket']['name']
+                key = unquote_plus(record['s3']['object']['key'])
+                objects.append((bucket, key, NotificationDeduplicator.record_identity(record)))
+        
+        return objects
+
+    def claim_object(self, bucket: str, key: str, identity: Optional[str]) -> bool:
+        """
+        检查对象是否需要处理，重复通知返回 False
+        
+        Args:
+            bucket: S3 存储桶名称
+            key: S3 文件键
+            identity: 对象标识
+        """
+        if self.deduplicator is None or identity is None:
+            return True
+        if self.deduplicator.claim(identity):
+            return True
+        logger.info(f"跳过重复通知: s3://{bucket}/{key}")
+        return False
+
+    def complete_object(self, identity: Optional[str]):
+        """对象处理成功后把去重租约改为完整的保留时间"""
+        if self.deduplicator is not None and identity is not None:
+            self.deduplicator.complete(identity)
+
+    def release_object(self, identity: Optional[str]):
+        """对象处理失败时撤销去重登记"""
+        if self.deduplicator is not None and identity is not None:
+            self.deduplicator.release(identity)
+
     def process_s3_notification(self, message_body: str) -> Optional[Dict]:
         """
-        处理 S3 事件通知消息
+        处理 S3 事件通知消息，失败时记录日志并返回 None
         
         Args:
             message_body: SQS 消息体
@@ -190,116 +957,656 @@ class VPCFlowLogsProcessor:
             处理结果或 None
         """
         try:
-            # 解析 S3 事件通知
-            notification = json.loads(message_body)
-            
-            # 处理可能的 SNS 包装
-            if 'Message' in notification:
-                s3_event = json.loads(notification['Message'])
-            else:
-                s3_event = notification
+            return self.process_notification(message_body)
+        except Exception as e:
+            logger.error(f"处理 S3 通知失败: {e}")
+            return None
+
+    def parse_notification(self, message_body: str) -> List[Tuple[str, str, Optional[str]]]:
+        """
+        提取消息中的 S3 对象，无法解析的消息重试也不会成功，记录日志后按空消息处理
+        
+        Args:
+            message_body: SQS 消息体
             
-            results = []
+        Returns:
+            (bucket, key, 对象标识) 列表
+        """
+        try:
+            return self.extract_s3_objects(message_body)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"无法解析的 S3 通知: {e}")
+            return []
+
+    def process_notification(self, message_body: str) -> List[Dict]:
+        """
+        处理 S3 事件通知消息，任一对象处理失败时抛出异常，消息需要重试
+        
+        Args:
+            message_body: SQS 消息体
             
-            # 处理每个 S3 记录
-            for record in s3_event.get('Records', []):
-                if record.get('eventSource') == 'aws:s3':
-                    bucket = record['s3']['bucket']['name']
-                    key = unquote_plus(record['s3']['object']['key'])
-                    
-                    logger.info(f"处理文件: s3://{bucket}/{key}")
-                    
-                    # 检测文件格式
-                    file_format = self.detect_file_format(key)
-                    
-                    if file_format == 'text':
-                        df = self.process_text_file(bucket, key)
-                    elif file_format == 'parquet':
-                        df = self.process_parquet_file(bucket, key)
-                    else:
-                        logger.warning(f"跳过未知格式文件: {key}")
-                        continue
-                    
-                    # 分析数据
-                    analysis = self.analyze_flow_logs(df)
-                    
-                    result = {
-                        "文件": f"s3://{bucket}/{key}",
-                        "格式": file_format,
-                        "分析结果": analysis
-                    }
-                    
-                    results.append(result)
+        Returns:
+            处理结果列表
+        """
+        results = []
+        
+        # 处理每个 S3 记录，重复通知直接跳过而不下载对象
+        for bucket, key, identity in self.parse_notification(message_body):
+            if not self.claim_object(bucket, key, identity):
+                continue
+            try:
+                result = self.process_s3_object(bucket, key)
+            except Exception:
+                self.release_object(identity)
+                raise
+            self.complete_object(identity)
+            if result:
+                results.append(result)
+        
+        return results
+
+    def process_message(self, message_body: str) -> List[Dict]:
+        """
+        处理单条 SQS 消息并记录处理结果，处理失败时抛出异常
+        
+        Args:
+            message_body: SQS 消息体
             
-            return results
+        Returns:
+            处理结果列表
+        """
+        results = self.process_notification(message_body)
+        self.collect_results(results)
+        return results
+
+    def collect_results(self, results: Optional[List[Dict]]):
+        """把时间桶汇总合并到滚动窗口，更新运行指标，并记录消息的处理结果"""
+        for result in results or []:
+            summary = result.pop("窗口汇总", None)
+            if summary is not None and self.windows is not None:
+                self.windows.merge(summary)
             
-        except Exception as e:
-            logger.error(f"处理 S3 通知失败: {e}")
-            return None
+            timings = result.pop("阶段耗时", {})
+            if self.metrics is not None:
+                self.metrics.inc('files_processed_total')
+                self.metrics.inc('records_processed_total', result['分析结果'].get('总记录数', 0))
+                self.metrics.inc('bytes_processed_total', timings.pop('bytes', 0))
+                for stage, seconds in timings.items():
+                    self.metrics.observe(stage, seconds)
+        self.log_results(results)
 
-    def poll_and_process(self, max_messages: int = 10, wait_time: int = 20):
+    def log_results(self, results: Optional[List[Dict]]):
+        """记录消息的处理结果"""
+        for result in results or []:
+            logger.info(f"处理完成: {result['文件']}")
+            logger.info(f"格式: {result['格式']}")
+            logger.info(f"记录数: {result['分析结果'].get('总记录数', 0)}")
+
+    def poll_and_process(self, max_messages: int = 10, wait_time: int = 20,
+                         receivers: int = 1, workers: int = 4,
+                         visibility_timeout: int = 300, queue_size: Optional[int] = None,
+                         processes: int = 0, max_processes: Optional[int] = None):
         """
         轮询 SQS 队列并处理消息
         
         Args:
             max_messages: 每次轮询的最大消息数
             wait_time: 长轮询等待时间（秒）
+            receivers: 并发接收线程数
+            workers: 处理线程数
+            visibility_timeout: 消息可见性超时（秒），需与队列配置一致
+            queue_size: 已接收但未处理完成的消息上限 (默认 workers 的 2 倍)
+            processes: worker 进程数，大于 0 时启用多进程模式
+            max_processes: 多进程模式下按队列积压自动扩缩容的进程数上限
         """
-        logger.info(f"开始轮询队列: {self.queue_url}")
+        common = dict(
+            receivers=receivers,
+            max_messages=max_messages,
+            wait_time=wait_time,
+            visibility_timeout=visibility_timeout,
+            queue_size=queue_size
+        )
         
-        while True:
+        if processes > 0:
+            poller = ProcessPoolSQSPoller(self, processes=processes, max_processes=max_processes, **common)
+        else:
+            poller = ConcurrentSQSPoller(self, workers=workers, **common)
+        poller.run()
+
+class _ResizableSlots:
+    """容量可调整的计数信号量，用于限制在途消息数"""
+    
+    def __init__(self, capacity: int):
+        self._cond = threading.Condition()
+        self._capacity = capacity
+        self._used = 0
+
+    def acquire(self, count: int, timeout: float) -> int:
+        """等待至少一个空闲槽位，返回实际占用的槽位数 (超时返回 0)"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._used < self._capacity, timeout):
+                return 0
+            granted = min(count, self._capacity - self._used)
+            self._used += granted
+            return granted
+
+    def release(self, count: int = 1):
+        with self._cond:
+            self._used -= count
+            self._cond.notify_all()
+
+    def resize(self, capacity: int):
+        with self._cond:
+            self._capacity = capacity
+            self._cond.notify_all()
+
+    @property
+    def used(self) -> int:
+        return self._used
+
+class ConcurrentSQSPoller:
+    """
+    流水线式并发 SQS 轮询器
+    
+    多个接收线程把消息放入有界工作队列，由 worker 线程池并发处理；
+    处理完成的消息通过 delete_message_batch 批量删除，心跳线程为仍在
+    队列中或处理中的消息调用 change_message_visibility 延长可见性超时，
+    避免大文件处理时间超过可见性超时而被重复消费。
+    """
+    
+    # 工作队列和删除队列的结束标记
+    _STOP = object()
+    
+    def __init__(self, processor: VPCFlowLogsProcessor, receivers: int = 1, workers: int = 4,
+                 max_messages: int = 10, wait_time: int = 20, visibility_timeout: int = 300,
+                 queue_size: Optional[int] = None, heartbeat_interval: Optional[float] = None,
+                 delete_batch_size: int = 10, delete_flush_interval: float = 1.0):
+        """
+        初始化并发轮询器
+        
+        Args:
+            processor: 负责处理单条消息的 VPCFlowLogsProcessor
+            receivers: 并发接收线程数
+            workers: 处理线程数
+            max_messages: 每次 receive_message 的最大消息数 (SQS 上限 10)
+            wait_time: 长轮询等待时间（秒）
+            visibility_timeout: 接收及续期时使用的可见性超时（秒）
+            queue_size: 已接收但未处理完成的消息上限，用于反压
+            heartbeat_interval: 心跳检查间隔（秒），默认为可见性超时的 1/3
+            delete_batch_size: 批量删除的最大条数 (SQS 上限 10)
+            delete_flush_interval: 未凑满一批时的最长等待时间（秒）
+        """
+        self.processor = processor
+        self.sqs = processor.sqs
+        self.queue_url = processor.queue_url
+        self.receivers = max(1, receivers)
+        self.workers = max(1, workers)
+        self.max_messages = min(max(1, max_messages), 10)
+        self.wait_time = wait_time
+        self.visibility_timeout = visibility_timeout
+        self.queue_size = max(queue_size or self.workers * 2, self.workers)
+        self.heartbeat_interval = heartbeat_interval or self.default_heartbeat_interval(visibility_timeout)
+        self.delete_batch_size = min(max(1, delete_batch_size), 10)
+        self.delete_flush_interval = delete_flush_interval
+        
+        # 反压: 每条已接收但未处理完成的消息占用一个槽位
+        self._slots = _ResizableSlots(self.queue_size)
+        self._work = queue.Queue()
+        self._deletes = queue.Queue()
+        
+        # 在途消息: receipt_handle -> {'message_id', 'receive_count', 'received_at', 'visible_until'}
+        self._inflight: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        
+        self._stopping = threading.Event()
+        self._heartbeat_stop = threading.Event()
+        self._threads: Dict[str, List[threading.Thread]] = {}
+        
+        # 去重缓存可能被多个轮询器共享，这里只检查租约是否与心跳匹配，不修改
+        deduplicator = processor.deduplicator
+        if deduplicator is not None and not self.heartbeat_interval < deduplicator.lease <= 2 * self.heartbeat_interval:
+            logger.warning(f"去重租约 {deduplicator.lease:g} 秒与心跳间隔 {self.heartbeat_interval:g} 秒不匹配，"
+                           f"建议使用 {self.dedup_lease(visibility_timeout, heartbeat_interval):g} 秒")
+        
+        self.stats = {'received': 0, 'processed': 0, 'failed': 0, 'deleted': 0, 'extended': 0}
+        self.metrics = processor.metrics
+        if self.metrics is not None:
+            self.metrics.gauge('inflight_messages', '已接收但未处理完成的消息数',
+                               lambda: len(self._inflight))
+            self.metrics.gauge('oldest_inflight_age_seconds', '最早在途消息的已接收时长',
+                               self._oldest_inflight_age)
+            if processor.deduplicator is not None:
+                self.metrics.gauge('dedup_hit_ratio', '重复通知去重缓存命中率',
+                                   lambda: processor.deduplicator.stats()['hit_rate'])
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            self.stats[name] += value
+        if self.metrics is not None:
+            self.metrics.inc(f'messages_{name}_total', value)
+
+    def _oldest_inflight_age(self) -> float:
+        with self._lock:
+            oldest = min((info['received_at'] for info in self._inflight.values()), default=None)
+        return 0.0 if oldest is None else time.monotonic() - oldest
+
+    @staticmethod
+    def default_heartbeat_interval(visibility_timeout: float) -> float:
+        return max(1.0, visibility_timeout / 3)
+
+    @classmethod
+    def dedup_lease(cls, visibility_timeout: float, heartbeat_interval: Optional[float] = None) -> float:
+        """
+        与心跳匹配的去重租约时长，创建 NotificationDeduplicator 时传入
+        
+        租约随心跳续期，需长于心跳间隔；并短于心跳时消息剩余的可见性超时 (至少 2 个心跳间隔)，
+        进程崩溃后租约先于消息重新投递过期。
+        """
+        return 1.5 * (heartbeat_interval or cls.default_heartbeat_interval(visibility_timeout))
+
+    def start(self):
+        """启动接收、处理、删除和心跳线程"""
+        logger.info(f"开始轮询队列: {self.queue_url} "
+                    f"(接收线程 {self.receivers}, 处理线程 {self.workers}, 队列上限 {self.queue_size})")
+        
+        def spawn(name: str, target, count: int = 1) -> List[threading.Thread]:
+            threads = []
+            for i in range(count):
+                thread = threading.Thread(target=target, name=f"{name}-{i}")
+                thread.start()
+                threads.append(thread)
+            return threads
+        
+        self._threads = {
+            'receiver': spawn('sqs-receiver', self._receive_loop, self.receivers),
+            'worker': spawn('sqs-worker', self._worker_loop, self.workers),
+            'deleter': spawn('sqs-deleter', self._delete_loop),
+            'heartbeat': spawn('sqs-heartbeat', self._heartbeat_loop),
+        }
+
+    def stop(self):
+        """停止接收新消息，已接收的消息会继续处理完成"""
+        self._stopping.set()
+
+    def join(self):
+        """等待队列排空并关闭所有线程"""
+        # 接收线程最多在一次长轮询后退出
+        for thread in self._threads.get('receiver', []):
+            thread.join()
+        
+        # 结束标记排在已接收消息之后，worker 会先处理完队列中的消息
+        for _ in self._threads.get('worker', []):
+            self._work.put(self._STOP)
+        for thread in self._threads.get('worker', []):
+            thread.join()
+        
+        self._heartbeat_stop.set()
+        self._deletes.put(self._STOP)
+        for name in ('deleter', 'heartbeat'):
+            for thread in self._threads.get(name, []):
+                thread.join()
+        
+        logger.info(f"轮询器已停止: {self.stats}")
+        if self.processor.deduplicator is not None:
+            logger.info(f"去重缓存: {self.processor.deduplicator.stats()}")
+
+    def run(self):
+        """启动轮询器并阻塞，直到收到中断信号后优雅关闭"""
+        self.start()
+        try:
+            while not self._stopping.wait(1):
+                pass
+        except KeyboardInterrupt:
+            logger.info("收到中断信号，停止接收并排空队列")
+        self.stop()
+        self.join()
+
+    def _receive_loop(self):
+        while not self._stopping.is_set():
+            # 先占用槽位再接收，避免消息在本地队列中空等而耗尽可见性超时
+            granted = self._slots.acquire(self.max_messages, timeout=0.5)
+            if not granted:
+                continue
+            
             try:
-                # 接收消息
+                started = time.perf_counter()
                 response = self.sqs.receive_message(
                     QueueUrl=self.queue_url,
-                    MaxNumberOfMessages=max_messages,
-                    WaitTimeSeconds=wait_time,
+                    MaxNumberOfMessages=granted,
+                    WaitTimeSeconds=self.wait_time,
+                    VisibilityTimeout=self.visibility_timeout,
+                    AttributeNames=['ApproximateReceiveCount'],
                     MessageAttributeNames=['All']
                 )
-                
-                messages = response.get('Messages', [])
-                
-                if not messages:
-                    logger.info("没有新消息，继续轮询...")
-                    continue
-                
-                logger.info(f"收到 {len(messages)} 条消息")
-                
-                # 处理每条消息
-                for message in messages:
-                    receipt_handle = message['ReceiptHandle']
-                    message_body = message['Body']
-                    
-                    try:
-                        # 处理 S3 通知
-                        results = self.process_s3_notification(message_body)
-                        
-                        if results:
-                            for result in results:
-                                logger.info(f"处理完成: {result['文件']}")
-                                logger.info(f"格式: {result['格式']}")
-                                logger.info(f"记录数: {result['分析结果'].get('总记录数', 0)}")
-                        
-                        # 删除已处理的消息
-                        self.sqs.delete_message(
-                            QueueUrl=self.queue_url,
-                            ReceiptHandle=receipt_handle
-                        )
-                        
-                        logger.info("消息处理完成并已删除")
-                        
-                    except Exception as e:
-                        logger.error(f"处理消息失败: {e}")
-                        # 消息会返回队列等待重试
-                
-            except KeyboardInterrupt:
-                logger.info("收到中断信号，停止处理")
-                break
+                if self.metrics is not None:
+                    self.metrics.observe('receive', time.perf_counter() - started)
             except Exception as e:
                 logger.error(f"轮询失败: {e}")
+                self._slots.release(granted)
                 # 短暂等待后继续
-                import time
-                time.sleep(5)
+                self._stopping.wait(5)
+                continue
+            
+            messages = response.get('Messages', [])
+            if len(messages) < granted:
+                self._slots.release(granted - len(messages))
+            
+            if not messages:
+                logger.info("没有新消息，继续轮询...")
+                continue
+            
+            logger.info(f"收到 {len(messages)} 条消息")
+            self._count('received', len(messages))
+            
+            now = time.monotonic()
+            with self._lock:
+                for message in messages:
+                    self._inflight[message['ReceiptHandle']] = {
+                        'message_id': message.get('MessageId'),
+                        'receive_count': int(message.get('Attributes', {}).get('ApproximateReceiveCount', 1)),
+                        'received_at': now,
+                        'visible_until': now + self.visibility_timeout,
+                    }
+            for message in messages:
+                self._work.put(message)
+
+    def _worker_loop(self):
+        while True:
+            message = self._work.get()
+            if message is self._STOP:
+                break
+            
+            receipt_handle = message['ReceiptHandle']
+            try:
+                # 处理 S3 通知
+                self.handle_message(message['Body'])
+            except Exception as e:
+                logger.error(f"处理消息失败: {e}")
+                self._count('failed')
+                self.on_failure(receipt_handle, e)
+            else:
+                self._count('processed')
+                self._deletes.put(receipt_handle)
+            finally:
+                self._slots.release()
+
+    def handle_message(self, message_body: str):
+        """处理单条消息，抛出异常表示消息需要重试"""
+        self.processor.process_message(message_body)
+
+    def on_failure(self, receipt_handle: str, error: Exception):
+        """消息处理失败: 停止续期，消息会在可见性超时后返回队列等待重试"""
+        with self._lock:
+            self._inflight.pop(receipt_handle, None)
+
+    def _delete_loop(self):
+        pending: List[str] = []
+        stopping = False
+        
+        while not stopping:
+            try:
+                item = self._deletes.get(timeout=self.delete_flush_interval)
+            except queue.Empty:
+                item = None
+            
+            if item is self._STOP:
+                stopping = True
+            elif item is not None:
+                pending.append(item)
+                if len(pending) < self.delete_batch_size:
+                    continue
+            
+            while pending:
+                batch, pending = pending[:self.delete_batch_size], pending[self.delete_batch_size:]
+                self._delete_batch(batch)
+
+    def _delete_batch(self, receipt_handles: List[str]):
+        """批量删除已处理的消息"""
+        entries = [{'Id': str(i), 'ReceiptHandle': handle} for i, handle in enumerate(receipt_handles)]
+        
+        try:
+            started = time.perf_counter()
+            response = self.sqs.delete_message_batch(QueueUrl=self.queue_url, Entries=entries)
+            if self.metrics is not None:
+                self.metrics.observe('delete', time.perf_counter() - started)
+        except Exception as e:
+            logger.error(f"批量删除消息失败: {e}")
+            response = {'Failed': [{'Id': entry['Id'], 'Message': str(e)} for entry in entries]}
+        
+        failed = response.get('Failed', [])
+        for entry in failed:
+            logger.error(f"删除消息失败: {entry.get('Message', entry.get('Code'))}")
+        
+        deleted = len(entries) - len(failed)
+        if deleted:
+            logger.info(f"已批量删除 {deleted} 条消息")
+            self._count('deleted', deleted)
+        
+        # 删除失败的消息不再续期，超时后会被重新投递
+        with self._lock:
+            for handle in receipt_handles:
+                self._inflight.pop(handle, None)
+
+    def _heartbeat_loop(self):
+        while not self._heartbeat_stop.wait(self.heartbeat_interval):
+            if self.processor.deduplicator is not None:
+                try:
+                    self.processor.deduplicator.extend()
+                except Exception as e:
+                    logger.warning(f"去重租约续期失败: {e}")
+            
+            now = time.monotonic()
+            with self._lock:
+                due = [handle for handle, info in self._inflight.items()
+                       if info['visible_until'] - now < 2 * self.heartbeat_interval]
+            
+            for handle in due:
+                try:
+                    self.sqs.change_message_visibility(
+                        QueueUrl=self.queue_url,
+                        ReceiptHandle=handle,
+                        VisibilityTimeout=self.visibility_timeout
+                    )
+                except Exception as e:
+                    logger.warning(f"延长消息可见性失败: {e}")
+                    continue
+                
+                self._count('extended')
+                with self._lock:
+                    if handle in self._inflight:
+                        self._inflight[handle]['visible_until'] = now + self.visibility_timeout
+
+# 子进程内的处理器实例，由进程池 initializer 创建 (boto3 客户端不能跨进程传递)
+_worker_processor: Optional[VPCFlowLogsProcessor] = None
+
+def _init_worker_process(processor_factory: Callable[[], VPCFlowLogsProcessor]):
+    global _worker_processor
+    _worker_processor = processor_factory()
+
+def _process_object_in_worker(bucket: str, key: str) -> Optional[Dict]:
+    """在 worker 进程中下载、解析并分析单个对象，只返回精简的分析结果"""
+    return _worker_processor.process_s3_object(bucket, key)
+
+class ProcessPoolSQSPoller(ConcurrentSQSPoller):
+    """
+    多进程 SQS 轮询器
+    
+    父进程负责 SQS 接收、删除和可见性续期，把 (bucket, key) 交给进程池，
+    worker 进程完成解析和分析这类受 GIL 限制的 CPU 密集工作并只返回分析结果。
+    worker 进程崩溃时进程池会被重建，受影响的消息按接收次数指数退避后返回
+    队列重试，导致崩溃的消息不会反复立即重试而使进程池持续重建。
+    """
+    
+    def __init__(self, processor: VPCFlowLogsProcessor, processes: int = 4,
+                 max_processes: Optional[int] = None, messages_per_process: int = 20,
+                 scale_interval: float = 30, queue_size: Optional[int] = None,
+                 processor_factory: Optional[Callable[[], VPCFlowLogsProcessor]] = None,
+                 mp_context: str = 'spawn', crash_retry_delay: float = 5, **kwargs):
+        """
+        初始化多进程轮询器
+        
+        Args:
+            processor: 父进程使用的处理器 (提供 SQS 客户端和通知解析)
+            processes: 初始 worker 进程数
+            max_processes: 自动扩缩容的进程数上限，为空时进程数固定
+            messages_per_process: 自动扩缩容时每个进程对应的队列积压消息数
+            scale_interval: 自动扩缩容检查间隔（秒）
+            queue_size: 在途消息上限，默认随进程数取其 2 倍
+            processor_factory: 在 worker 进程中创建处理器的可 pickle 函数
+            mp_context: multiprocessing 启动方式
+            crash_retry_delay: worker 进程崩溃后消息首次重试的延迟（秒），按接收次数翻倍，
+                               不超过可见性超时
+            **kwargs: 传给 ConcurrentSQSPoller 的其他参数
+        """
+        self.processes = max(1, processes)
+        self.min_processes = self.processes
+        self.max_processes = max(max_processes or self.processes, self.processes)
+        self.messages_per_process = max(1, messages_per_process)
+        self.scale_interval = scale_interval
+        self._fixed_queue_size = queue_size
+        self.crash_retry_delay = crash_retry_delay
+        
+        # 分发线程只等待子进程结果，数量按在途消息上限分配
+        super().__init__(
+            processor,
+            workers=queue_size or self.max_processes * 2,
+            queue_size=queue_size or self.processes * 2,
+            **kwargs
+        )
+        self.queue_size = queue_size or self.processes * 2
+        self._slots.resize(self.queue_size)
+        
+        self.processor_factory = processor_factory or functools.partial(
+            VPCFlowLogsProcessor, processor.queue_url, processor.region, windows=processor.windows
+        )
+        self._mp_context = multiprocessing.get_context(mp_context)
+        self._pool_lock = threading.Lock()
+        self._pool = self._new_pool(self.processes)
+
+    def _new_pool(self, processes: int) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=self._mp_context,
+            initializer=_init_worker_process,
+            initargs=(self.processor_factory,)
+        )
+
+    def _replace_pool(self, broken: ProcessPoolExecutor):
+        """进程池损坏后重建 (多个线程同时发现时只重建一次)"""
+        with self._pool_lock:
+            if self._pool is not broken:
+                return
+            logger.warning("worker 进程异常退出，重建进程池")
+            self._pool = self._new_pool(self.processes)
+        broken.shutdown(wait=False)
+
+    def _resize_pool(self, processes: int):
+        with self._pool_lock:
+            old_pool = self._pool
+            self._pool = self._new_pool(processes)
+            self.processes = processes
+        if self._fixed_queue_size is None:
+            self._slots.resize(processes * 2)
+        # 旧进程池处理完已提交的任务后退出
+        old_pool.shutdown(wait=False)
+
+    def start(self):
+        super().start()
+        if self.max_processes > self.min_processes:
+            thread = threading.Thread(target=self._autoscale_loop, name='sqs-autoscaler')
+            thread.start()
+            self._threads['autoscaler'] = [thread]
+
+    def join(self):
+        super().join()
+        for thread in self._threads.get('autoscaler', []):
+            thread.join()
+        self._pool.shutdown(wait=True)
+
+    def handle_message(self, message_body: str):
+        objects = self.processor.parse_notification(message_body)
+        
+        pool = None
+        pending = set()
+        try:
+            # 重复通知不提交给进程池
+            claimed = []
+            for bucket, key, identity in objects:
+                if self.processor.claim_object(bucket, key, identity):
+                    pending.add(identity)
+                    claimed.append((bucket, key, identity))
+            
+            # 持锁提交，避免扩缩容在取得进程池和提交之间把它关闭
+            with self._pool_lock:
+                pool = self._pool
+                futures = [((bucket, key, identity), pool.submit(_process_object_in_worker, bucket, key))
+                           for bucket, key, identity in claimed]
+            
+            # 等待所有对象完成，已成功的对象保留登记，任一对象失败时消息整体重试
+            results = []
+            error = None
+            for (bucket, key, identity), future in futures:
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    logger.error(f"处理文件失败 s3://{bucket}/{key}: {e}")
+                    error = error or e
+                    continue
+                pending.discard(identity)
+                self.processor.complete_object(identity)
+                if result:
+                    results.append(result)
+            if error is not None:
+                raise error
+        except BaseException as e:
+            # 消息会返回队列重试，未完成对象的登记需要撤销
+            for identity in pending:
+                self.processor.release_object(identity)
+            if isinstance(e, BrokenProcessPool):
+                self._replace_pool(pool)
+            raise
+        
+        self.processor.collect_results(results)
+
+    def on_failure(self, receipt_handle: str, error: Exception):
+        with self._lock:
+            info = self._inflight.get(receipt_handle, {})
+        super().on_failure(receipt_handle, error)
+        if not isinstance(error, BrokenProcessPool):
+            return
+        
+        # 崩溃进程上的消息提前返回队列，延迟按接收次数翻倍，
+        # 反复导致崩溃的消息最终按正常的可见性超时重试
+        receive_count = info.get('receive_count', 1)
+        delay = min(self.visibility_timeout, self.crash_retry_delay * 2 ** (receive_count - 1))
+        try:
+            self.sqs.change_message_visibility(
+                QueueUrl=self.queue_url,
+                ReceiptHandle=receipt_handle,
+                VisibilityTimeout=int(delay)
+            )
+        except Exception as e:
+            logger.warning(f"释放消息失败: {e}")
+
+    def _autoscale_loop(self):
+        while not self._stopping.wait(self.scale_interval):
+            try:
+                response = self.sqs.get_queue_attributes(
+                    QueueUrl=self.queue_url,
+                    AttributeNames=['ApproximateNumberOfMessages']
+                )
+                backlog = int(response['Attributes'].get('ApproximateNumberOfMessages', 0))
+            except Exception as e:
+                logger.warning(f"获取队列积压失败: {e}")
+                continue
+            
+            target = math.ceil(backlog / self.messages_per_process)
+            target = min(self.max_processes, max(self.min_processes, target))
+            if target != self.processes:
+                logger.info(f"调整 worker 进程数: {self.processes} -> {target} (队列积压 {backlog})")
+                self._resize_pool(target)
 
 def main():
     parser = argparse.ArgumentParser(description='VPC Flow Logs SQS 消息处理器')
@@ -307,18 +1614,65 @@ def main():
     parser.add_argument('--region', help='AWS 区域')
     parser.add_argument('--max-messages', type=int, default=10, help='每次轮询的最大消息数')
     parser.add_argument('--wait-time', type=int, default=20, help='长轮询等待时间（秒）')
+    parser.add_argument('--receivers', type=int, default=1, help='并发接收线程数')
+    parser.add_argument('--workers', type=int, default=4, help='处理线程数')
+    parser.add_argument('--visibility-timeout', type=int, default=300, help='消息可见性超时（秒），需与队列配置一致')
+    parser.add_argument('--queue-size', type=int, help='已接收但未处理完成的消息上限 (默认 workers 的 2 倍)')
+    parser.add_argument('--processes', type=int, default=0, help='worker 进程数，大于 0 时启用多进程模式')
+    parser.add_argument('--max-processes', type=int, help='按队列积压自动扩缩容的进程数上限')
+    parser.add_argument('--dedup-cache-size', type=int, default=100000, help='重复通知去重缓存条目数 (0 表示关闭)')
+    parser.add_argument('--dedup-db', help='去重缓存的 SQLite 持久化文件路径')
+    parser.add_argument('--dedup-ttl', type=int, default=86400, help='去重标识保留时间（秒）')
+    parser.add_argument('--window-output', help='滚动窗口快照输出文件')
+    parser.add_argument('--window-url', help='滚动窗口快照 POST 地址')
+    parser.add_argument('--windows', default='60,300,3600', help='滚动窗口长度列表（秒，逗号分隔）')
+    parser.add_argument('--window-bucket', type=int, default=10, help='窗口时间桶宽度（秒）')
+    parser.add_argument('--window-top-k', type=int, default=10, help='窗口快照中的热门源地址数量')
+    parser.add_argument('--window-interval', type=float, default=30, help='窗口快照输出间隔（秒）')
+    parser.add_argument('--metrics-port', type=int, help='Prometheus 指标 HTTP 端口 (默认不启动)')
+    parser.add_argument('--metrics-host', default='0.0.0.0', help='Prometheus 指标监听地址')
     
     args = parser.parse_args()
     
     # 创建处理器
-    processor = VPCFlowLogsProcessor(args.queue_url, args.region)
+    deduplicator = None
+    if args.dedup_cache_size > 0:
+        deduplicator = NotificationDeduplicator(args.dedup_cache_size, args.dedup_ttl, args.dedup_db,
+                                                lease=ConcurrentSQSPoller.dedup_lease(args.visibility_timeout))
+    windows = None
+    if args.window_output or args.window_url:
+        windows = SlidingWindowAggregator(
+            tuple(int(w) for w in args.windows.split(',')), args.window_bucket, args.window_top_k
+        )
+        windows.start_emitting(args.window_interval, args.window_output, args.window_url)
+    metrics = None
+    if args.metrics_port is not None:
+        metrics = PollerMetrics()
+        metrics.serve(args.metrics_port, args.metrics_host)
+    processor = VPCFlowLogsProcessor(
+        args.queue_url, args.region, deduplicator=deduplicator, windows=windows, metrics=metrics
+    )
     
     # 开始处理
     try:
-        processor.poll_and_process(args.max_messages, args.wait_time)
+        processor.poll_and_process(
+            args.max_messages,
+            args.wait_time,
+            receivers=args.receivers,
+            workers=args.workers,
+            visibility_timeout=args.visibility_timeout,
+            queue_size=args.queue_size,
+            processes=args.processes,
+            max_processes=args.max_processes
+        )
     except Exception as e:
         logger.error(f"处理器启动失败: {e}")
         return 1
+    finally:
+        if windows is not None:
+            windows.stop_emitting()
+        if metrics is not None:
+            metrics.shutdown()
     
     return 0
 
@@ -0,0 +1,300 @@
+"""
+flow-log-parser.py 各模式的行为测试
+
+运行方法:
+    python3 -m pytest -q vpcflowlog-deployment/tests
+"""
+
+import os
+import sys
+import gzip
+import zlib
+import argparse
+import importlib.util
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pytest
+
+TOOLS_DIR = Path(__file__).resolve().parent.parent / 'tools'
+HEADER = ('version account-id interface-id srcaddr dstaddr srcport dstport protocol packets bytes start end '
+          'action log-status vpc-id subnet-id instance-id tcp-flags type pkt-srcaddr pkt-dstaddr region az-id '
+          'sublocation-type sublocation-id pkt-src-aws-service pkt-dst-aws-service flow-direction traffic-path')
+HOUR_10 = 1705312800  # 2024-01-15T10:00:00Z
+
+def _load_parser():
+    if 'flow_log_parser' in sys.modules:
+        return sys.modules['flow_log_parser']
+    spec = importlib.util.spec_from_file_location('flow_log_parser', TOOLS_DIR / 'flow-log-parser.py')
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['flow_log_parser'] = module
+    spec.loader.exec_module(module)
+    return module
+
+flp = _load_parser()
+
+def flow_line(start: int, src: str = '10.0.0.1', dst: str = '10.0.0.2', srcport: int = 40000, dstport: int = 443,
+              nbytes: int = 1000, packets: int = 10, action: str = 'ACCEPT', direction: str = 'egress',
+              eni: str = 'eni-00000001') -> str:
+    return (f"5 123456789012 {eni} {src} {dst} {srcport} {dstport} 6 {packets} {nbytes} {start} {start + 30} "
+            f"{action} OK vpc-0123 subnet-1 i-00000001 2 IPv4 {src} {dst} us-east-1 use1-az1 - - - - "
+            f"{direction} 1")
+
+def write_log(path: Path, lines) -> str:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write(HEADER + '\n' + '\n'.join(lines) + '\n')
+    return str(path)
+
+def hour_rows(output: Path) -> dict:
+    table = ds.dataset(str(output), format='parquet', partitioning='hive').to_table(columns=['hour'])
+    hours = table.column('hour').to_pylist()
+    return {hour: hours.count(hour) for hour in set(hours)}
+
+def compact(output: Path, *files: str) -> dict:
+    compactor = flp.FlowLogCompactor(flp.FlowLogParser(), str(output), memory_rows=100)
+    for file_path in files:
+        compactor.add_file(file_path)
+    return compactor.finish()
+
+def test_compaction_merges_late_rows_and_is_idempotent(tmp_path):
+    output = tmp_path / 'compacted'
+    hour_10 = write_log(tmp_path / 'raw/hour=10/a.log.gz',
+                        [flow_line(HOUR_10 + i * 10, srcport=10000 + i) for i in range(350)])
+    # 11 点投递的文件中有一条开始时间落在 10 点的延迟记录
+    hour_11 = write_log(tmp_path / 'raw/hour=11/b.log.gz',
+                        [flow_line(HOUR_10 + 3599, srcport=9999)]
+                        + [flow_line(HOUR_10 + 3600 + i * 10, srcport=20000 + i) for i in range(200)])
+
+    compact(output, hour_10)
+    assert hour_rows(output) == {10: 350}
+
+    summary = compact(output, hour_11)
+    assert hour_rows(output) == {10: 351, 11: 200}
+    assert summary['rows'] == 201
+
+    # 重复合并同样的输入不会重复累积
+    summary = compact(output, hour_10, hour_11)
+    assert hour_rows(output) == {10: 351, 11: 200}
+    assert summary['rows'] == 0
+    assert summary['duplicate_rows'] == 551
+
+def corrupt_gzip(path: Path) -> str:
+    """deflate 数据中间损坏的 gzip 文件 (解压时抛出 zlib.error 而不是 OSError)"""
+    lines = [flow_line(HOUR_10 + i, srcport=10000 + i * 7 % 50000, nbytes=i * 131 % 99991) for i in range(5000)]
+    data = bytearray(gzip.compress((HEADER + '\n' + '\n'.join(lines) + '\n').encode(), mtime=0))
+    data[100:116] = b'\xff' * 16
+    path.write_bytes(bytes(data))
+    with pytest.raises(zlib.error), gzip.open(path, 'rb') as f:
+        f.read()
+    return str(path)
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_validation_records_corrupt_gzip(tmp_path, workers):
+    good = write_log(tmp_path / 'logs/a.log.gz', [flow_line(HOUR_10 + i) for i in range(10)])
+    bad = corrupt_gzip(tmp_path / 'logs/b.log.gz')
+    args = argparse.Namespace(local_file=None, local_dir=str(tmp_path / 'logs'), s3_file=None, s3_prefix=None,
+                              samples=3, workers=workers, output=None)
+
+    report = flp.run_validation(args, None).to_dict()
+
+    assert report['files'] == 2
+    assert report['errors']['corrupt_file'] == 1
+    assert list(report['invalid_files']) == [bad]
+    assert good not in report['invalid_files']
+
+def parse_table(file_path: str, workers: int = 1, chunk_bytes: int = 16 * 1024) -> pa.Table:
+    parser = flp.FlowLogParser()
+    parser.parse_workers = workers
+    parser.chunk_bytes = chunk_bytes
+    return pa.Table.from_batches(list(parser.iter_batches(file_path)), schema=flp.FlowLogParser.ARROW_SCHEMA)
+
+def test_parallel_parse_matches_serial(tmp_path):
+    lines = [flow_line(HOUR_10 + i, srcport=1024 + i, nbytes=i * 37) for i in range(3000)]
+    lines[1234] = 'broken line'
+    file_path = write_log(tmp_path / 'large.log.gz', lines)
+
+    serial = parse_table(file_path)
+    parallel = parse_table(file_path, workers=2)
+
+    assert serial.num_rows == 2999
+    assert parallel.equals(serial)
+
+def test_single_chunk_is_read_from_its_own_segment(tmp_path):
+    # 唯一的分块恰好填满第一个段，之后换出的新段是空的
+    line = flow_line(HOUR_10)
+    line += ' ' * (-(len(line) + 1) % flp.FlowLogParser.SEGMENT_CHUNKS)
+    file_path = tmp_path / 'single.log'
+    file_path.write_text(line + '\n')
+    chunk_bytes = (len(line) + 1) // flp.FlowLogParser.SEGMENT_CHUNKS
+
+    table = parse_table(str(file_path), workers=2, chunk_bytes=chunk_bytes)
+
+    assert table.equals(parse_table(str(file_path)))
+    assert table.column('start').to_pylist() == [HOUR_10]
+
+def test_cache_detects_rewrite_within_same_second(tmp_path):
+    file_path = write_log(tmp_path / 'logs/a.log.gz', [flow_line(HOUR_10, nbytes=1111)])
+    args = argparse.Namespace(local_file=file_path, local_dir=None, s3_file=None, s3_prefix=None,
+                              cache_dir=str(tmp_path / 'cache'), limit=None)
+    parser = flp.FlowLogParser()
+    mtime_ns = HOUR_10 * 10**9 + 100
+
+    os.utime(file_path, ns=(mtime_ns, mtime_ns))
+    size = os.path.getsize(file_path)
+    assert flp.load_cached_inputs(args, parser).column('bytes').to_pylist() == [1111]
+
+    # 同样大小、同一秒内改写的文件不能命中旧缓存
+    write_log(Path(file_path), [flow_line(HOUR_10, nbytes=2222)])
+    os.utime(file_path, ns=(mtime_ns + 500, mtime_ns + 500))
+    assert os.path.getsize(file_path) == size
+    assert flp.load_cached_inputs(args, parser).column('bytes').to_pylist() == [2222]
+    assert flp.load_cached_inputs(args, parser).column('bytes').to_pylist() == [2222]
+
+def sample_logs(tmp_path: Path) -> list:
+    files = []
+    for index in range(20):
+        lines = [flow_line(HOUR_10 + i, nbytes=100 + index * 10 + i % 7, action='REJECT' if i % 5 == 0 else 'ACCEPT')
+                 for i in range(200 + index * 5)]
+        files.append(write_log(tmp_path / f'logs/{index:02d}.log.gz', lines))
+    return files
+
+def test_sampling_without_subsampling_is_exact(tmp_path):
+    files = sample_logs(tmp_path)
+    sampler = flp.FlowLogSampler(flp.FlowLogParser(), object_fraction=1.0, seed=1)
+    for file_path in sampler.choose_objects(files):
+        sampler.add_file(file_path)
+
+    records = sampler.generate_stats()['total_records']
+    assert records == {'estimate': 4950, 'low': 4950, 'high': 4950}
+
+@pytest.mark.parametrize('options', [{'row_fraction': 0.3}, {'reservoir': 50}])
+def test_sampling_confidence_interval_covers_truth(tmp_path, options):
+    files = sample_logs(tmp_path)
+    truth = {'records': 4950, 'rejected': 990}
+    truth['bytes'] = sum(100 + index * 10 + i % 7 for index in range(20) for i in range(200 + index * 5))
+
+    sampler = flp.FlowLogSampler(flp.FlowLogParser(), object_fraction=0.5, seed=7, confidence=0.99, **options)
+    for file_path in sampler.choose_objects(files):
+        sampler.add_file(file_path)
+    stats = sampler.generate_stats()
+
+    for name, value in (('records', stats['total_records']), ('rejected', stats['action_breakdown']['REJECT']),
+                        ('bytes', stats['traffic_summary']['total_bytes'])):
+        assert value['low'] <= truth[name] <= value['high'], name
+        assert value['low'] < value['high']
+
+@pytest.mark.parametrize('value', ['0', '1', '1.5', '-0.1', 'abc'])
+def test_confidence_must_be_in_open_interval(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        flp.confidence_arg(value)
+    assert flp.confidence_arg('0.9') == 0.9
+
+def test_conversations_count_each_flow_once_across_enis(tmp_path):
+    client, server = dict(src='10.0.0.1', dst='10.0.0.2', srcport=40000, dstport=443), \
+        dict(src='10.0.0.2', dst='10.0.0.1', srcport=443, dstport=40000)
+    # 两端的 ENI 各记录一次两个方向的流量
+    lines = [
+        flow_line(HOUR_10, nbytes=100, packets=2, direction='egress', eni='eni-client', **client),
+        flow_line(HOUR_10, nbytes=100, packets=2, direction='ingress', eni='eni-server', **client),
+        flow_line(HOUR_10, nbytes=5000, packets=5, direction='ingress', eni='eni-client', **server),
+        flow_line(HOUR_10, nbytes=5000, packets=5, direction='egress', eni='eni-server', **server),
+        # 只有一端在 VPC 内的流量只被记录一次
+        flow_line(HOUR_10, src='10.0.0.1', dst='203.0.113.9', nbytes=70, action='REJECT'),
+    ]
+    file_path = write_log(tmp_path / 'logs/a.log.gz', lines)
+
+    conversations = flp.FlowLogConversations(flp.FlowLogParser(), spill_dir=str(tmp_path))
+    conversations.add_file(file_path)
+    rows = {(row['addr_a'], row['addr_b']): row
+            for table in conversations.iter_results() for row in table.to_pylist()}
+
+    internal = rows[('10.0.0.1', '10.0.0.2')]
+    assert (internal['bytes_ab'], internal['bytes_ba'], internal['bytes']) == (100, 5000, 5100)
+    assert (internal['packets'], internal['records'], internal['accepted'], internal['rejected']) == (7, 2, 2, 0)
+    external = rows[('10.0.0.1', '203.0.113.9')]
+    assert (external['bytes'], external['records'], external['rejected']) == (70, 1, 1)
+
+def test_conversations_spill_and_merge_matches_in_memory(tmp_path):
+    lines = [flow_line(HOUR_10 + i, srcport=1024 + i % 300, nbytes=i, direction=('ingress', 'egress')[i % 2])
+             for i in range(3000)]
+    file_path = write_log(tmp_path / 'logs/a.log.gz', lines)
+
+    def aggregate(**kwargs):
+        conversations = flp.FlowLogConversations(flp.FlowLogParser(), spill_dir=str(tmp_path), **kwargs)
+        conversations.add_file(file_path)
+        table = pa.concat_tables(conversations.iter_results())
+        return table.sort_by([('port_a', 'ascending')]), conversations.spills
+
+    in_memory, _ = aggregate()
+    spilled, spills = aggregate(memory_bytes=4096, partitions=4)
+    assert spills > 0
+    assert spilled.num_rows == 300
+    assert spilled.equals(in_memory)
+
+
+def test_query_prunes_partitions_and_filters_rows(tmp_path):
+    output = tmp_path / 'compacted'
+    lines = [flow_line(HOUR_10 + hour * 3600 + i, srcport=1000 + i, nbytes=hour * 100 + i,
+                       action='REJECT' if i % 4 == 0 else 'ACCEPT')
+             for hour in range(3) for i in range(40)]
+    compact(output, write_log(tmp_path / 'raw/a.log.gz', lines))
+
+    query = flp.FlowLogQuery(str(output))
+    since, until = HOUR_10 + 3600, HOUR_10 + 7200
+    assert len(list(query.dataset.get_fragments(filter=query._partition_filter(since, until)))) == 1
+
+    df = query.run(['action'], ['bytes'], since=since, until=until, where=['action=REJECT'])
+    assert df.to_dict('records') == [{'action': 'REJECT', 'bytes': sum(100 + i for i in range(0, 40, 4)), 'flows': 10}]
+
+    # 跨越分区边界的时间范围按 start 精确过滤
+    df = query.run([], ['packets'], since=HOUR_10 + 20, until=HOUR_10 + 3600 + 10)
+    assert df['flows'].tolist() == [30]
+    assert query.parse_time('2024-01-15T11:00:00') == HOUR_10 + 3600
+
+
+def test_ip_index_round_trip_and_membership(tmp_path):
+    parser = flp.FlowLogParser()
+    log = write_log(tmp_path / 'a.log.gz', [flow_line(HOUR_10 + i, src=f'10.0.1.{i}') for i in range(50)])
+    index = flp.FlowLogIpIndex.build(parser.parse_file(log), 0.01, flp.local_source(log))
+
+    restored = flp.FlowLogIpIndex.from_bytes(index.to_bytes())
+    assert (restored.min_time, restored.max_time, restored.records) == (HOUR_10, HOUR_10 + 49 + 30, 50)
+    assert restored.source == flp.local_source(log)
+    for i in range(50):
+        assert restored.might_contain(flp.FlowLogIpIndex.pack_address(f'10.0.1.{i}'))
+    misses = sum(restored.might_contain(flp.FlowLogIpIndex.pack_address(f'172.16.{i // 256}.{i % 256}'))
+                 for i in range(2000))
+    assert misses < 2000 * 0.05
+
+    with pytest.raises(ValueError):
+        flp.FlowLogIpIndex.from_bytes(index.to_bytes()[:-1])
+
+
+def test_ip_search_skips_objects_by_sidecar(tmp_path):
+    parser = flp.FlowLogParser()
+    files = [write_log(tmp_path / f'raw/{n}.log.gz', [flow_line(HOUR_10 + n * 3600 + i, src=f'10.{n}.0.{i}')
+                                                      for i in range(20)]) for n in range(4)]
+    flp.run_indexing(argparse.Namespace(local_file=None, local_dir=str(tmp_path / 'raw'), index_fp_rate=0.001), parser)
+    assert all(os.path.exists(f + flp.FlowLogIpIndex.SUFFIX) for f in files)
+
+    search = flp.FlowLogIpSearch(parser, ['10.2.0.7'], workers=2)
+    results = list(search.search_local(files))
+    assert [r['srcaddr'] for r in results] == ['10.2.0.7']
+    assert (search.stats['indexed'], search.stats['candidates']) == (4, 1)
+
+    # 时间范围不重叠的对象不扫描
+    search = flp.FlowLogIpSearch(parser, ['10.2.0.7'], since=HOUR_10 + 3 * 3600, workers=2)
+    assert list(search.search_local(files)) == []
+    assert search.stats['candidates'] == 0
+
+    # 过期或损坏的 sidecar 按没有索引处理，仍会扫描；--indexed-only 时跳过
+    write_log(Path(files[0]), [flow_line(HOUR_10, src='10.2.0.7')])
+    with open(files[1] + flp.FlowLogIpIndex.SUFFIX, 'wb') as f:
+        f.write(b'garbage')
+    search = flp.FlowLogIpSearch(parser, ['10.2.0.7'], workers=2)
+    assert len(list(search.search_local(files))) == 2
+    assert (search.stats['indexed'], search.stats['candidates']) == (2, 3)
+    search = flp.FlowLogIpSearch(parser, ['10.2.0.7'], workers=2, indexed_only=True)
+    assert len(list(search.search_local(files))) == 1
@@ -0,0 +1,208 @@
+"""
+SQS 轮询处理器测试: 失败重试、重复通知去重和 Parquet 列名映射
+
+使用 tools/load-test-harness.py 中的 LocalS3/LocalSQS 替身，不需要真实的 AWS 资源。
+
+运行方法:
+    python3 -m pytest -q vpcflowlog-deployment/tests
+"""
+
+import sys
+import json
+import time
+import functools
+import importlib.util
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+TOOLS_DIR = Path(__file__).resolve().parent.parent / 'tools'
+QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/123456789012/vpc-flow-logs-test'
+BUCKET = 'vpc-flow-logs-test'
+VISIBILITY_TIMEOUT = 30
+
+def _load_harness():
+    if 'load_test_harness' in sys.modules:
+        return sys.modules['load_test_harness']
+    spec = importlib.util.spec_from_file_location('load_test_harness', TOOLS_DIR / 'load-test-harness.py')
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['load_test_harness'] = module
+    spec.loader.exec_module(module)
+    return module
+
+harness = _load_harness()
+smp = harness.load_script('sqs_message_processor', 'sqs-message-processor.py')
+LEASE = smp.ConcurrentSQSPoller.dedup_lease(VISIBILITY_TIMEOUT)
+
+@pytest.fixture
+def dataset(tmp_path):
+    data_dir = tmp_path / 'data'
+    harness.generate_dataset(str(data_dir), files=2, records_per_file=50)
+    return str(data_dir), harness.list_objects(str(data_dir))
+
+@pytest.fixture
+def s3(dataset):
+    return harness.LocalS3(dataset[0], BUCKET)
+
+@pytest.fixture
+def sqs():
+    return harness.LocalSQS()
+
+def build_message(objects, index: int, key=None) -> str:
+    """按压测工具的格式生成 S3 通知，同一 index 生成相同的对象标识"""
+    injector = harness.NotificationInjector(None, QUEUE_URL, BUCKET, objects, total=0)
+    body = injector.build_message(index)
+    if key is not None:
+        event = json.loads(body)
+        event['Records'][0]['s3']['object']['key'] = key
+        body = json.dumps(event)
+    return body
+
+def message_identity(body: str) -> str:
+    return smp.NotificationDeduplicator.record_identity(json.loads(body)['Records'][0])
+
+def wait_until(predicate, timeout: float = 20) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+def run_poller(poller, until, timeout: float = 20) -> bool:
+    poller.start()
+    try:
+        return wait_until(until, timeout)
+    finally:
+        poller.stop()
+        poller.join()
+
+def new_poller(sqs, s3, deduplicator=None, processes: int = 0, **kwargs):
+    processor = smp.VPCFlowLogsProcessor(QUEUE_URL, sqs_client=sqs, s3_client=s3, deduplicator=deduplicator)
+    common = dict(wait_time=0, visibility_timeout=VISIBILITY_TIMEOUT, **kwargs)
+    if processes:
+        factory = functools.partial(smp.VPCFlowLogsProcessor, QUEUE_URL, s3_client=s3, sqs_client=sqs)
+        return smp.ProcessPoolSQSPoller(processor, processes=processes, processor_factory=factory,
+                                        mp_context='fork', **common)
+    return smp.ConcurrentSQSPoller(processor, workers=2, **common)
+
+@pytest.mark.parametrize('processes', [0, 1])
+def test_failed_object_keeps_message(dataset, s3, sqs, processes):
+    _, objects = dataset
+    deduplicator = smp.NotificationDeduplicator(lease=LEASE)
+    body = build_message(objects, 0, key='vpc-flow-logs/missing.log.gz')
+    sqs.send_message(QueueUrl=QUEUE_URL, MessageBody=body)
+
+    poller = new_poller(sqs, s3, deduplicator, processes=processes)
+    assert run_poller(poller, lambda: poller.stats['failed'] >= 1)
+
+    assert poller.stats['deleted'] == 0
+    assert sqs.outstanding == 1
+    # 失败对象的登记已撤销，重新投递后可以再次处理
+    assert deduplicator.claim(message_identity(body))
+
+@pytest.mark.parametrize('processes', [0, 1])
+def test_duplicate_notifications_are_acked(dataset, s3, sqs, processes):
+    _, objects = dataset
+    body = build_message(objects, 0)
+    sqs.send_message(QueueUrl=QUEUE_URL, MessageBody=body)
+
+    deduplicator = smp.NotificationDeduplicator(lease=LEASE)
+    poller = new_poller(sqs, s3, deduplicator, processes=processes)
+    assert run_poller(poller, lambda: sqs.outstanding == 0)
+    requests = s3.requests
+
+    sqs.send_message(QueueUrl=QUEUE_URL, MessageBody=body)
+    poller = new_poller(sqs, s3, deduplicator, processes=processes)
+    assert run_poller(poller, lambda: sqs.outstanding == 0)
+
+    assert sqs.deleted == 2
+    assert s3.requests == requests
+    assert deduplicator.stats()['hits'] == 1
+
+def test_redelivery_after_crash_is_processed(dataset, s3, sqs, tmp_path):
+    _, objects = dataset
+    db_path = str(tmp_path / 'dedup.db')
+    body = build_message(objects, 0)
+    identity = message_identity(body)
+
+    # 崩溃的处理器只登记了租约，没有完成处理
+    crashed = smp.NotificationDeduplicator(db_path=db_path, lease=0.2)
+    assert crashed.claim(identity)
+
+    # 租约有效期内其他实例视为正在处理
+    assert not smp.NotificationDeduplicator(db_path=db_path).claim(identity)
+    time.sleep(0.3)
+
+    sqs.send_message(QueueUrl=QUEUE_URL, MessageBody=body)
+    deduplicator = smp.NotificationDeduplicator(db_path=db_path, lease=LEASE)
+    poller = new_poller(sqs, s3, deduplicator)
+    assert run_poller(poller, lambda: sqs.outstanding == 0)
+
+    assert s3.requests == 1
+    assert deduplicator.stats()['leased'] == 0
+    # 处理成功后按完整 TTL 保留，之后的重复通知不再处理
+    assert not smp.NotificationDeduplicator(db_path=db_path).claim(identity)
+
+def test_heartbeat_extends_lease(tmp_path):
+    db_path = str(tmp_path / 'dedup.db')
+    deduplicator = smp.NotificationDeduplicator(db_path=db_path, lease=0.3)
+    assert deduplicator.claim('bucket/key/etag/1')
+
+    for _ in range(3):
+        time.sleep(0.15)
+        assert deduplicator.extend() == 1
+    assert not smp.NotificationDeduplicator(db_path=db_path).claim('bucket/key/etag/1')
+
+    deduplicator.release('bucket/key/etag/1')
+    assert smp.NotificationDeduplicator(db_path=db_path).claim('bucket/key/etag/1')
+
+@pytest.mark.parametrize('processes', [0, 1])
+def test_poller_does_not_change_shared_lease(sqs, s3, processes, caplog):
+    deduplicator = smp.NotificationDeduplicator(lease=LEASE)
+    new_poller(sqs, s3, deduplicator, processes=processes)
+    assert deduplicator.lease == LEASE
+    assert '去重租约' not in caplog.text
+
+    # 与心跳不匹配的租约只给出警告
+    mismatched = smp.NotificationDeduplicator(lease=600)
+    new_poller(sqs, s3, mismatched, processes=processes)
+    assert mismatched.lease == 600
+    assert '去重租约 600 秒' in caplog.text
+
+def test_parquet_start_end_columns_feed_windows(tmp_path):
+    # Parquet 格式的 Flow Logs 使用 start/end/log_status 列名
+    (tmp_path / 'vpc-flow-logs').mkdir()
+    key = 'vpc-flow-logs/flows.parquet'
+    pd.DataFrame({
+        'srcaddr': ['10.0.0.1', '10.0.0.2'], 'dstaddr': ['10.1.0.1', '10.1.0.1'],
+        'packets': [10, 20], 'bytes': [1000, 2000], 'protocol': [6, 17],
+        'start': [1705312800, 1705312830], 'end': [1705312860, 1705312890],
+        'action': ['ACCEPT', 'REJECT'], 'log_status': ['OK', 'OK'],
+    }).to_parquet(tmp_path / key, index=False)
+
+    windows = smp.SlidingWindowAggregator(windows=(60,), bucket_seconds=10)
+    processor = smp.VPCFlowLogsProcessor(QUEUE_URL, sqs_client=harness.LocalSQS(),
+                                         s3_client=harness.LocalS3(str(tmp_path), BUCKET), windows=windows)
+    result = processor.process_s3_object(BUCKET, key)
+
+    assert result['分析结果']['时间范围'] == {'开始': 1705312800, '结束': 1705312890}
+    assert sum(bucket['bytes'] for bucket in result['窗口汇总'].values()) == 3000
+
+def test_generated_parquet_uses_aws_column_names(tmp_path):
+    data_dir = str(tmp_path / 'data')
+    harness.generate_dataset(data_dir, files=1, records_per_file=200, parquet_ratio=1.0)
+    (key, _, _), = harness.list_objects(data_dir)
+    assert key.endswith('.parquet')
+    assert {'start', 'end', 'log_status'} <= set(pd.read_parquet(Path(data_dir) / key).columns)
+
+    processor = smp.VPCFlowLogsProcessor(QUEUE_URL, sqs_client=harness.LocalSQS(),
+                                         s3_client=harness.LocalS3(data_dir, BUCKET))
+    with harness.local_read_parquet(harness.LocalS3(data_dir, BUCKET)):
+        result = processor.process_s3_object(BUCKET, key)
+    assert pd.read_parquet is harness._read_parquet
+
+    # 投递小时为 10 点，部分记录开始于前一个小时
+    time_range = result['分析结果']['时间范围']
+    assert time_range['开始'] < 1705312800 <= time_range['结束']
@@ -7,23 +7,63 @@ VPC Flow Logs 文件解析和验证工具
 2. 验证文件格式
 3. 生成统计报告
 4. 转换为不同格式 (JSON, CSV, Parquet)
+5. 把小文件合并为按小时分区、排序的 Parquet 数据集
+6. 对 Parquet 数据集执行即席聚合查询 (query 子命令)
+7. 为每个对象写入 IP 索引 sidecar，按 IP 搜索时只下载可能匹配的对象 (search 子命令)
+8. 缓存解析结果 (列式二进制格式)，重复分析同一批文件时通过 mmap 零拷贝读取
+9. 只校验不解析的快速验证模式，多进程并行，输出错误直方图和样例行
+10. 按对象和行两阶段抽样，快速估计大范围日志的统计量 (带置信区间)
+11. 双向会话聚合，内存有界，超出上限时按哈希分区溢写到磁盘再归并
+12. 单个大文件的文件内多进程并行解析 (共享内存分块)
 
 使用方法:
     python3 flow-log-parser.py --bucket my-bucket --key vpc-flow-logs/year=2024/month=01/day=15/hour=10/file.gz
     python3 flow-log-parser.py --local-file /path/to/file.gz --format json
     python3 flow-log-parser.py --bucket my-bucket --prefix vpc-flow-logs/year=2024/month=01/day=15/ --stats
+    python3 flow-log-parser.py --s3-prefix my-bucket vpc-flow-logs/year=2024/month=01/day=15/ --compact ./flow-logs-compacted
+    python3 flow-log-parser.py query ./flow-logs-compacted --group-by srcaddr,dstport --since 6h --where "action=REJECT" --top 20
+    python3 flow-log-parser.py --s3-prefix my-bucket vpc-flow-logs/year=2024/month=01/day=15/ --index --index-fp-rate 0.001
+    python3 flow-log-parser.py --local-dir ./logs --cache-dir ~/.cache/flow-logs --stats-only
+    python3 flow-log-parser.py --s3-prefix my-bucket vpc-flow-logs/year=2024/month=01/day=15/ --validate --workers 8
+    python3 flow-log-parser.py --s3-prefix my-bucket vpc-flow-logs/year=2024/month=01/ --sample 0.02 --sample-rows 0.1 --seed 42
+    python3 flow-log-parser.py --local-dir ./logs --conversations --memory-mb 1024 --format parquet --output conversations.parquet
+    python3 flow-log-parser.py --local-file /path/to/large-file.gz --parse-workers 16 --stats-only
+    python3 flow-log-parser.py search --ip 10.1.2.3 --s3-prefix my-bucket vpc-flow-logs/year=2024/month=01/day=15/ --since 6h
 
 依赖:
     pip install boto3 pandas pyarrow
 """
 
+import os
+import re
+import sys
+import time
 import gzip
+import zlib
 import json
+import math
+import struct
+import hashlib
+import ipaddress
+import itertools
+import random
+import shutil
 import argparse
+import tempfile
 import boto3
+from collections import deque
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import pandas as pd
-from datetime import datetime
-from typing import Dict, List, Optional, Iterator
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+from datetime import datetime, timedelta, timezone
+from statistics import NormalDist
+from typing import Dict, List, Optional, Iterator, Tuple
 import logging
 from pathlib import Path
 
@@ -68,8 +108,34 @@ class FlowLogParser:
         1: 'ICMP', 6: 'TCP', 17: 'UDP', 58: 'ICMPv6'
     }
     
+    # 原始字段的 Arrow 类型 (与 README 中的 Athena 表定义一致)
+    ARROW_SCHEMA = pa.schema([
+        ('version', pa.int32()), ('account_id', pa.string()), ('interface_id', pa.string()),
+        ('srcaddr', pa.string()), ('dstaddr', pa.string()),
+        ('srcport', pa.int32()), ('dstport', pa.int32()), ('protocol', pa.int32()),
+        ('packets', pa.int64()), ('bytes', pa.int64()), ('start', pa.int64()), ('end', pa.int64()),
+        ('action', pa.string()), ('log_status', pa.string()),
+        ('vpc_id', pa.string()), ('subnet_id', pa.string()), ('instance_id', pa.string()),
+        ('tcp_flags', pa.int32()), ('type', pa.string()), ('pkt_srcaddr', pa.string()),
+        ('pkt_dstaddr', pa.string()),
+        ('region', pa.string()), ('az_id', pa.string()), ('sublocation_type', pa.string()),
+        ('sublocation_id', pa.string()),
+        ('pkt_src_aws_service', pa.string()), ('pkt_dst_aws_service', pa.string()),
+        ('flow_direction', pa.string()), ('traffic_path', pa.int32())
+    ])
+    
+    # 文件内并行解析时每个共享内存段容纳的分块数
+    SEGMENT_CHUNKS = 4
+    
+    # 解析缓存格式版本，缓存布局变化时递增使旧缓存失效
+    CACHE_VERSION = 1
+    CACHE_METADATA_KEY = b'flowlog_cache'
+    
     def __init__(self):
         self.s3_client = boto3.client('s3')
+        # 大于 1 时 iter_batches 在文件内按分块多进程并行解析
+        self.parse_workers = 1
+        self.chunk_bytes = 16 * 1024 * 1024
         
     def download_from_s3(self, bucket: str, key: str, local_path: Optional[str] = None) -> str:
         """从 S3 下载文件"""
@@ -114,17 +180,27 @@ class FlowLogParser:
         
     def parse_line(self, line: str) -> Optional[Dict]:
         """解析单行记录"""
+        record = self.parse_fields(line)
+        return self.add_derived_fields(record) if record else None
+    
+    @classmethod
+    def parse_fields(cls, line: str) -> Optional[Dict]:
+        """解析单行的原始字段 (不含计算字段)，表头行返回 None"""
         fields = line.split(' ')
         
-        if len(fields) != len(self.FIELD_NAMES):
-            raise ValueError(f"字段数量不匹配: 期望 {len(self.FIELD_NAMES)}, 实际 {len(fields)}")
+        # 跳过文件开头的表头行
+        if fields[0] == 'version':
+            return None
+        
+        if len(fields) != len(cls.FIELD_NAMES):
+            raise ValueError(f"字段数量不匹配: 期望 {len(cls.FIELD_NAMES)}, 实际 {len(fields)}")
             
         record = {}
-        for i, (field_name, value) in enumerate(zip(self.FIELD_NAMES, fields)):
+        for i, (field_name, value) in enumerate(zip(cls.FIELD_NAMES, fields)):
             # 处理缺失值
             if value == '-':
                 record[field_name] = None
-            elif field_name in self.NUMERIC_FIELDS:
+            elif field_name in cls.NUMERIC_FIELDS:
                 try:
                     record[field_name] = int(value)
                 except ValueError:
@@ -132,10 +208,14 @@ class FlowLogParser:
             else:
                 record[field_name] = value
                 
-        # 添加计算字段
+        return record
+    
+    def add_derived_fields(self, record: Dict) -> Dict:
+        """为只含原始字段的记录添加计算字段"""
         record['protocol_name'] = self.PROTOCOL_MAP.get(record.get('protocol'), 'Unknown')
-        record['start_time'] = datetime.fromtimestamp(record['start']) if record['start'] else None
-        record['end_time'] = datetime.fromtimestamp(record['end']) if record['end'] else None
+        # 捕获窗口时间是 epoch 秒，统一转换为 UTC 时间 (与解析缓存输出和分区路径一致)
+        record['start_time'] = datetime.fromtimestamp(record['start'], tz=timezone.utc) if record['start'] else None
+        record['end_time'] = datetime.fromtimestamp(record['end'], tz=timezone.utc) if record['end'] else None
         record['duration'] = record['end'] - record['start'] if record['end'] and record['start'] else None
         
         return record
@@ -189,22 +269,2282 @@ class FlowLogParser:
         df = pd.DataFrame(records)
         df.to_parquet(output_path, index=False)
         
-    def list_s3_files(self, bucket: str, prefix: str) -> List[str]:
-        """列出 S3 中的文件"""
-        logger.info(f"列出 s3://{bucket}/{prefix} 中的文件")
+    def iter_records(self, file_path: str) -> Iterator[Dict]:
+        """逐条产出记录，文件内并行解析时由 Arrow 批次还原，与 parse_file 的结果一致"""
+        if self.parse_workers <= 1:
+            yield from self.parse_file(file_path)
+            return
+        for batch in self.iter_batches(file_path):
+            for record in batch.to_pylist():
+                yield self.add_derived_fields(record)
+        
+    def iter_batches(self, file_path: str, batch_rows: int = 65536) -> Iterator[pa.RecordBatch]:
+        """按批次解析文件，只保留原始字段并转换为 Arrow RecordBatch"""
+        # 是否值得启动进程池由分块结果决定 (不足两个分块时在当前进程解析)
+        if self.parse_workers > 1 and self._shared_memory_available():
+            yield from self.iter_batches_parallel(file_path)
+            return
+        
+        columns = {name: [] for name in self.FIELD_NAMES}
+        rows = 0
+        
+        for record in self.parse_file(file_path):
+            for name in self.FIELD_NAMES:
+                columns[name].append(record[name])
+            rows += 1
+            if rows >= batch_rows:
+                yield pa.RecordBatch.from_pydict(columns, schema=self.ARROW_SCHEMA)
+                columns = {name: [] for name in self.FIELD_NAMES}
+                rows = 0
+        
+        if rows:
+            yield pa.RecordBatch.from_pydict(columns, schema=self.ARROW_SCHEMA)
+
+    def _shared_memory_available(self) -> bool:
+        """
+        检查 /dev/shm 能否容纳并行解析同时占用的共享内存段
+        
+        共享内存按页延迟分配，空间不足时写入会触发 SIGBUS 而不是报错，因此预先检查；
+        不足时回退为串行解析。
+        """
+        required = (2 * self.parse_workers + 2 * self.SEGMENT_CHUNKS) * self.chunk_bytes
+        try:
+            free = shutil.disk_usage('/dev/shm').free
+        except OSError:
+            # 没有 /dev/shm 的系统 (如 macOS) 共享内存不受该目录大小限制
+            return True
+        if free < required:
+            logger.warning(f"/dev/shm 可用空间 {free // (1024 * 1024)} MB 不足 "
+                           f"{required // (1024 * 1024)} MB，改为串行解析 (可减小 --chunk-mb 或 --parse-workers)")
+            return False
+        return True
+    
+    @staticmethod
+    def _last_newline(buffer: memoryview, start: int, end: int) -> int:
+        """buffer[start:end] 中最后一个换行之后的位置，没有换行时返回 start"""
+        window_end = end
+        while window_end > start:
+            window_start = max(start, window_end - 65536)
+            position = bytes(buffer[window_start:window_end]).rfind(b'\n')
+            if position >= 0:
+                return window_start + position + 1
+            window_end = window_start
+        return start
+    
+    def iter_shared_chunks(self, file_path: str, segments: List[shared_memory.SharedMemory]) -> Iterator[Tuple[str, int, int]]:
+        """
+        边解压边切分: 把文件解压一次到共享内存段中，每解压出 chunk_bytes 就产出一个以换行结尾的分块
+        (共享内存名, 起始, 结束)。每个段容纳 SEGMENT_CHUNKS 个分块，写满后未完成的行移到新段继续，
+        共享内存占用与文件大小无关。创建的段按顺序追加到 segments，由调用方在其中的分块处理完后释放。
+        """
+        open_func = gzip.open if file_path.endswith('.gz') else open
+        chunk_bytes = self.chunk_bytes
+        segment_size = self.SEGMENT_CHUNKS * chunk_bytes
+        segment = shared_memory.SharedMemory(create=True, size=segment_size)
+        segments.append(segment)
+        start = filled = 0
+        
+        with open_func(file_path, 'rb') as f:
+            while True:
+                if filled == segment.size:
+                    # 段已写满，未完成的行移到新段 (超长行时新段按需加大)
+                    carry = filled - start
+                    next_segment = shared_memory.SharedMemory(create=True, size=max(segment_size, 2 * carry))
+                    segments.append(next_segment)
+                    next_segment.buf[:carry] = segment.buf[start:filled]
+                    segment, start, filled = next_segment, 0, carry
+                
+                count = f.readinto(segment.buf[filled:min(filled + chunk_bytes, segment.size)])
+                if not count:
+                    break
+                filled += count
+                
+                if filled - start >= chunk_bytes:
+                    end = self._last_newline(segment.buf, start, filled)
+                    if end > start:
+                        yield segment.name, start, end
+                        start = end
+        
+        if filled > start:
+            yield segment.name, start, filled
+    
+    @staticmethod
+    def _release_segments(segments: List[shared_memory.SharedMemory], keep: Optional[str] = None):
+        """释放 keep 之前的共享内存段 (keep 为空时全部释放)"""
+        while segments and segments[0].name != keep:
+            segment = segments.pop(0)
+            segment.close()
+            segment.unlink()
+    
+    @classmethod
+    def parse_chunk(cls, data: bytes) -> Tuple[pa.RecordBatch, int]:
+        """解析一个分块的原始字节，返回 (RecordBatch, 错误行数)，不依赖实例 (worker 中无需创建 S3 客户端)"""
+        columns = {name: [] for name in cls.FIELD_NAMES}
+        errors = 0
+        for line in data.decode('utf-8').split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = cls.parse_fields(line)
+            except Exception:
+                errors += 1
+                continue
+            if record:
+                for name in cls.FIELD_NAMES:
+                    columns[name].append(record[name])
+        return pa.RecordBatch.from_pydict(columns, schema=cls.ARROW_SCHEMA), errors
+    
+    def iter_batches_parallel(self, file_path: str) -> Iterator[pa.RecordBatch]:
+        """
+        文件内并行解析: 边解压边把以换行结尾的分块交给进程池解析，按原顺序产出批次
+
+        worker 只接收共享内存名和分块偏移，不传递行列表；返回的 RecordBatch 以 Arrow 缓冲区形式传回。
+        解压在父进程中串行进行，但与 worker 的解析重叠。分块按顺序完成，最早的在途分块之前的
+        共享内存段随即释放。解压后不足两个分块的文件不启动进程池，直接在当前进程解析。
+        """
+        segments: List[shared_memory.SharedMemory] = []
+        executor = None
+        
+        try:
+            chunks = self.iter_shared_chunks(file_path, segments)
+            head = list(itertools.islice(chunks, 2))
+            
+            if len(head) < 2:
+                def results() -> Iterator[Tuple[pa.RecordBatch, int]]:
+                    # 分块之后可能已换到新段，按分块记录的段名读取
+                    by_name = {segment.name: segment for segment in segments}
+                    for shm_name, start, end in head:
+                        yield self.parse_chunk(bytes(by_name[shm_name].buf[start:end]))
+                yield from self._collect_chunk_results(results())
+                return
+            
+            logger.info(f"并行解析文件: {file_path} ({self.parse_workers} 个进程)")
+            executor = ProcessPoolExecutor(max_workers=self.parse_workers)
+            # 最多同时提交 2 倍进程数的分块，限制等待合并的结果和共享内存的占用
+            pending = deque()
+            
+            def finish_oldest() -> Tuple[pa.RecordBatch, int]:
+                future, _ = pending.popleft()
+                result = future.result()
+                self._release_segments(segments, pending[0][1] if pending else segments[-1].name)
+                return result
+            
+            def results() -> Iterator[Tuple[pa.RecordBatch, int]]:
+                for shm_name, start, end in itertools.chain(head, chunks):
+                    pending.append((executor.submit(_parse_chunk_in_worker, shm_name, start, end), shm_name))
+                    if len(pending) >= 2 * self.parse_workers:
+                        yield finish_oldest()
+                while pending:
+                    yield finish_oldest()
+            
+            yield from self._collect_chunk_results(results())
+        finally:
+            # 进程池关闭 (在途分块处理完或取消) 后再释放剩余的共享内存
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+            self._release_segments(segments)
+    
+    def _collect_chunk_results(self, results: Iterator[Tuple[pa.RecordBatch, int]]) -> Iterator[pa.RecordBatch]:
+        records = 0
+        errors = 0
+        for batch, chunk_errors in results:
+            records += batch.num_rows
+            errors += chunk_errors
+            if batch.num_rows:
+                yield batch
+        logger.info(f"解析完成: {records} 条记录, {errors} 个错误")
+    
+    def build_table(self, file_path: str) -> pa.Table:
+        """解析文件为单块 Arrow 表，字符串列转为字典编码 (编码 + 字符串表)"""
+        table = pa.Table.from_batches(list(self.iter_batches(file_path)), schema=self.ARROW_SCHEMA).combine_chunks()
+        columns = [pc.dictionary_encode(column) if pa.types.is_string(column.type) else column
+                   for column in table.columns]
+        return pa.Table.from_arrays(columns, names=table.column_names)
+
+    def cache_path(self, cache_dir: str, source: Dict) -> str:
+        """缓存文件路径，由源文件路径决定，源文件变化时原地覆盖"""
+        digest = hashlib.sha1(source['path'].encode('utf-8')).hexdigest()
+        return os.path.join(cache_dir, f"{digest}.arrow")
+
+    def read_cache(self, cache_dir: str, source: Dict) -> Optional[pa.Table]:
+        """
+        读取解析缓存
+        
+        缓存是未压缩的 Arrow IPC 文件，通过 mmap 打开后各列直接引用映射的页面，
+        不复制数据；源文件的大小、mtime/ETag 与缓存中记录的不一致时视为未命中。
+        """
+        path = self.cache_path(cache_dir, source)
+        if not os.path.exists(path):
+            return None
+        try:
+            table = ipc.open_file(pa.memory_map(path, 'r')).read_all()
+            metadata = json.loads(table.schema.metadata[self.CACHE_METADATA_KEY])
+        except (pa.ArrowInvalid, KeyError, TypeError, ValueError) as e:
+            logger.warning(f"忽略损坏的缓存 {path}: {e}")
+            return None
+        if metadata != {'version': self.CACHE_VERSION, 'source': source}:
+            return None
+        logger.info(f"命中解析缓存: {source['path']}")
+        return table
+
+    def write_cache(self, cache_dir: str, source: Dict, table: pa.Table) -> pa.Table:
+        """写入解析缓存，并返回从缓存 mmap 打开的表"""
+        os.makedirs(cache_dir, exist_ok=True)
+        path = self.cache_path(cache_dir, source)
+        metadata = json.dumps({'version': self.CACHE_VERSION, 'source': source})
+        table = table.replace_schema_metadata({self.CACHE_METADATA_KEY: metadata})
+        
+        # 先写临时文件再改名，并发运行或中途退出都不会留下半个缓存
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with pa.OSFile(temp_path, 'wb') as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(temp_path, path)
+        return ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+    def generate_table_stats(self, table: pa.Table) -> Dict:
+        """在 Arrow 表上生成与 generate_stats 相同结构的统计报告，不转换为逐行记录"""
+        if table.num_rows == 0:
+            return {}
+        
+        counted: Dict[str, Dict] = {}
+        
+        def value_counts(column: str) -> Dict:
+            """逐块计数后按值合并: 各文件的字典不同，字典列按编码计数再映射为字符串，不统一字典"""
+            if column in counted:
+                return counted[column]
+            merged: Dict = {}
+            for chunk in table.column(column).chunks:
+                if pa.types.is_dictionary(chunk.type):
+                    counts = pc.value_counts(chunk.indices)
+                    values = chunk.dictionary.take(counts.field('values'))
+                else:
+                    counts = pc.value_counts(chunk)
+                    values = counts.field('values')
+                for value, count in zip(values.to_pylist(), counts.field('counts').to_pylist()):
+                    if value is not None:
+                        merged[value] = merged.get(value, 0) + count
+            counted[column] = merged
+            return merged
+        
+        def top(column: str, limit: Optional[int] = None) -> Dict:
+            pairs = sorted(value_counts(column).items(), key=lambda x: -x[1])
+            return dict(pairs[:limit] if limit else pairs)
+        
+        def distinct(column: str) -> int:
+            return len(value_counts(column))
+
+        def timestamp(value: pa.Scalar) -> Optional[str]:
+            value = value.as_py()
+            return datetime.fromtimestamp(value, tz=timezone.utc).isoformat() if value is not None else None
+        
+        protocols = {}
+        for protocol, count in top('protocol').items():
+            name = self.PROTOCOL_MAP.get(protocol, 'Unknown')
+            protocols[name] = protocols.get(name, 0) + count
+        null_protocols = table.column('protocol').null_count
+        if null_protocols:
+            protocols['Unknown'] = protocols.get('Unknown', 0) + null_protocols
         
+        return {
+            'total_records': table.num_rows,
+            'time_range': {
+                'start': timestamp(pc.min(table.column('start'))),
+                'end': timestamp(pc.max(table.column('end'))),
+            },
+            'traffic_summary': {
+                'total_bytes': pc.sum(table.column('bytes')).as_py() or 0,
+                'total_packets': pc.sum(table.column('packets')).as_py() or 0,
+                'unique_sources': distinct('srcaddr'),
+                'unique_destinations': distinct('dstaddr'),
+            },
+            'action_breakdown': top('action'),
+            'protocol_breakdown': dict(sorted(protocols.items(), key=lambda x: -x[1])),
+            'top_sources': top('srcaddr', 10),
+            'top_destinations': top('dstaddr', 10),
+            'top_ports': {
+                'source': top('srcport', 10),
+                'destination': top('dstport', 10),
+            }
+        }
+
+    def save_table(self, table: pa.Table, output_path: str, output_format: str):
+        """保存 Arrow 表，补充与 parse_line 相同的计算字段"""
+        logger.info(f"保存为 {output_format.upper()}: {output_path}")
+        
+        codes = list(self.PROTOCOL_MAP)
+        names = pa.array([self.PROTOCOL_MAP[code] for code in codes] + ['Unknown'])
+        index = pc.fill_null(pc.index_in(table.column('protocol'), value_set=pa.array(codes, pa.int32())), len(codes))
+        duration = pc.subtract(table.column('end'), table.column('start'))
+        table = (table
+                 .append_column('protocol_name', pc.take(names, index))
+                 .append_column('start_time', table.column('start').cast(pa.timestamp('s', tz='UTC')))
+                 .append_column('end_time', table.column('end').cast(pa.timestamp('s', tz='UTC')))
+                 .append_column('duration', duration))
+        
+        if output_format == 'json':
+            with open(output_path, 'w', encoding='utf-8') as f:
+                json.dump(table.to_pylist(), f, indent=2, default=str)
+        elif output_format == 'csv':
+            pa_csv.write_csv(table.cast(pa.schema([
+                field.with_type(field.type.value_type) if pa.types.is_dictionary(field.type) else field
+                for field in table.schema
+            ])), output_path)
+        elif output_format == 'parquet':
+            pq.write_table(table, output_path)
+
+    def iter_s3_files(self, bucket: str, prefix: str) -> Iterator[str]:
+        """逐个下载前缀下的文件，调用方处理完后删除本地副本，磁盘占用只有一个文件"""
+        for _, local_path in self.iter_s3_keys(bucket, self.list_s3_files(bucket, prefix)):
+            yield local_path
+
+    def iter_s3_keys(self, bucket: str, keys: List[str]) -> Iterator[Tuple[str, str]]:
+        """逐个下载指定的对象，返回 (key, 本地路径)，调用方处理完后删除本地副本"""
+        for key in keys:
+            fd, local_path = tempfile.mkstemp(suffix=Path(key).name)
+            os.close(fd)
+            self.download_from_s3(bucket, key, local_path)
+            try:
+                yield key, local_path
+            finally:
+                os.remove(local_path)
+
+    def list_s3_objects(self, bucket: str, prefix: str) -> List[Dict]:
+        """列出前缀下的全部对象 (包含 Key、Size、ETag 等信息)"""
         paginator = self.s3_client.get_paginator('list_objects_v2')
-        files = []
+        objects = []
         
         for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
-            for obj in page.get('Contents', []):
-                if obj['Key'].endswith('.gz'):
-                    files.append(obj['Key'])
+            objects.extend(page.get('Contents', []))
+        
+        return objects
+
+    def list_s3_files(self, bucket: str, prefix: str) -> List[str]:
+        """列出 S3 中的文件"""
+        logger.info(f"列出 s3://{bucket}/{prefix} 中的文件")
+        
+        files = [obj['Key'] for obj in self.list_s3_objects(bucket, prefix) if obj['Key'].endswith('.gz')]
                     
         logger.info(f"找到 {len(files)} 个文件")
         return files
 
+def _parse_chunk_in_worker(shm_name: str, start: int, end: int) -> Tuple[pa.RecordBatch, int]:
+    """worker 进程入口: 从共享内存读取一个分块并解析"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        data = bytes(shm.buf[start:end])
+    finally:
+        shm.close()
+    return FlowLogParser.parse_chunk(data)
+
+class FlowLogCompactor:
+    """
+    Flow Log 小文件合并工具
+    
+    把大量 5 分钟粒度的小 Text 文件合并为 Hive 分区 (year=/month=/day=/hour=) 的
+    Parquet 数据集。每个小时分区内按时间和可配置的排序键排序，输出文件按目标大小滚动，
+    低基数字段使用字典编码并写入列统计信息，便于下游按分区和行组跳过数据。
+    
+    内存有界: 解析结果每累积 memory_rows 行就排序后按小时溢写为 Arrow IPC 临时文件，
+    最后对每个小时的所有溢写段做分块多路归并。
+    
+    增量且幂等: 每个小时分区的 _manifest.json 记录该分区的 part 文件和已合并的输入来源。
+    输入中已合并到某个分区的来源在该分区中跳过；有新行的分区与已有的 part 文件一起归并，
+    完整写到暂存目录后再替换输出中的同一分区 (S3 输出依次上传新文件和清单，再删除旧的 part 文件)。
+    因此延迟到达、落在之前小时的行会并入已有分区，重复执行也不会重复累积数据。
+    """
+    
+    MANIFEST = '_manifest.json'
+    
+    # 使用字典编码的低基数字段
+    DICTIONARY_COLUMNS = [
+        'version', 'account_id', 'interface_id', 'dstport', 'protocol', 'action', 'log_status',
+        'vpc_id', 'subnet_id', 'instance_id', 'tcp_flags', 'type', 'region', 'az_id',
+        'sublocation_type', 'sublocation_id', 'pkt_src_aws_service', 'pkt_dst_aws_service',
+        'flow_direction', 'traffic_path'
+    ]
+    
+    def __init__(self, parser: FlowLogParser, output: str, sort_key: str = 'srcaddr',
+                 target_file_size: int = 128 * 1024 * 1024, row_group_size: int = 128 * 1024,
+                 memory_rows: int = 500000, spill_dir: Optional[str] = None,
+                 compression: str = 'zstd'):
+        """
+        初始化合并工具
+        
+        Args:
+            parser: 用于解析文件的 FlowLogParser
+            output: 输出目录，或 s3://bucket/prefix (先写本地暂存目录再上传)
+            sort_key: 时间之后的第二排序字段
+            target_file_size: 单个输出文件的目标大小（字节）
+            row_group_size: Parquet 行组的行数
+            memory_rows: 内存中最多保留的行数，超过后排序并溢写到磁盘
+            spill_dir: 溢写文件目录 (默认使用系统临时目录)
+            compression: Parquet 压缩算法
+        """
+        if sort_key not in FlowLogParser.FIELD_NAMES:
+            raise ValueError(f"未知的排序字段: {sort_key}")
+        
+        self.parser = parser
+        self.output = output
+        self.sort_keys = [('start', 'ascending'), (sort_key, 'ascending')]
+        self.target_file_size = target_file_size
+        self.row_group_size = row_group_size
+        self.memory_rows = memory_rows
+        self.compression = compression
+        # 每次运行的文件名不同，S3 上传新文件时不会覆盖旧清单仍引用的文件
+        self.run_id = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+        
+        self._spill_dir = tempfile.mkdtemp(prefix='flowlog-spill-', dir=spill_dir)
+        self._pending: List[pa.RecordBatch] = []
+        self._pending_rows = 0
+        self._runs: Dict[int, List[str]] = {}
+        self._rows_by_hour: Dict[int, int] = {}
+        self._sources: Dict[int, set] = {}
+        self._manifests: Dict[int, Dict] = {}
+        self.skipped_rows = 0
+        self.duplicate_rows = 0
+
+    def add_file(self, file_path: str, source: Optional[str] = None):
+        """
+        解析一个文件并加入合并缓冲区
+        
+        Args:
+            file_path: 本地文件路径
+            source: 输入来源的稳定标识 (默认为文件的绝对路径，S3 输入使用 s3:// 路径)
+        """
+        source = source or os.path.abspath(file_path)
+        for batch in self.parser.iter_batches(file_path):
+            batch = self._exclude_merged(batch, source)
+            if not batch.num_rows:
+                continue
+            self._pending.append(batch)
+            self._pending_rows += batch.num_rows
+            if self._pending_rows >= self.memory_rows:
+                self._spill()
+    
+    def _exclude_merged(self, batch: pa.RecordBatch, source: str) -> pa.RecordBatch:
+        """去掉来源已经合并进对应小时分区的行，并记录其余各小时的来源"""
+        hours = pc.divide(batch.column('start'), 3600)
+        merged = []
+        for hour in pc.unique(hours).to_pylist():
+            if hour is None:
+                continue
+            if source in self._manifest(hour)['sources']:
+                merged.append(hour)
+            else:
+                self._sources.setdefault(hour, set()).add(source)
+        if not merged:
+            return batch
+        
+        duplicate = pc.is_in(hours, value_set=pa.array(merged, hours.type))
+        self.duplicate_rows += pc.sum(duplicate.cast(pa.int64())).as_py()
+        logger.info(f"{source} 已合并到 {len(merged)} 个分区，跳过其中的行")
+        return batch.filter(pc.invert(duplicate))
+    
+    def _s3_location(self, partition: str) -> Tuple[str, str, str]:
+        """S3 输出的 (bucket, 前缀, 分区前缀)"""
+        bucket, _, prefix = self.output[len('s3://'):].partition('/')
+        prefix = prefix.rstrip('/')
+        return bucket, prefix, '/'.join(filter(None, [prefix, partition])) + '/'
+    
+    def _manifest(self, hour: int) -> Dict:
+        """
+        读取输出中一个小时分区的清单 (files: part 文件名, sources: 已合并的输入来源)
+        
+        没有清单的旧分区视为全部 part 文件都属于该分区、来源未知；分区不存在时为空清单。
+        """
+        if hour in self._manifests:
+            return self._manifests[hour]
+        
+        partition = self.partition_path(hour)
+        manifest = None
+        if self.output.startswith('s3://'):
+            bucket, _, partition_prefix = self._s3_location(partition)
+            keys = [obj['Key'] for obj in self.parser.list_s3_objects(bucket, partition_prefix)]
+            if partition_prefix + self.MANIFEST in keys:
+                body = self.parser.s3_client.get_object(Bucket=bucket, Key=partition_prefix + self.MANIFEST)['Body']
+                manifest = json.loads(body.read())
+            parts = [key[len(partition_prefix):] for key in keys if key[len(partition_prefix):].startswith('part-')]
+        else:
+            partition_dir = os.path.join(self.output, partition)
+            if os.path.exists(os.path.join(partition_dir, self.MANIFEST)):
+                with open(os.path.join(partition_dir, self.MANIFEST)) as f:
+                    manifest = json.load(f)
+            parts = sorted(name for name in os.listdir(partition_dir)
+                           if name.startswith('part-')) if os.path.isdir(partition_dir) else []
+        
+        if manifest is None:
+            manifest = {'files': parts, 'sources': []}
+        manifest['sources'] = set(manifest['sources'])
+        self._manifests[hour] = manifest
+        return manifest
+
+    def _spill(self):
+        """把缓冲区排序后按小时分区写成溢写段"""
+        if not self._pending_rows:
+            return
+        
+        table = pa.Table.from_batches(self._pending, schema=FlowLogParser.ARROW_SCHEMA)
+        self._pending, self._pending_rows = [], 0
+        
+        # 没有开始时间的行无法分区
+        valid = table.column('start').is_valid()
+        self.skipped_rows += table.num_rows - pc.sum(valid.cast(pa.int64())).as_py()
+        table = table.filter(valid).sort_by(self.sort_keys)
+        if not table.num_rows:
+            return
+        
+        # 已按时间排序，同一小时的行是连续的，按出现顺序统计即可得到各小时的行范围
+        hour_counts = pc.value_counts(pc.divide(table.column('start'), 3600))
+        offset = 0
+        for hour, count in zip(hour_counts.field('values').to_pylist(),
+                               hour_counts.field('counts').to_pylist()):
+            self._write_run(hour, table.slice(offset, count))
+            offset += count
+    
+    def _write_run(self, hour: int, table: pa.Table):
+        """把一个小时的有序行写成一个溢写段"""
+        runs = self._runs.setdefault(hour, [])
+        path = os.path.join(self._spill_dir, f"hour-{hour}-run-{len(runs):05d}.arrow")
+        with ipc.new_file(path, FlowLogParser.ARROW_SCHEMA) as writer:
+            for batch in table.to_batches(max_chunksize=self.row_group_size):
+                writer.write_batch(batch)
+        runs.append(path)
+        self._rows_by_hour[hour] = self._rows_by_hour.get(hour, 0) + table.num_rows
+    
+    def _spill_existing(self, hour: int) -> int:
+        """把输出中该小时分区已有的 part 文件读入为溢写段 (按当前排序键重新排序)，返回行数"""
+        partition = self.partition_path(hour)
+        rows = 0
+        pending: List[pa.RecordBatch] = []
+        pending_rows = 0
+        
+        def flush():
+            nonlocal pending, pending_rows
+            if pending_rows:
+                table = pa.Table.from_batches(pending).cast(FlowLogParser.ARROW_SCHEMA)
+                self._write_run(hour, table.sort_by(self.sort_keys))
+            pending, pending_rows = [], 0
+        
+        for name in self._manifest(hour)['files']:
+            if self.output.startswith('s3://'):
+                bucket, _, partition_prefix = self._s3_location(partition)
+                path = self.parser.download_from_s3(
+                    bucket, partition_prefix + name, os.path.join(self._spill_dir, f"existing-{hour}-{name}"))
+            else:
+                path = os.path.join(self.output, partition, name)
+            
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=self.row_group_size):
+                pending.append(batch)
+                pending_rows += batch.num_rows
+                rows += batch.num_rows
+                if pending_rows >= self.memory_rows:
+                    flush()
+            if self.output.startswith('s3://'):
+                os.remove(path)
+        flush()
+        return rows
+
+    def _sort_value(self, table: pa.Table, index: int) -> Tuple:
+        """与 Arrow 排序一致的比较键 (空值排在最后)"""
+        key = []
+        for name, _ in self.sort_keys:
+            value = table.column(name)[index].as_py()
+            key += [value is None, value if value is not None else 0 if name == 'start' else '']
+        return tuple(key)
+
+    def _split_point(self, table: pa.Table, bound: Tuple) -> int:
+        """二分查找有序表中第一个大于 bound 的位置"""
+        low, high = 0, table.num_rows
+        while low < high:
+            middle = (low + high) // 2
+            if self._sort_value(table, middle) <= bound:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _merge_runs(self, hour: int) -> Iterator[pa.Table]:
+        """对一个小时的有序溢写段做分块多路归并，按顺序产出有序的数据块"""
+        paths = self._runs[hour]
+        if self._rows_by_hour[hour] <= self.memory_rows:
+            tables = [ipc.open_file(pa.memory_map(path)).read_all() for path in paths]
+            yield pa.concat_tables(tables).sort_by(self.sort_keys)
+            return
+        
+        readers = [ipc.open_file(pa.memory_map(path)) for path in paths]
+        positions = [0] * len(readers)
+        buffers: List[Optional[pa.Table]] = [None] * len(readers)
+        
+        while True:
+            # 每个未读完的溢写段至少保留一个批次在内存中
+            for i, reader in enumerate(readers):
+                while ((buffers[i] is None or buffers[i].num_rows == 0)
+                       and positions[i] < reader.num_record_batches):
+                    batch = pa.Table.from_batches([reader.get_batch(positions[i])])
+                    positions[i] += 1
+                    buffers[i] = batch if buffers[i] is None else pa.concat_tables([buffers[i], batch])
+            
+            active = [i for i, buffer in enumerate(buffers) if buffer is not None and buffer.num_rows]
+            if not active:
+                return
+            
+            # 所有仍有后续批次的段中，缓冲区末尾的最小值以内的行都可以安全输出
+            open_runs = [i for i in active if positions[i] < readers[i].num_record_batches]
+            if open_runs:
+                bound = min(self._sort_value(buffers[i], buffers[i].num_rows - 1) for i in open_runs)
+            else:
+                bound = None
+            
+            pieces = []
+            for i in active:
+                split = buffers[i].num_rows if bound is None else self._split_point(buffers[i], bound)
+                if split:
+                    pieces.append(buffers[i].slice(0, split))
+                    buffers[i] = buffers[i].slice(split)
+            yield pa.concat_tables(pieces).sort_by(self.sort_keys)
+
+    @staticmethod
+    def partition_path(hour: int) -> str:
+        """小时编号对应的 Hive 分区路径"""
+        moment = datetime.fromtimestamp(hour * 3600, tz=timezone.utc)
+        return f"year={moment:%Y}/month={moment:%m}/day={moment:%d}/hour={moment:%H}"
+
+    def _write_hour(self, hour: int, output_dir: str) -> List[str]:
+        """把一个小时的溢写段归并写出到暂存目录，生成一个或多个 Parquet 文件"""
+        partition_dir = os.path.join(output_dir, self.partition_path(hour))
+        os.makedirs(partition_dir, exist_ok=True)
+        
+        files = []
+        writer = None
+        pending: List[pa.Table] = []
+        pending_rows = 0
+        
+        def flush_row_group(final: bool = False):
+            nonlocal writer, pending, pending_rows
+            while pending_rows >= self.row_group_size or (final and pending_rows):
+                table = pa.concat_tables(pending)
+                group, rest = table.slice(0, self.row_group_size), table.slice(self.row_group_size)
+                pending, pending_rows = [rest], rest.num_rows
+                
+                if writer is None:
+                    path = os.path.join(partition_dir, f"part-{self.run_id}-{len(files):05d}.parquet")
+                    writer = pq.ParquetWriter(
+                        path, FlowLogParser.ARROW_SCHEMA,
+                        compression=self.compression,
+                        use_dictionary=self.DICTIONARY_COLUMNS,
+                        write_statistics=True
+                    )
+                    files.append(path)
+                writer.write_table(group, row_group_size=self.row_group_size)
+                
+                # 按目标大小滚动输出文件
+                if os.path.getsize(files[-1]) >= self.target_file_size:
+                    writer.close()
+                    writer = None
+        
+        for chunk in self._merge_runs(hour):
+            pending.append(chunk)
+            pending_rows += chunk.num_rows
+            flush_row_group()
+        flush_row_group(final=True)
+        
+        if writer is not None:
+            writer.close()
+        return files
+
+    def finish(self) -> Dict:
+        """归并所有小时分区并写出数据集，返回合并摘要"""
+        self._spill()
+        
+        # 本地输出的暂存目录放在输出目录内 (以 . 开头，数据集扫描时会忽略)，保证可以原子重命名
+        if self.output.startswith('s3://'):
+            staging_dir = tempfile.mkdtemp(prefix='flowlog-compact-')
+        else:
+            os.makedirs(self.output, exist_ok=True)
+            staging_dir = tempfile.mkdtemp(prefix='.compact-', dir=self.output)
+        
+        summary = {'partitions': {}, 'files': 0, 'rows': 0, 'skipped_rows': self.skipped_rows,
+                   'duplicate_rows': self.duplicate_rows}
+        try:
+            for hour in sorted(self._runs):
+                new_rows = self._rows_by_hour[hour]
+                existing_rows = self._spill_existing(hour)
+                files = self._write_hour(hour, staging_dir)
+                partition = self.partition_path(hour)
+                
+                manifest = self._manifest(hour)
+                manifest_path = os.path.join(staging_dir, partition, self.MANIFEST)
+                with open(manifest_path, 'w') as f:
+                    json.dump({'files': [os.path.basename(path) for path in files],
+                               'sources': sorted(manifest['sources'] | self._sources.get(hour, set()))}, f, indent=2)
+                
+                summary['partitions'][partition] = {'rows': self._rows_by_hour[hour], 'new_rows': new_rows,
+                                                    'files': len(files)}
+                summary['files'] += len(files)
+                summary['rows'] += new_rows
+                logger.info(f"分区 {partition}: 新增 {new_rows} 行, 并入已有 {existing_rows} 行, {len(files)} 个文件")
+                
+                for path in self._runs[hour]:
+                    os.remove(path)
+                
+                if self.output.startswith('s3://'):
+                    # 清单在新文件之后上传，中途失败时重新执行仍按旧清单读取已有数据
+                    self._upload(staging_dir, partition, files + [manifest_path])
+                else:
+                    self._replace_partition(staging_dir, partition)
+        finally:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        
+        return summary
+
+    def _replace_partition(self, staging_dir: str, partition: str):
+        """用暂存目录中新写出的分区 (已包含原有的行) 整体替换输出目录中的同一分区"""
+        target = os.path.join(self.output, partition)
+        if os.path.isdir(target):
+            replaced = os.path.join(staging_dir, '.replaced')
+            os.rename(target, replaced)
+            shutil.rmtree(replaced)
+            logger.info(f"更新已有分区 {partition}")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.rename(os.path.join(staging_dir, partition), target)
+
+    def _upload(self, staging_dir: str, partition: str, files: List[str]):
+        """上传一个分区的新文件和清单，再删除该分区中以前写入的 part 文件 (其中的行已并入新文件)"""
+        bucket, prefix, partition_prefix = self._s3_location(partition)
+        previous = [obj['Key'] for obj in self.parser.list_s3_objects(bucket, partition_prefix + 'part-')]
+        
+        uploaded = set()
+        for path in files:
+            key = '/'.join(filter(None, [prefix, os.path.relpath(path, staging_dir)]))
+            logger.info(f"上传 {path} 到 s3://{bucket}/{key}")
+            self.parser.s3_client.upload_file(path, bucket, key)
+            uploaded.add(key)
+            os.remove(path)
+        
+        stale = [key for key in previous if key not in uploaded]
+        for start in range(0, len(stale), 1000):
+            self.parser.s3_client.delete_objects(
+                Bucket=bucket,
+                Delete={'Objects': [{'Key': key} for key in stale[start:start + 1000]], 'Quiet': True}
+            )
+        if stale:
+            logger.info(f"删除分区 {partition} 中旧的 {len(stale)} 个文件")
+
+def run_compaction(args, parser_tool: FlowLogParser):
+    """执行合并模式"""
+    compactor = FlowLogCompactor(
+        parser_tool,
+        args.compact,
+        sort_key=args.sort_key,
+        target_file_size=args.target_file_size_mb * 1024 * 1024,
+        row_group_size=args.row_group_size,
+        memory_rows=args.memory_rows,
+        spill_dir=args.spill_dir
+    )
+    
+    # 输入来源的标识写入分区清单，S3 对象使用 s3:// 路径而不是临时下载路径
+    if args.local_file:
+        files = [(args.local_file, None)]
+    elif args.local_dir:
+        files = [(str(path), None) for path in sorted(Path(args.local_dir).rglob('*.gz'))]
+    elif args.s3_file:
+        bucket, key = args.s3_file
+        files = [(parser_tool.download_from_s3(bucket, key), f"s3://{bucket}/{key}")]
+    else:
+        # 合并模式处理前缀下的全部文件，逐个下载以限制磁盘占用
+        bucket, prefix = args.s3_prefix
+        files = ((path, f"s3://{bucket}/{key}")
+                 for key, path in parser_tool.iter_s3_keys(bucket, parser_tool.list_s3_files(bucket, prefix)))
+    
+    for file_path, source in files:
+        compactor.add_file(file_path, source)
+    
+    summary = compactor.finish()
+    logger.info(f"合并完成: 新增 {summary['rows']} 行, {len(summary['partitions'])} 个分区, "
+                f"{summary['files']} 个文件, 跳过 {summary['skipped_rows']} 行, "
+                f"已合并过的 {summary['duplicate_rows']} 行")
+    return summary
+
+class FlowLogQuery:
+    """
+    Parquet 数据集上的即席聚合查询
+    
+    通过 pyarrow.dataset 扫描本地或 S3 上的 Parquet 数据集: 时间范围先转换为 Hive 分区
+    (year=/month=/day=/hour=) 条件裁剪文件，再按 start 列的行组 min/max 统计跳过行组；
+    只读取分组、聚合和过滤用到的列，扫描多线程执行，并按批次做部分聚合以限制内存。
+    """
+    
+    PARTITION_FIELDS = ('year', 'month', 'day', 'hour')
+    
+    WHERE_PATTERN = re.compile(r'^\s*(\w+)\s*(>=|<=|!=|=|>|<|\s+in\s+)\s*(.+?)\s*$', re.IGNORECASE)
+    
+    def __init__(self, path: str):
+        """
+        初始化查询
+        
+        Args:
+            path: 数据集路径 (本地目录、文件或 s3://bucket/prefix)
+        """
+        self.path = path
+        self.dataset = ds.dataset(path, format='parquet', partitioning='hive')
+        self.schema = self.dataset.schema
+
+    @staticmethod
+    def parse_time(value: str) -> int:
+        """
+        解析时间参数为 epoch 秒
+        
+        支持 epoch 秒、ISO 8601 (无时区时按 UTC) 以及相对时间 (如 30m、6h、2d 表示距今)
+        """
+        value = value.strip()
+        if value.isdigit():
+            return int(value)
+        
+        relative = re.fullmatch(r'(\d+)([smhd])', value)
+        if relative:
+            unit = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}[relative.group(2)]
+            moment = datetime.now(timezone.utc) - timedelta(**{unit: int(relative.group(1))})
+            return int(moment.timestamp())
+        
+        moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return int(moment.timestamp())
+
+    def _partition_filter(self, since: Optional[int], until: Optional[int]) -> Optional[ds.Expression]:
+        """把时间范围转换为 Hive 分区字段上的条件，用于裁剪文件"""
+        fields = []
+        for name in self.PARTITION_FIELDS:
+            if name not in self.schema.names:
+                break
+            fields.append(name)
+        if not fields:
+            return None
+        
+        # year*1000000 + month*10000 + day*100 + hour 可在分区裁剪时按常量折叠
+        key = None
+        for name in fields:
+            key = pc.field(name) if key is None else key * 100 + pc.field(name)
+        formats = ['%Y', '%Y%m', '%Y%m%d', '%Y%m%d%H']
+        
+        def partition_key(epoch: int) -> int:
+            return int(datetime.fromtimestamp(epoch, tz=timezone.utc).strftime(formats[len(fields) - 1]))
+        
+        expression = None
+        if since is not None:
+            expression = key >= partition_key(since)
+        if until is not None:
+            upper = key <= partition_key(until - 1)
+            expression = upper if expression is None else expression & upper
+        return expression
+
+    def _where_filter(self, predicate: str) -> Tuple[ds.Expression, str]:
+        """解析形如 dstport=443、action!=ACCEPT、protocol in 6,17 的条件"""
+        match = self.WHERE_PATTERN.match(predicate)
+        if not match:
+            raise ValueError(f"无法解析的条件: {predicate}")
+        
+        column, operator, raw_value = match.group(1), match.group(2).strip().lower(), match.group(3)
+        if column not in self.schema.names:
+            raise ValueError(f"未知字段: {column}")
+        
+        field_type = self.schema.field(column).type
+        
+        def convert(value: str):
+            value = value.strip().strip('\'"')
+            if pa.types.is_integer(field_type):
+                return int(value)
+            if pa.types.is_floating(field_type):
+                return float(value)
+            return value
+        
+        field = pc.field(column)
+        if operator == 'in':
+            return field.isin([convert(v) for v in raw_value.split(',')]), column
+        
+        value = convert(raw_value)
+        expression = {
+            '=': field == value, '!=': field != value, '>': field > value,
+            '>=': field >= value, '<': field < value, '<=': field <= value
+        }[operator]
+        return expression, column
+
+    def run(self, group_by: List[str], sums: List[str], since: Optional[int] = None,
+            until: Optional[int] = None, where: Optional[List[str]] = None,
+            order_by: Optional[str] = None, top: Optional[int] = None) -> pd.DataFrame:
+        """
+        执行聚合查询
+        
+        Args:
+            group_by: 分组字段
+            sums: 求和字段
+            since: 起始时间 (epoch 秒，按 start 过滤，包含)
+            until: 结束时间 (epoch 秒，按 start 过滤，不包含)
+            where: 附加过滤条件列表 (AND 组合)
+            order_by: 排序字段 (降序)，默认为第一个求和字段
+            top: 只返回前 N 行
+            
+        Returns:
+            聚合结果 DataFrame，流数列为 flows
+        """
+        for column in group_by + sums:
+            if column not in self.schema.names:
+                raise ValueError(f"未知字段: {column}")
+        
+        expressions = []
+        filter_columns = set()
+        if since is not None:
+            expressions.append(pc.field('start') >= since)
+        if until is not None:
+            expressions.append(pc.field('start') < until)
+        if since is not None or until is not None:
+            filter_columns.add('start')
+        for predicate in where or []:
+            expression, column = self._where_filter(predicate)
+            expressions.append(expression)
+            filter_columns.add(column)
+        
+        partition_filter = self._partition_filter(since, until)
+        if partition_filter is not None:
+            expressions.append(partition_filter)
+        
+        row_filter = None
+        for expression in expressions:
+            row_filter = expression if row_filter is None else row_filter & expression
+        
+        all_fragments = len(list(self.dataset.get_fragments()))
+        fragments = list(self.dataset.get_fragments(filter=partition_filter)) \
+            if partition_filter is not None else None
+        scanned = len(fragments) if fragments is not None else all_fragments
+        logger.info(f"分区裁剪后扫描 {scanned}/{all_fragments} 个文件")
+        
+        # 只读取分组和求和用到的列，过滤列由扫描器内部读取
+        columns = list(dict.fromkeys(group_by + sums))
+        scanner = self.dataset.scanner(
+            columns=columns or [self.schema.names[0]],
+            filter=row_filter,
+            use_threads=True,
+            batch_size=1 << 20
+        )
+        
+        # 部分聚合结果的列: 分组字段 + <字段>_sum + count_all
+        aggregations = [(column, 'sum') for column in sums] + [([], 'count_all')]
+        partial_columns = [f"{column}_sum" for column in sums] + ['count_all']
+        
+        def scalar_column(value: pa.Scalar) -> pa.Array:
+            return pa.array([value.as_py()], type=value.type)
+        
+        def combine(tables: List[pa.Table]) -> pa.Table:
+            table = pa.concat_tables(tables)
+            if not group_by:
+                return pa.table({name: scalar_column(pc.sum(table.column(name))) for name in partial_columns})
+            result = table.group_by(group_by).aggregate([(name, 'sum') for name in partial_columns])
+            return result.rename_columns([
+                name[:-len('_sum')] if name[:-len('_sum')] in partial_columns else name
+                for name in result.column_names
+            ])
+        
+        partials: List[pa.Table] = []
+        rows = 0
+        started = time.time()
+        
+        for batch in scanner.to_batches():
+            if not batch.num_rows:
+                continue
+            rows += batch.num_rows
+            table = pa.Table.from_batches([batch])
+            if group_by:
+                partials.append(table.group_by(group_by).aggregate(aggregations))
+            else:
+                partials.append(pa.table({
+                    **{f"{column}_sum": scalar_column(pc.sum(table.column(column))) for column in sums},
+                    'count_all': pa.array([batch.num_rows], type=pa.int64())
+                }))
+            
+            # 定期合并部分聚合结果，内存只与分组数量相关
+            if len(partials) >= 32:
+                partials = [combine(partials)]
+        
+        logger.info(f"扫描 {rows} 行, 耗时 {time.time() - started:.2f} 秒")
+        
+        if not partials:
+            return pd.DataFrame(columns=group_by + sums + ['flows'])
+        
+        df = combine(partials).to_pandas().rename(
+            columns={**{f"{column}_sum": column for column in sums}, 'count_all': 'flows'}
+        )
+        order_column = order_by or (sums[0] if sums else 'flows')
+        df = df.sort_values(order_column, ascending=False)
+        if top:
+            df = df.head(top)
+        return df.reset_index(drop=True)
+
+def query_main(argv: List[str]):
+    """query 子命令入口"""
+    parser = argparse.ArgumentParser(prog='flow-log-parser.py query', description='对 Parquet 数据集执行聚合查询')
+    parser.add_argument('dataset', help='数据集路径 (本地目录或 s3://bucket/prefix)')
+    parser.add_argument('--group-by', default='', help='分组字段 (逗号分隔)')
+    parser.add_argument('--sum', default='bytes,packets', help='求和字段 (逗号分隔)')
+    parser.add_argument('--since', help='起始时间: epoch 秒、ISO 8601 或相对时间 (如 6h)')
+    parser.add_argument('--until', help='结束时间: epoch 秒、ISO 8601 或相对时间')
+    parser.add_argument('--where', action='append', help='过滤条件，如 dstport=443、action!=ACCEPT、protocol in 6,17 (可多次指定)')
+    parser.add_argument('--order-by', help='排序字段 (降序)，默认为第一个求和字段')
+    parser.add_argument('--top', type=int, help='只输出前 N 行')
+    parser.add_argument('--threads', type=int, help='扫描线程数 (默认使用全部 CPU)')
+    parser.add_argument('--output', help='结果输出文件 (.json 或 .csv)')
+    
+    args = parser.parse_args(argv)
+    if args.threads:
+        pa.set_cpu_count(args.threads)
+        pa.set_io_thread_count(args.threads)
+    
+    def split(value: str) -> List[str]:
+        return [item.strip() for item in value.split(',') if item.strip()]
+    
+    query = FlowLogQuery(args.dataset)
+    result = query.run(
+        group_by=split(args.group_by),
+        sums=split(args.sum),
+        since=FlowLogQuery.parse_time(args.since) if args.since else None,
+        until=FlowLogQuery.parse_time(args.until) if args.until else None,
+        where=args.where,
+        order_by=args.order_by,
+        top=args.top
+    )
+    
+    print(result.to_string(index=False))
+    
+    if args.output:
+        if args.output.endswith('.csv'):
+            result.to_csv(args.output, index=False)
+        else:
+            result.to_json(args.output, orient='records', indent=2, force_ascii=False)
+        logger.info(f"查询结果已保存到: {args.output}")
+
+class FlowLogIpIndex:
+    """
+    单个 Flow Log 对象的 IP 查找索引 (sidecar 文件)
+    
+    记录对象中出现过的 srcaddr/dstaddr/pkt_srcaddr/pkt_dstaddr 地址的 Bloom 过滤器以及
+    start/end 的最小/最大值。本地文件的 sidecar 与原文件放在一起 (<文件>.ipidx)；S3 对象的 sidecar
+    写在单独的前缀下 (ipidx/<key>.ipidx)，不会被读取数据前缀的 Athena 表当作日志行。按 IP 搜索时先读取很小的
+    sidecar，只有时间范围重叠且可能包含该地址的对象才需要下载和解析。Bloom 过滤器按假阳性率
+    p 定长: 每个唯一地址约占 -ln(p) / ln(2)^2 位 (1% 约 9.6 位，0.1% 约 14.4 位)。
+    
+    文件格式: 4 字节魔数 FLIX + 4 字节大端头部长度 + JSON 头部 + 位数组。
+    """
+    
+    ADDRESS_FIELDS = ('srcaddr', 'dstaddr', 'pkt_srcaddr', 'pkt_dstaddr')
+    SUFFIX = '.ipidx'
+    S3_PREFIX = 'ipidx/'
+    MAGIC = b'FLIX'
+    VERSION = 1
+    
+    def __init__(self, num_bits: int, num_hashes: int, bits: Optional[bytearray] = None,
+                 min_time: Optional[int] = None, max_time: Optional[int] = None,
+                 addresses: int = 0, records: int = 0, source: Optional[Dict] = None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else bytearray((num_bits + 7) // 8)
+        self.min_time = min_time
+        self.max_time = max_time
+        self.addresses = addresses
+        self.records = records
+        self.source = source or {}
+    
+    @staticmethod
+    def pack_address(value: str) -> Optional[bytes]:
+        """把 IPv4/IPv6 文本地址规范化为 4/16 字节，无效地址返回 None"""
+        try:
+            return ipaddress.ip_address(value).packed
+        except ValueError:
+            return None
+    
+    @classmethod
+    def build(cls, records: Iterator[Dict], fp_rate: float = 0.01, source: Optional[Dict] = None) -> 'FlowLogIpIndex':
+        """
+        从解析后的记录构建索引
+        
+        Args:
+            records: parse_file 产生的记录
+            fp_rate: Bloom 过滤器的目标假阳性率
+            source: 原对象的标识 (大小、ETag 或 mtime)，搜索时用来判断 sidecar 是否过期
+        """
+        if not 0 < fp_rate < 1:
+            raise ValueError(f"假阳性率必须在 0 和 1 之间: {fp_rate}")
+        
+        # 先对文本去重，再只对唯一地址做规范化和哈希
+        texts = set()
+        min_time = max_time = None
+        count = 0
+        for record in records:
+            count += 1
+            for field in cls.ADDRESS_FIELDS:
+                value = record.get(field)
+                if value is not None:
+                    texts.add(value)
+            start, end = record.get('start'), record.get('end')
+            if start is not None and (min_time is None or start < min_time):
+                min_time = start
+            if end is not None and (max_time is None or end > max_time):
+                max_time = end
+        
+        addresses = {packed for packed in map(cls.pack_address, texts) if packed is not None}
+        n = max(len(addresses), 1)
+        num_bits = max(64, math.ceil(-n * math.log(fp_rate) / (math.log(2) ** 2)))
+        num_hashes = max(1, round(num_bits / n * math.log(2)))
+        
+        index = cls(num_bits, num_hashes, min_time=min_time, max_time=max_time,
+                    addresses=len(addresses), records=count, source=source)
+        for packed in addresses:
+            for position in index._positions(packed):
+                index.bits[position >> 3] |= 1 << (position & 7)
+        return index
+    
+    def _positions(self, packed: bytes) -> Iterator[int]:
+        """双重哈希: 由一个 128 位摘要派生 k 个位置"""
+        digest = hashlib.blake2b(packed, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+    
+    def might_contain(self, packed: bytes) -> bool:
+        """地址可能出现在对象中返回 True，返回 False 时一定不存在"""
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(packed))
+    
+    def overlaps(self, since: Optional[int], until: Optional[int]) -> bool:
+        """对象的时间范围是否与 [since, until) 重叠"""
+        if since is not None and self.max_time is not None and self.max_time < since:
+            return False
+        if until is not None and self.min_time is not None and self.min_time >= until:
+            return False
+        return True
+    
+    def to_bytes(self) -> bytes:
+        header = json.dumps({
+            'version': self.VERSION,
+            'num_bits': self.num_bits,
+            'num_hashes': self.num_hashes,
+            'min_time': self.min_time,
+            'max_time': self.max_time,
+            'addresses': self.addresses,
+            'records': self.records,
+            'source': self.source,
+        }, separators=(',', ':')).encode('utf-8')
+        return self.MAGIC + struct.pack('>I', len(header)) + header + bytes(self.bits)
+    
+    @classmethod
+    def s3_key(cls, key: str) -> str:
+        """S3 对象的 sidecar key"""
+        return cls.S3_PREFIX + key + cls.SUFFIX
+    
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'FlowLogIpIndex':
+        if data[:4] != cls.MAGIC:
+            raise ValueError("不是有效的 IP 索引文件")
+        (header_length,) = struct.unpack('>I', data[4:8])
+        header = json.loads(data[8:8 + header_length])
+        if header['version'] != cls.VERSION:
+            raise ValueError(f"不支持的索引版本: {header['version']}")
+        if len(data) - 8 - header_length != (header['num_bits'] + 7) // 8:
+            raise ValueError("IP 索引文件被截断")
+        return cls(
+            header['num_bits'], header['num_hashes'], bytearray(data[8 + header_length:]),
+            min_time=header['min_time'], max_time=header['max_time'],
+            addresses=header['addresses'], records=header['records'], source=header['source']
+        )
+
+def local_source(file_path: str) -> Dict:
+    """本地文件的标识 (纳秒精度的 mtime，同一秒内改写的同样大小的文件也能区分)"""
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def s3_source(obj: Dict) -> Dict:
+    """S3 对象的标识 (来自 list_objects_v2 的条目)"""
+    return {'size': obj['Size'], 'etag': obj['ETag']}
+
+def list_s3_data(parser_tool: FlowLogParser, args) -> Tuple[str, str, List[Dict]]:
+    """列出 --s3-file/--s3-prefix 对应的数据对象，返回 (bucket, 前缀, 对象列表)"""
+    if args.s3_file:
+        bucket, prefix = args.s3_file
+        data = [obj for obj in parser_tool.list_s3_objects(bucket, prefix) if obj['Key'] == prefix]
+    else:
+        bucket, prefix = args.s3_prefix
+        data = [obj for obj in parser_tool.list_s3_objects(bucket, prefix) if obj['Key'].endswith('.gz')]
+    return bucket, prefix, data
+
+def list_s3_targets(parser_tool: FlowLogParser, args) -> Tuple[str, List[Dict], Dict[str, Dict]]:
+    """列出 --s3-file/--s3-prefix 对应的数据对象和已有的 sidecar (位于 ipidx/ 前缀下)"""
+    bucket, prefix, data = list_s3_data(parser_tool, args)
+    sidecars = {obj['Key']: obj for obj in parser_tool.list_s3_objects(bucket, FlowLogIpIndex.S3_PREFIX + prefix)
+                if obj['Key'].endswith(FlowLogIpIndex.SUFFIX)}
+    return bucket, data, sidecars
+
+def run_indexing(args, parser_tool: FlowLogParser):
+    """执行索引模式: 为每个对象写入 IP 索引 sidecar"""
+    summary = {'objects': 0, 'records': 0, 'bytes': 0, 'index_bytes': 0}
+    
+    def record(index: FlowLogIpIndex, size: int, data: bytes):
+        summary['objects'] += 1
+        summary['records'] += index.records
+        summary['bytes'] += size
+        summary['index_bytes'] += len(data)
+    
+    if args.local_file or args.local_dir:
+        files = [args.local_file] if args.local_file else sorted(str(path) for path in Path(args.local_dir).rglob('*.gz'))
+        for file_path in files:
+            source = local_source(file_path)
+            index = FlowLogIpIndex.build(parser_tool.parse_file(file_path), args.index_fp_rate, source)
+            data = index.to_bytes()
+            with open(file_path + FlowLogIpIndex.SUFFIX, 'wb') as f:
+                f.write(data)
+            record(index, source['size'], data)
+    else:
+        bucket, objects, _ = list_s3_targets(parser_tool, args)
+        sources = {obj['Key']: s3_source(obj) for obj in objects}
+        for key, file_path in parser_tool.iter_s3_keys(bucket, list(sources)):
+            index = FlowLogIpIndex.build(parser_tool.parse_file(file_path), args.index_fp_rate, sources[key])
+            data = index.to_bytes()
+            parser_tool.s3_client.put_object(Bucket=bucket, Key=FlowLogIpIndex.s3_key(key), Body=data)
+            record(index, sources[key]['size'], data)
+    
+    ratio = summary['index_bytes'] / summary['bytes'] * 100 if summary['bytes'] else 0
+    logger.info(f"索引完成: {summary['objects']} 个对象, {summary['records']} 条记录, "
+                f"索引 {summary['index_bytes']:,} 字节 (原始数据的 {ratio:.2f}%)")
+    return summary
+
+def load_cached_inputs(args, parser_tool: FlowLogParser) -> pa.Table:
+    """通过解析缓存加载输入: 命中时 mmap 读取，未命中时解析并写入缓存；S3 对象命中时不下载"""
+    tables = []
+    
+    if args.local_file or args.local_dir:
+        files = [args.local_file] if args.local_file else sorted(str(path) for path in Path(args.local_dir).rglob('*.gz'))
+        for file_path in files:
+            source = {'path': os.path.abspath(file_path), **local_source(file_path)}
+            table = parser_tool.read_cache(args.cache_dir, source)
+            if table is None:
+                table = parser_tool.write_cache(args.cache_dir, source, parser_tool.build_table(file_path))
+            tables.append(table)
+    else:
+        bucket, _, objects = list_s3_data(parser_tool, args)
+        if args.s3_prefix:
+            objects = objects[:10]  # 与非缓存模式一致，限制处理前10个文件
+        
+        sources = {obj['Key']: {'path': f"s3://{bucket}/{obj['Key']}", **s3_source(obj)} for obj in objects}
+        missing = []
+        for key, source in sources.items():
+            table = parser_tool.read_cache(args.cache_dir, source)
+            if table is None:
+                missing.append(key)
+            tables.append(table)
+        
+        built = {}
+        for key, file_path in parser_tool.iter_s3_keys(bucket, missing):
+            built[key] = parser_tool.write_cache(args.cache_dir, sources[key], parser_tool.build_table(file_path))
+        tables = [table if table is not None else built[key] for key, table in zip(sources, tables)]
+    
+    if not tables:
+        return parser_tool.ARROW_SCHEMA.empty_table()
+    
+    # 各文件的表直接拼接为多块表，不复制数据
+    table = pa.concat_tables([table.replace_schema_metadata(None) for table in tables])
+    if args.limit:
+        table = table.slice(0, args.limit)
+    return table
+
+class FlowLogIpSearch:
+    """
+    按 IP 搜索 Flow Log 对象
+    
+    先并发读取各对象的 sidecar，按时间范围和 Bloom 过滤器排除不可能匹配的对象，只下载和解析
+    剩余的候选对象。没有 sidecar 或 sidecar 已过期 (对象大小、ETag/mtime 变化) 的对象
+    默认仍会扫描，以保证结果完整。
+    """
+    
+    def __init__(self, parser: FlowLogParser, ips: List[str], since: Optional[int] = None,
+                 until: Optional[int] = None, workers: int = 16, indexed_only: bool = False):
+        self.parser = parser
+        self.since = since
+        self.until = until
+        self.workers = workers
+        self.indexed_only = indexed_only
+        
+        self.addresses = set()
+        self.texts = set()
+        for ip in ips:
+            packed = FlowLogIpIndex.pack_address(ip)
+            if packed is None:
+                raise ValueError(f"无效的 IP 地址: {ip}")
+            self.addresses.add(packed)
+            self.texts.update((ip, str(ipaddress.ip_address(ip))))
+        
+        self.stats = {
+            'objects': 0, 'indexed': 0, 'candidates': 0, 'matches': 0,
+            'total_bytes': 0, 'index_bytes': 0, 'scanned_bytes': 0,
+        }
+    
+    def _needs_scan(self, name: str, source: Dict, data: Optional[bytes]) -> bool:
+        """根据 sidecar 判断对象是否需要下载扫描"""
+        self.stats['objects'] += 1
+        self.stats['total_bytes'] += source['size']
+        
+        index = None
+        if data is not None:
+            self.stats['index_bytes'] += len(data)
+            try:
+                index = FlowLogIpIndex.from_bytes(data)
+            except (ValueError, KeyError, TypeError, struct.error) as e:
+                # 损坏的 sidecar 按没有索引处理
+                logger.warning(f"忽略损坏的 IP 索引 {name}: {e}")
+        
+        if index is not None:
+            if index.source == source:
+                self.stats['indexed'] += 1
+                if not index.overlaps(self.since, self.until):
+                    return False
+                if not any(index.might_contain(packed) for packed in self.addresses):
+                    return False
+            elif self.indexed_only:
+                return False
+        elif self.indexed_only:
+            return False
+        
+        self.stats['candidates'] += 1
+        self.stats['scanned_bytes'] += source['size']
+        return True
+    
+    def _matches(self, record: Dict) -> bool:
+        if self.since is not None and (record['end'] or 0) < self.since:
+            return False
+        if self.until is not None and (record['start'] or 0) >= self.until:
+            return False
+        for field in FlowLogIpIndex.ADDRESS_FIELDS:
+            value = record[field]
+            if value is None:
+                continue
+            if value in self.texts:
+                return True
+            # IPv6 可能有多种文本写法，按规范化后的字节比较
+            if ':' in value and FlowLogIpIndex.pack_address(value) in self.addresses:
+                return True
+        return False
+    
+    def _scan(self, file_path: str) -> Iterator[Dict]:
+        for record in self.parser.parse_file(file_path):
+            if self._matches(record):
+                self.stats['matches'] += 1
+                yield record
+    
+    def search_local(self, files: List[str]) -> Iterator[Dict]:
+        """搜索本地文件，sidecar 位于文件旁边"""
+        def load(file_path: str) -> Optional[bytes]:
+            try:
+                with open(file_path + FlowLogIpIndex.SUFFIX, 'rb') as f:
+                    return f.read()
+            except FileNotFoundError:
+                return None
+        
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            sidecars = list(executor.map(load, files))
+        
+        for file_path, data in zip(files, sidecars):
+            if self._needs_scan(file_path, local_source(file_path), data):
+                yield from self._scan(file_path)
+    
+    def search_s3(self, bucket: str, objects: List[Dict], sidecars: Dict[str, Dict]) -> Iterator[Dict]:
+        """搜索 S3 对象，先并发读取全部 sidecar，再逐个下载候选对象"""
+        def load(obj: Dict) -> Optional[bytes]:
+            sidecar_key = FlowLogIpIndex.s3_key(obj['Key'])
+            if sidecar_key not in sidecars:
+                return None
+            return self.parser.s3_client.get_object(Bucket=bucket, Key=sidecar_key)['Body'].read()
+        
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            loaded = list(executor.map(load, objects))
+        
+        candidates = [obj['Key'] for obj, data in zip(objects, loaded) if self._needs_scan(obj['Key'], s3_source(obj), data)]
+        logger.info(f"{len(objects)} 个对象中有 {len(candidates)} 个候选对象需要扫描")
+        
+        for _, file_path in self.parser.iter_s3_keys(bucket, candidates):
+            yield from self._scan(file_path)
+
+def search_main(argv: List[str]):
+    """search 子命令入口"""
+    parser = argparse.ArgumentParser(prog='flow-log-parser.py search', description='借助 IP 索引 sidecar 按 IP 搜索 Flow Logs')
+    parser.add_argument('--ip', action='append', required=True, help='要搜索的 IP 地址 (可多次指定)')
+    
+    input_group = parser.add_mutually_exclusive_group(required=True)
+    input_group.add_argument('--local-file', help='本地文件路径')
+    input_group.add_argument('--s3-file', nargs=2, metavar=('BUCKET', 'KEY'), help='S3 文件 (bucket key)')
+    input_group.add_argument('--s3-prefix', nargs=2, metavar=('BUCKET', 'PREFIX'), help='S3 前缀 (搜索多个文件)')
+    input_group.add_argument('--local-dir', help='本地目录 (搜索其中所有 .gz 文件)')
+    
+    parser.add_argument('--since', help='起始时间: epoch 秒、ISO 8601 或相对时间 (如 6h)')
+    parser.add_argument('--until', help='结束时间: epoch 秒、ISO 8601 或相对时间')
+    parser.add_argument('--indexed-only', action='store_true', help='跳过没有 sidecar 或 sidecar 已过期的对象')
+    parser.add_argument('--workers', type=int, default=16, help='并发读取 sidecar 的线程数')
+    parser.add_argument('--format', choices=['json', 'csv', 'parquet'], default='json', help='输出格式')
+    parser.add_argument('--output', help='输出文件路径')
+    
+    args = parser.parse_args(argv)
+    
+    parser_tool = FlowLogParser()
+    search = FlowLogIpSearch(
+        parser_tool,
+        args.ip,
+        since=FlowLogQuery.parse_time(args.since) if args.since else None,
+        until=FlowLogQuery.parse_time(args.until) if args.until else None,
+        workers=args.workers,
+        indexed_only=args.indexed_only
+    )
+    
+    if args.local_file or args.local_dir:
+        files = [args.local_file] if args.local_file else sorted(str(path) for path in Path(args.local_dir).rglob('*.gz'))
+        records = list(search.search_local(files))
+    else:
+        bucket, objects, sidecars = list_s3_targets(parser_tool, args)
+        records = list(search.search_s3(bucket, objects, sidecars))
+    
+    stats = search.stats
+    touched = stats['index_bytes'] + stats['scanned_bytes']
+    ratio = touched / stats['total_bytes'] * 100 if stats['total_bytes'] else 0
+    print(f"\n=== IP 搜索结果 ===")
+    print(f"对象数: {stats['objects']:,} (有效索引 {stats['indexed']:,}, 扫描 {stats['candidates']:,})")
+    print(f"读取字节: {touched:,} / {stats['total_bytes']:,} ({ratio:.2f}%)")
+    print(f"匹配记录: {stats['matches']:,}")
+    
+    if records:
+        output_path = args.output or f'flow_logs_search.{args.format}'
+        if args.format == 'json':
+            parser_tool.save_as_json(records, output_path)
+        elif args.format == 'csv':
+            parser_tool.save_as_csv(records, output_path)
+        elif args.format == 'parquet':
+            parser_tool.save_as_parquet(records, output_path)
+        logger.info(f"搜索结果已保存到: {output_path}")
+
+class FlowLogValidator:
+    """
+    只校验不解析的快速验证器
+
+    逐行扫描原始字节，不构造记录字典。每行先用一个预编译的整行正则 (字段数、数值字段、version、
+    IPv4 地址、action/log_status 枚举) 匹配，再比较 start <= end；只有匹配失败的行才逐字段检查以确定错误类别
+    (IPv6 地址在这一步通过 ipaddress 校验)。结果是按错误类别汇总的直方图，每个类别保留少量样例行。
+    """
+    
+    VERSION = b'5'
+    ACTIONS = {b'ACCEPT', b'REJECT'}
+    LOG_STATUSES = {b'OK', b'NODATA', b'SKIPDATA'}
+    ADDRESS_FIELDS = {'srcaddr', 'dstaddr', 'pkt_srcaddr', 'pkt_dstaddr'}
+    SAMPLE_LENGTH = 300
+    CHUNK_SIZE = 1 << 20
+    
+    _IPV4 = rb'(?:(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])\.){3}(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])'
+    
+    def __init__(self, samples: int = 3):
+        self.samples = samples
+        self.files = 0
+        self.lines = 0
+        self.invalid_lines = 0
+        self.errors: Dict[str, int] = {}
+        self.examples: Dict[str, List[Dict]] = {}
+        self.invalid_files: Dict[str, int] = {}
+        
+        patterns = []
+        for name in FlowLogParser.FIELD_NAMES:
+            if name == 'version':
+                patterns.append(re.escape(self.VERSION))
+            elif name in ('start', 'end'):
+                patterns.append(rb'([0-9]+)')
+            elif name in FlowLogParser.NUMERIC_FIELDS:
+                patterns.append(rb'(?:[0-9]+|-)')
+            elif name in self.ADDRESS_FIELDS:
+                patterns.append(rb'(?:' + self._IPV4 + rb'|-)')
+            elif name == 'action':
+                patterns.append(rb'(?:ACCEPT|REJECT|-)')
+            elif name == 'log_status':
+                patterns.append(rb'(?:OK|NODATA|SKIPDATA)')
+            else:
+                patterns.append(rb'[^ ]+')
+        self._line_pattern = re.compile(rb' '.join(patterns))
+        self._ipv4_pattern = re.compile(self._IPV4)
+        self._number_pattern = re.compile(rb'[0-9]+')
+    
+    def classify(self, fields: List[bytes]) -> List[str]:
+        """逐字段检查未通过快速匹配的行，返回错误类别"""
+        if len(fields) != len(FlowLogParser.FIELD_NAMES):
+            return ['field_count']
+        
+        errors = []
+        values = dict(zip(FlowLogParser.FIELD_NAMES, fields))
+        for name, value in values.items():
+            if name == 'version':
+                if value != self.VERSION:
+                    errors.append('version')
+            elif name in FlowLogParser.NUMERIC_FIELDS:
+                if value == b'-' and name not in ('start', 'end'):
+                    continue
+                if not self._number_pattern.fullmatch(value):
+                    errors.append(f'numeric:{name}')
+            elif name in self.ADDRESS_FIELDS:
+                if value == b'-' or self._ipv4_pattern.fullmatch(value):
+                    continue
+                try:
+                    if b':' not in value:
+                        raise ValueError(value)
+                    ipaddress.IPv6Address(value.decode('ascii'))
+                except (ValueError, UnicodeDecodeError):
+                    errors.append(f'ip:{name}')
+            elif name == 'action':
+                if value != b'-' and value not in self.ACTIONS:
+                    errors.append('action')
+            elif name == 'log_status':
+                if value not in self.LOG_STATUSES:
+                    errors.append('log_status')
+            elif not value:
+                errors.append(f'empty:{name}')
+        
+        start, end = values['start'], values['end']
+        if not errors and self._number_pattern.fullmatch(start) and self._number_pattern.fullmatch(end) and int(start) > int(end):
+            errors.append('start_after_end')
+        return errors
+    
+    def _record(self, file_path: str, line_num: int, line: bytes, errors: List[str]):
+        self.invalid_lines += 1
+        self.invalid_files[file_path] = self.invalid_files.get(file_path, 0) + 1
+        for error in errors:
+            self.errors[error] = self.errors.get(error, 0) + 1
+            examples = self.examples.setdefault(error, [])
+            if len(examples) < self.samples:
+                examples.append({
+                    'file': file_path,
+                    'line': line_num,
+                    'text': line[:self.SAMPLE_LENGTH].decode('utf-8', errors='replace')
+                })
+    
+    def validate_file(self, file_path: str, name: Optional[str] = None):
+        """校验一个文件，name 为报告中使用的文件名 (S3 对象为 s3://bucket/key)"""
+        name = name or file_path
+        match = self._line_pattern.fullmatch
+        lines = 0
+        
+        open_func = gzip.open if file_path.endswith('.gz') else open
+        line_num = 0
+        try:
+            with open_func(file_path, 'rb') as f:
+                remainder = b''
+                while True:
+                    # 按块读取后切分，比逐行迭代 GzipFile 快得多
+                    chunk = f.read(self.CHUNK_SIZE)
+                    if chunk:
+                        chunk_lines = (remainder + chunk).split(b'\n')
+                        remainder = chunk_lines.pop()
+                    else:
+                        chunk_lines, remainder = [remainder], b''
+                    
+                    for line in chunk_lines:
+                        line_num += 1
+                        result = match(line)
+                        if result is None:
+                            line = line.strip()
+                            if not line or line.startswith(b'version '):
+                                continue
+                            result = match(line)
+                        lines += 1
+                        
+                        if result is not None:
+                            start, end = result.groups()
+                            # 等长时按字节比较即可，避免转换为整数
+                            if start > end if len(start) == len(end) else int(start) > int(end):
+                                self._record(name, line_num, line, ['start_after_end'])
+                            continue
+                        
+                        errors = self.classify(line.split(b' '))
+                        if errors:
+                            self._record(name, line_num, line, errors)
+                    
+                    if not chunk:
+                        break
+        except (OSError, EOFError, gzip.BadGzipFile, zlib.error) as e:
+            # 压缩流损坏 (含 deflate 数据错误) 或被截断
+            self._record(name, line_num + 1, str(e).encode(), ['corrupt_file'])
+        
+        self.files += 1
+        self.lines += lines
+    
+    def merge(self, other: 'FlowLogValidator'):
+        """合并另一个验证器的结果"""
+        self.files += other.files
+        self.lines += other.lines
+        self.invalid_lines += other.invalid_lines
+        for error, count in other.errors.items():
+            self.errors[error] = self.errors.get(error, 0) + count
+        for error, examples in other.examples.items():
+            merged = self.examples.setdefault(error, [])
+            merged.extend(examples[:self.samples - len(merged)])
+        for file_path, count in other.invalid_files.items():
+            self.invalid_files[file_path] = self.invalid_files.get(file_path, 0) + count
+    
+    def to_dict(self) -> Dict:
+        return {
+            'files': self.files,
+            'lines': self.lines,
+            'invalid_lines': self.invalid_lines,
+            'errors': dict(sorted(self.errors.items(), key=lambda item: -item[1])),
+            'examples': self.examples,
+            'invalid_files': self.invalid_files,
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict, samples: int = 3) -> 'FlowLogValidator':
+        validator = cls(samples)
+        validator.files = data['files']
+        validator.lines = data['lines']
+        validator.invalid_lines = data['invalid_lines']
+        validator.errors = data['errors']
+        validator.examples = data['examples']
+        validator.invalid_files = data['invalid_files']
+        return validator
+
+def validate_source(source, samples: int) -> FlowLogValidator:
+    """校验一个文件，source 为本地路径或 (bucket, key)"""
+    validator = FlowLogValidator(samples)
+    if isinstance(source, str):
+        validator.validate_file(source)
+    else:
+        bucket, key = source
+        fd, local_path = tempfile.mkstemp(suffix=Path(key).name)
+        os.close(fd)
+        try:
+            FlowLogParser().download_from_s3(bucket, key, local_path)
+            validator.validate_file(local_path, f"s3://{bucket}/{key}")
+        finally:
+            os.remove(local_path)
+    return validator
+
+def _validate_source_in_worker(source, samples: int) -> Dict:
+    """worker 进程入口，结果序列化后返回给父进程"""
+    return validate_source(source, samples).to_dict()
+
+def run_validation(args, parser_tool: FlowLogParser) -> FlowLogValidator:
+    """验证模式: 多进程并行校验所有输入文件，汇总错误直方图"""
+    if args.local_file or args.local_dir:
+        sources = [args.local_file] if args.local_file else sorted(str(path) for path in Path(args.local_dir).rglob('*.gz'))
+    elif args.s3_file:
+        sources = [tuple(args.s3_file)]
+    else:
+        bucket, prefix = args.s3_prefix
+        sources = [(bucket, key) for key in parser_tool.list_s3_files(bucket, prefix)]
+    
+    validator = FlowLogValidator(args.samples)
+    if args.workers > 1 and len(sources) > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            for partial in executor.map(_validate_source_in_worker, sources, [args.samples] * len(sources)):
+                validator.merge(FlowLogValidator.from_dict(partial, args.samples))
+    else:
+        for source in sources:
+            validator.merge(validate_source(source, args.samples))
+    
+    report = validator.to_dict()
+    print(f"\n=== Flow Log 验证报告 ===")
+    print(f"文件数: {report['files']:,} (有错误 {len(report['invalid_files']):,})")
+    print(f"记录行数: {report['lines']:,}")
+    print(f"无效行数: {report['invalid_lines']:,}")
+    
+    if report['errors']:
+        print(f"\n错误分布:")
+        for error, count in report['errors'].items():
+            print(f"  {error}: {count:,}")
+            for example in report['examples'][error]:
+                print(f"    {example['file']}:{example['line']}: {example['text']}")
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        logger.info(f"验证报告已保存到: {args.output}")
+    
+    return validator
+
+class FlowLogSampler:
+    """
+    两阶段抽样统计
+
+    第一阶段从全部对象中无放回地随机抽取一部分对象，第二阶段在每个抽中的对象内按行抽样:
+    伯努利抽样 (每行以固定概率入选，用几何分布跳过未入选的行) 或蓄水池抽样 (每个对象固定保留 k 行)。
+    只解析入选的行。总量和分布按两阶段整群抽样的展开估计量放大，方差包含对象间和对象内两部分，
+    据此给出正态近似的置信区间。
+    """
+    
+    # 求和型指标，其余为计数型 (每行贡献 0 或 1)
+    SUM_FIELDS = ('bytes', 'packets')
+    TOP_FIELDS = {'top_sources': 'srcaddr', 'top_destinations': 'dstaddr'}
+    
+    def __init__(self, parser: FlowLogParser, object_fraction: float = 0.05, row_fraction: float = 1.0,
+                 reservoir: Optional[int] = None, seed: Optional[int] = None, confidence: float = 0.95):
+        self.parser = parser
+        self.object_fraction = object_fraction
+        self.row_fraction = row_fraction
+        self.reservoir = reservoir
+        self.seed = seed if seed is not None else int(time.time())
+        self.confidence = confidence
+        self.rng = random.Random(self.seed)
+        
+        self.objects_total = 0
+        self.objects_sampled = 0
+        self.rows_read = 0
+        self.rows_sampled = 0
+        self.time_range: List[Optional[datetime]] = [None, None]
+        self.sources = set()
+        self.destinations = set()
+        # 每个指标在各抽中对象上的估计值之和、平方和，以及对象内方差之和
+        self._totals: Dict[Tuple, float] = {}
+        self._squares: Dict[Tuple, float] = {}
+        self._variances: Dict[Tuple, float] = {}
+    
+    def choose_objects(self, objects: List) -> List:
+        """第一阶段: 随机抽取对象，对象多于一个时至少抽两个，以便估计对象间方差"""
+        self.objects_total = len(objects)
+        count = min(len(objects), max(2, round(len(objects) * self.object_fraction)))
+        chosen = self.rng.sample(objects, count)
+        logger.info(f"从 {len(objects)} 个对象中抽取 {count} 个 (种子 {self.seed})")
+        return sorted(chosen)
+    
+    def _sample_lines(self, lines: Iterator[str]) -> Tuple[List[str], int]:
+        """第二阶段: 返回 (入选的行, 对象的总行数)"""
+        if self.reservoir:
+            # 蓄水池抽样 (Algorithm L)，按几何分布跳过不会入选的行
+            k = self.reservoir
+            sample = []
+            count = 0
+            weight = 1.0
+            next_pick = k
+            for line in lines:
+                count += 1
+                if count <= k:
+                    sample.append(line)
+                    if count == k:
+                        weight = math.exp(math.log(self.rng.random()) / k)
+                        next_pick = k + math.floor(math.log(self.rng.random()) / math.log(1 - weight)) + 1
+                elif count == next_pick:
+                    sample[self.rng.randrange(k)] = line
+                    weight *= math.exp(math.log(self.rng.random()) / k)
+                    next_pick += math.floor(math.log(self.rng.random()) / math.log(1 - weight)) + 1
+            return sample, count
+        
+        if self.row_fraction >= 1:
+            sample = list(lines)
+            return sample, len(sample)
+        
+        # 伯努利抽样: 相邻入选行的间隔服从几何分布
+        log_skip = math.log(1 - self.row_fraction)
+        sample = []
+        count = 0
+        next_pick = math.floor(math.log(1 - self.rng.random()) / log_skip) + 1
+        for line in lines:
+            count += 1
+            if count == next_pick:
+                sample.append(line)
+                next_pick += math.floor(math.log(1 - self.rng.random()) / log_skip) + 1
+        return sample, count
+    
+    def add_file(self, file_path: str):
+        """对一个抽中的对象做行抽样并累计估计值"""
+        open_func = gzip.open if file_path.endswith('.gz') else open
+        with open_func(file_path, 'rt', encoding='utf-8') as f:
+            first = f.readline()
+            lines = f if first.startswith('version ') else itertools.chain([first], f)
+            sample, count = self._sample_lines(lines)
+        
+        sums: Dict[Tuple, float] = {}
+        squares: Dict[Tuple, float] = {}
+        for line in sample:
+            try:
+                record = self.parser.parse_line(line.strip())
+            except ValueError:
+                # 无效行不计为记录，但仍占用抽样名额
+                continue
+            if record is None:
+                continue
+            
+            keys = [
+                ('total_records',),
+                ('action_breakdown', record['action']),
+                ('protocol_breakdown', record['protocol_name']),
+                ('top_sources', record['srcaddr']),
+                ('top_destinations', record['dstaddr']),
+                ('top_ports', 'source', record['srcport']),
+                ('top_ports', 'destination', record['dstport']),
+            ]
+            for key in keys:
+                sums[key] = sums.get(key, 0) + 1
+            for field in self.SUM_FIELDS:
+                value = record[field] or 0
+                sums[(field,)] = sums.get((field,), 0) + value
+                squares[(field,)] = squares.get((field,), 0) + value * value
+            
+            self.sources.add(record['srcaddr'])
+            self.destinations.add(record['dstaddr'])
+            if record['start_time'] and (self.time_range[0] is None or record['start_time'] < self.time_range[0]):
+                self.time_range[0] = record['start_time']
+            if record['end_time'] and (self.time_range[1] is None or record['end_time'] > self.time_range[1]):
+                self.time_range[1] = record['end_time']
+        
+        sampled = len(sample)
+        self.objects_sampled += 1
+        self.rows_read += count
+        self.rows_sampled += sampled
+        
+        for key, total in sums.items():
+            # 计数型指标的平方和等于和
+            square = squares.get(key, total)
+            if sampled == count:
+                estimate, variance = total, 0.0
+            elif self.reservoir:
+                # 对象内无放回简单随机抽样
+                spread = (square - total * total / sampled) / (sampled - 1) if sampled > 1 else 0.0
+                estimate = count / sampled * total
+                variance = count * count * (1 - sampled / count) * spread / sampled
+            else:
+                # 伯努利抽样的 Horvitz-Thompson 估计
+                p = self.row_fraction
+                estimate = total / p
+                variance = square * (1 - p) / (p * p)
+            
+            self._totals[key] = self._totals.get(key, 0) + estimate
+            self._squares[key] = self._squares.get(key, 0) + estimate * estimate
+            self._variances[key] = self._variances.get(key, 0) + variance
+    
+    def estimate(self, key: Tuple) -> Dict:
+        """指标的总体估计值和置信区间"""
+        objects, sampled = self.objects_total, self.objects_sampled
+        total = self._totals.get(key, 0)
+        estimate = objects / sampled * total
+        
+        variance = objects / sampled * self._variances.get(key, 0)
+        if sampled < objects:
+            # 未出现该指标的抽中对象按 0 计入对象间方差
+            spread = (self._squares.get(key, 0) - total * total / sampled) / (sampled - 1)
+            variance += objects * objects * (1 - sampled / objects) * spread / sampled
+        
+        margin = NormalDist().inv_cdf(0.5 + self.confidence / 2) * math.sqrt(max(variance, 0))
+        return {
+            'estimate': round(estimate),
+            'low': max(round(estimate - margin), 0),
+            'high': round(estimate + margin),
+        }
+    
+    def _breakdown(self, *prefix, limit: Optional[int] = None) -> Dict:
+        keys = [key for key in self._totals if key[:len(prefix)] == prefix]
+        keys.sort(key=lambda key: -self._totals[key])
+        return {key[len(prefix)]: self.estimate(key) for key in keys[:limit]}
+    
+    def generate_stats(self) -> Dict:
+        """与 FlowLogParser.generate_stats 结构相同的统计报告，数值为估计值和置信区间"""
+        if not self.objects_sampled:
+            return {}
+        
+        return {
+            'sampling': {
+                'objects_total': self.objects_total,
+                'objects_sampled': self.objects_sampled,
+                'row_method': 'reservoir' if self.reservoir else ('bernoulli' if self.row_fraction < 1 else 'all'),
+                'row_fraction': self.row_fraction,
+                'reservoir_size': self.reservoir,
+                'rows_read': self.rows_read,
+                'rows_sampled': self.rows_sampled,
+                'seed': self.seed,
+                'confidence': self.confidence,
+            },
+            'total_records': self.estimate(('total_records',)),
+            'time_range': {
+                'start': self.time_range[0].isoformat() if self.time_range[0] else None,
+                'end': self.time_range[1].isoformat() if self.time_range[1] else None,
+            },
+            'traffic_summary': {
+                'total_bytes': self.estimate(('bytes',)),
+                'total_packets': self.estimate(('packets',)),
+                # 唯一值数量不能按比例放大，只报告样本中出现的数量 (总体的下界)
+                'unique_sources': len(self.sources),
+                'unique_destinations': len(self.destinations),
+            },
+            'action_breakdown': self._breakdown('action_breakdown'),
+            'protocol_breakdown': self._breakdown('protocol_breakdown'),
+            'top_sources': self._breakdown('top_sources', limit=10),
+            'top_destinations': self._breakdown('top_destinations', limit=10),
+            'top_ports': {
+                'source': self._breakdown('top_ports', 'source', limit=10),
+                'destination': self._breakdown('top_ports', 'destination', limit=10),
+            }
+        }
+
+def run_sampling(args, parser_tool: FlowLogParser):
+    """抽样模式: 抽取部分对象和行，输出带置信区间的估计统计"""
+    sampler = FlowLogSampler(
+        parser_tool,
+        object_fraction=args.sample,
+        row_fraction=args.sample_rows,
+        reservoir=args.reservoir,
+        seed=args.seed,
+        confidence=args.confidence
+    )
+    
+    if args.local_file or args.local_dir:
+        files = [args.local_file] if args.local_file else sorted(str(path) for path in Path(args.local_dir).rglob('*.gz'))
+        for file_path in sampler.choose_objects(files):
+            sampler.add_file(file_path)
+    else:
+        if args.s3_file:
+            bucket, key = args.s3_file
+            keys = [key]
+        else:
+            bucket, prefix = args.s3_prefix
+            keys = parser_tool.list_s3_files(bucket, prefix)
+        for _, local_path in parser_tool.iter_s3_keys(bucket, sampler.choose_objects(keys)):
+            sampler.add_file(local_path)
+    
+    stats = sampler.generate_stats()
+    if not stats:
+        logger.warning("没有可抽样的文件")
+        return
+    
+    stats_output = args.output.replace('.json', '_stats.json') if args.output else 'flow_log_stats.json'
+    with open(stats_output, 'w', encoding='utf-8') as f:
+        json.dump(stats, f, indent=2, default=str)
+    logger.info(f"统计报告已保存到: {stats_output}")
+    
+    def show(value: Dict) -> str:
+        return f"{value['estimate']:,} [{value['low']:,}, {value['high']:,}]"
+    
+    sampling = stats['sampling']
+    print(f"\n=== Flow Log 抽样统计报告 (估计值 [{sampling['confidence']:.0%} 置信区间]) ===")
+    print(f"抽样对象: {sampling['objects_sampled']:,} / {sampling['objects_total']:,}, "
+          f"抽样行: {sampling['rows_sampled']:,} / {sampling['rows_read']:,} (种子 {sampling['seed']})")
+    print(f"总记录数: {show(stats['total_records'])}")
+    print(f"总字节数: {show(stats['traffic_summary']['total_bytes'])}")
+    print(f"总数据包: {show(stats['traffic_summary']['total_packets'])}")
+    print(f"样本中的唯一源地址: {stats['traffic_summary']['unique_sources']:,}")
+    print(f"样本中的唯一目标地址: {stats['traffic_summary']['unique_destinations']:,}")
+    
+    if stats['action_breakdown']:
+        print(f"\n动作分布:")
+        for action, value in stats['action_breakdown'].items():
+            print(f"  {action}: {show(value)}")
+    
+    if stats['protocol_breakdown']:
+        print(f"\n协议分布:")
+        for protocol, value in stats['protocol_breakdown'].items():
+            print(f"  {protocol}: {show(value)}")
+
+class FlowLogConversations:
+    """
+    双向会话聚合
+
+    同一连接的两个方向在 Flow Logs 中是两条记录。这里把 5 元组规范化为固定方向
+    (按 (地址, 端口) 排序，较小的一端为 a)，两个方向的字节数、数据包数分别累计到同一个会话上，
+    并记录首次/最后出现时间和 ACCEPT/REJECT 记录数。端点优先使用 pkt-srcaddr/pkt-dstaddr，
+    经过 NAT 或中间 ENI 时也能按真实的通信双方配对。
+
+    同一 VPC 内两端的 ENI 都会记录同一方向的流量，字节数、数据包数和记录数在每个方向上按记录端
+    (flow-direction 为 ingress 或其他) 分别累计，输出时取两者的较大值，避免同一份流量被计算两次。
+
+    内存有界: 每个批次先用 Arrow 哈希分组做部分聚合，部分结果超过 memory_bytes 时合并；
+    合并后仍超过一半则按会话键的哈希值分为 partitions 个分区溢写为 Arrow IPC 文件。
+    最后逐个分区归并，单个分区仍超过上限时换一个哈希种子继续切分。
+    """
+    
+    KEY_COLUMNS = ['addr_a', 'port_a', 'addr_b', 'port_b', 'protocol']
+    # 按方向 (ab/ba) 和记录端 (ingress/other) 分别累计的指标
+    MEASURES = ('bytes', 'packets', 'records', 'accepted', 'rejected')
+    SUM_COLUMNS = [f'{measure}_{direction}_{side}' for measure in MEASURES
+                   for direction in ('ab', 'ba') for side in ('ingress', 'other')]
+    SCHEMA = pa.schema(
+        [('addr_a', pa.string()), ('port_a', pa.int32()), ('addr_b', pa.string()), ('port_b', pa.int32()),
+         ('protocol', pa.int32())]
+        + [(name, pa.int64()) for name in SUM_COLUMNS]
+        + [('first_seen', pa.int64()), ('last_seen', pa.int64())]
+    )
+    MAX_DEPTH = 4
+    
+    def __init__(self, parser: FlowLogParser, memory_bytes: int = 512 * 1024 * 1024,
+                 partitions: int = 64, spill_dir: Optional[str] = None):
+        """
+        初始化会话聚合
+        
+        Args:
+            parser: 用于解析文件的 FlowLogParser
+            memory_bytes: 内存中部分聚合结果的大小上限 (近似值，按 Arrow 缓冲区大小计算)
+            partitions: 溢写时的哈希分区数
+            spill_dir: 溢写文件目录 (默认使用系统临时目录)
+        """
+        self.parser = parser
+        self.memory_bytes = memory_bytes
+        self.partitions = partitions
+        
+        self._spill_dir = tempfile.mkdtemp(prefix='flowlog-conversations-', dir=spill_dir)
+        self._partials: List[pa.Table] = []
+        self._partial_bytes = 0
+        self._runs: Dict[int, List[str]] = {}
+        self.records = 0
+        self.skipped_rows = 0
+        self.spills = 0
+    
+    def add_file(self, file_path: str):
+        """解析一个文件并累计到会话表"""
+        for batch in self.parser.iter_batches(file_path):
+            self.add_batch(batch)
+    
+    def add_batch(self, batch: pa.RecordBatch):
+        """规范化一个批次的 5 元组并做部分聚合"""
+        table = pa.Table.from_batches([batch])
+        src = pc.coalesce(table.column('pkt_srcaddr'), table.column('srcaddr'))
+        dst = pc.coalesce(table.column('pkt_dstaddr'), table.column('dstaddr'))
+        srcport = pc.coalesce(table.column('srcport'), 0)
+        dstport = pc.coalesce(table.column('dstport'), 0)
+        
+        # NODATA/SKIPDATA 记录没有地址
+        valid = pc.and_(src.is_valid(), dst.is_valid())
+        skipped = table.num_rows - pc.sum(valid.cast(pa.int64())).as_py()
+        self.skipped_rows += skipped
+        if skipped:
+            table, src, dst = table.filter(valid), src.filter(valid), dst.filter(valid)
+            srcport, dstport = srcport.filter(valid), dstport.filter(valid)
+        if not table.num_rows:
+            return
+        self.records += table.num_rows
+        
+        # 按 (地址, 端口) 排序决定规范方向，字符串序只需要一致即可
+        swap = pc.or_(pc.greater(src, dst), pc.and_(pc.equal(src, dst), pc.greater(srcport, dstport)))
+        ingress = pc.fill_null(pc.equal(table.column('flow_direction'), 'ingress'), False)
+        action = table.column('action')
+        measures = {
+            'bytes': pc.coalesce(table.column('bytes'), 0),
+            'packets': pc.coalesce(table.column('packets'), 0),
+            'records': pa.array([1] * table.num_rows, pa.int64()),
+            'accepted': pc.fill_null(pc.equal(action, 'ACCEPT'), False).cast(pa.int64()),
+            'rejected': pc.fill_null(pc.equal(action, 'REJECT'), False).cast(pa.int64()),
+        }
+        zero = pa.scalar(0, pa.int64())
+        
+        def directed(values, reverse: bool, observed_ingress: bool):
+            selected = pc.and_(pc.invert(swap) if not reverse else swap,
+                               ingress if observed_ingress else pc.invert(ingress))
+            return pc.if_else(selected, values, zero)
+        
+        columns = {
+            'addr_a': pc.if_else(swap, dst, src),
+            'port_a': pc.if_else(swap, dstport, srcport),
+            'addr_b': pc.if_else(swap, src, dst),
+            'port_b': pc.if_else(swap, srcport, dstport),
+            'protocol': pc.coalesce(table.column('protocol'), -1),
+        }
+        for name, values in measures.items():
+            for reverse, direction in ((False, 'ab'), (True, 'ba')):
+                columns[f'{name}_{direction}_ingress'] = directed(values, reverse, True)
+                columns[f'{name}_{direction}_other'] = directed(values, reverse, False)
+        columns['first_seen'] = table.column('start')
+        columns['last_seen'] = table.column('end')
+        
+        self._add_partial(self._aggregate(pa.table(columns)))
+    
+    def _aggregate(self, table: pa.Table) -> pa.Table:
+        """按会话键聚合 (批次内和合并部分结果共用)"""
+        result = table.group_by(self.KEY_COLUMNS).aggregate(
+            [(name, 'sum') for name in self.SUM_COLUMNS] + [('first_seen', 'min'), ('last_seen', 'max')]
+        )
+        return result.rename_columns([name.rsplit('_', 1)[0] if name.endswith(('_sum', '_min', '_max')) else name
+                                      for name in result.column_names]).select(self.SCHEMA.names).cast(self.SCHEMA)
+    
+    def _add_partial(self, table: pa.Table):
+        self._partials.append(table)
+        self._partial_bytes += table.nbytes
+        if self._partial_bytes < self.memory_bytes:
+            return
+        
+        # 先合并部分结果，重复会话较多时合并后就足够小
+        merged = self._aggregate(pa.concat_tables(self._partials))
+        self._partials, self._partial_bytes = [merged], merged.nbytes
+        if merged.nbytes >= self.memory_bytes // 2:
+            self._spill()
+    
+    def _partition_ids(self, table: pa.Table, depth: int) -> pa.Array:
+        """会话键的哈希分区号，每一层使用不同的哈希种子"""
+        keys = table.select(self.KEY_COLUMNS).to_pandas()
+        hashes = pd.util.hash_pandas_object(keys, index=False, hash_key=f'flowconv{depth:08d}')
+        return pa.array(hashes.values % self.partitions)
+    
+    def _write_partitions(self, table: pa.Table, depth: int, runs: Dict[int, List[str]], prefix: str):
+        """按哈希分区写出溢写段"""
+        partition_ids = self._partition_ids(table, depth)
+        for partition in range(self.partitions):
+            part = table.filter(pc.equal(partition_ids, partition))
+            if not part.num_rows:
+                continue
+            paths = runs.setdefault(partition, [])
+            path = os.path.join(self._spill_dir, f"{prefix}-p{partition:04d}-run-{len(paths):05d}.arrow")
+            with ipc.new_file(path, self.SCHEMA) as writer:
+                writer.write_table(part)
+            paths.append(path)
+    
+    def _spill(self):
+        """把内存中的部分结果按分区溢写到磁盘"""
+        if not self._partials:
+            return
+        table = pa.concat_tables(self._partials)
+        self._partials, self._partial_bytes = [], 0
+        self._write_partitions(table, 0, self._runs, 'spill')
+        self.spills += 1
+        logger.info(f"溢写 {table.num_rows} 个会话 ({table.nbytes / 1048576:.1f} MB)")
+    
+    def _merge_partition(self, paths: List[str], depth: int) -> Iterator[pa.Table]:
+        """归并一个分区的溢写段，超过内存上限时用下一层哈希继续切分"""
+        size = sum(os.path.getsize(path) for path in paths)
+        if size <= self.memory_bytes or depth >= self.MAX_DEPTH or len(paths) == 1:
+            tables = [ipc.open_file(pa.memory_map(path)).read_all() for path in paths]
+            yield self._aggregate(pa.concat_tables(tables))
+        else:
+            runs: Dict[int, List[str]] = {}
+            prefix = os.path.basename(paths[0]).rsplit('-run-', 1)[0] + f'-d{depth}'
+            for path in paths:
+                # 每个溢写段本身已经在上限以内
+                self._write_partitions(ipc.open_file(pa.memory_map(path)).read_all(), depth, runs, prefix)
+                os.remove(path)
+            for partition in sorted(runs):
+                yield from self._merge_partition(runs[partition], depth + 1)
+        
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+    
+    @staticmethod
+    def finalize(table: pa.Table) -> pa.Table:
+        """输出列: 每个方向取两个记录端中的较大值，总量为两个方向之和"""
+        columns = {name: table.column(name) for name in FlowLogConversations.KEY_COLUMNS}
+        directed = {}
+        for name in FlowLogConversations.MEASURES:
+            for direction in ('ab', 'ba'):
+                directed[f'{name}_{direction}'] = pc.max_element_wise(
+                    table.column(f'{name}_{direction}_ingress'), table.column(f'{name}_{direction}_other'))
+        for name in ('bytes', 'packets'):
+            columns[f'{name}_ab'] = directed[f'{name}_ab']
+            columns[f'{name}_ba'] = directed[f'{name}_ba']
+        for name in FlowLogConversations.MEASURES:
+            columns[name] = pc.add(directed[f'{name}_ab'], directed[f'{name}_ba'])
+        for name in ('first_seen', 'last_seen'):
+            columns[name] = table.column(name)
+        return pa.table(columns)
+    
+    def iter_results(self) -> Iterator[pa.Table]:
+        """按分区产出最终的会话表，每个会话只出现在一个分区中"""
+        try:
+            if not self._runs:
+                if self._partials:
+                    yield self.finalize(self._aggregate(pa.concat_tables(self._partials)))
+                return
+            
+            self._spill()
+            for partition in sorted(self._runs):
+                for table in self._merge_partition(self._runs[partition], 1):
+                    yield self.finalize(table)
+        finally:
+            self._partials, self._partial_bytes = [], 0
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+
+def run_conversations(args, parser_tool: FlowLogParser):
+    """会话模式: 聚合双向会话，输出完整会话表 (csv/parquet，由 main 校验) 并打印流量最大的会话"""
+    conversations = FlowLogConversations(
+        parser_tool,
+        memory_bytes=args.memory_mb * 1024 * 1024,
+        partitions=args.partitions,
+        spill_dir=args.spill_dir
+    )
+    
+    if args.local_file:
+        files = [args.local_file]
+    elif args.local_dir:
+        files = sorted(str(path) for path in Path(args.local_dir).rglob('*.gz'))
+    elif args.s3_file:
+        files = [parser_tool.download_from_s3(*args.s3_file)]
+    else:
+        files = parser_tool.iter_s3_files(*args.s3_prefix)
+    
+    for file_path in files:
+        conversations.add_file(file_path)
+    
+    output_path = args.output or f'flow_log_conversations.{args.format}'
+    writer = None
+    total = 0
+    top: Optional[pa.Table] = None
+    
+    try:
+        for table in conversations.iter_results():
+            total += table.num_rows
+            if writer is None:
+                writer = pq.ParquetWriter(output_path, table.schema) if args.format == 'parquet' \
+                    else pa_csv.CSVWriter(output_path, table.schema)
+            writer.write_table(table)
+            
+            # 只保留当前的前 N 个会话
+            candidates = table if top is None else pa.concat_tables([top, table])
+            top = candidates.take(pc.select_k_unstable(candidates, args.top, [('bytes', 'descending')]))
+    finally:
+        if writer is not None:
+            writer.close()
+    
+    logger.info(f"会话聚合完成: {conversations.records} 条记录, {total} 个会话, "
+                f"溢写 {conversations.spills} 次, 跳过 {conversations.skipped_rows} 行")
+    if writer is not None:
+        logger.info(f"会话表已保存到: {output_path}")
+    
+    if top is not None and top.num_rows:
+        df = top.sort_by([('bytes', 'descending')]).to_pandas()
+        df['protocol'] = df['protocol'].map(lambda value: FlowLogParser.PROTOCOL_MAP.get(value, value))
+        for column in ('first_seen', 'last_seen'):
+            df[column] = pd.to_datetime(df[column], unit='s', utc=True)
+        print(f"\n=== 流量最大的 {len(df)} 个会话 (共 {total:,} 个) ===")
+        print(df[['addr_a', 'port_a', 'addr_b', 'port_b', 'protocol', 'bytes_ab', 'bytes_ba',
+                  'packets', 'records', 'rejected', 'first_seen', 'last_seen']].to_string(index=False))
+
+def fraction_arg(value: str) -> float:
+    """argparse 类型: (0, 1] 之间的比例"""
+    try:
+        fraction = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的比例: {value}")
+    if not 0 < fraction <= 1:
+        raise argparse.ArgumentTypeError(f"比例必须在 (0, 1] 之间: {value}")
+    return fraction
+
+def confidence_arg(value: str) -> float:
+    """argparse 类型: (0, 1) 之间的置信水平"""
+    try:
+        confidence = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的置信水平: {value}")
+    if not 0 < confidence < 1:
+        raise argparse.ArgumentTypeError(f"置信水平必须在 (0, 1) 之间: {value}")
+    return confidence
+
+def positive_int_arg(value: str) -> int:
+    """argparse 类型: 正整数"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的整数: {value}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"必须是正整数: {value}")
+    return number
+
 def main():
+    # 子命令
+    if len(sys.argv) > 1 and sys.argv[1] == 'query':
+        return query_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == 'search':
+        return search_main(sys.argv[2:])
+    
     parser = argparse.ArgumentParser(description='VPC Flow Logs 解析工具')
     
     # 输入选项
@@ -212,22 +2552,87 @@ def main():
     input_group.add_argument('--local-file', help='本地文件路径')
     input_group.add_argument('--s3-file', nargs=2, metavar=('BUCKET', 'KEY'), help='S3 文件 (bucket key)')
     input_group.add_argument('--s3-prefix', nargs=2, metavar=('BUCKET', 'PREFIX'), help='S3 前缀 (处理多个文件)')
+    input_group.add_argument('--local-dir', help='本地目录 (处理其中所有 .gz 文件)')
     
     # 输出选项
-    parser.add_argument('--format', choices=['json', 'csv', 'parquet'], default='json', help='输出格式')
+    parser.add_argument('--format', choices=['json', 'csv', 'parquet'], help='输出格式 (默认 json，会话模式默认 parquet)')
     parser.add_argument('--output', help='输出文件路径')
     parser.add_argument('--stats', action='store_true', help='生成统计报告')
     parser.add_argument('--stats-only', action='store_true', help='只生成统计报告')
     parser.add_argument('--limit', type=int, help='限制处理的记录数量')
+    parser.add_argument('--cache-dir', help='解析缓存目录: 每个输入文件的解析结果以列式二进制格式缓存，之后的运行通过 mmap 零拷贝读取')
+    
+    # 合并选项
+    parser.add_argument('--compact', metavar='OUTPUT', help='合并为按小时分区的 Parquet 数据集 (本地目录或 s3://bucket/prefix)')
+    parser.add_argument('--sort-key', default='srcaddr', help='合并时时间之后的排序字段')
+    parser.add_argument('--target-file-size-mb', type=int, default=128, help='合并输出文件的目标大小 (MB)')
+    parser.add_argument('--row-group-size', type=int, default=128 * 1024, help='Parquet 行组行数')
+    parser.add_argument('--memory-rows', type=int, default=500000, help='合并时内存中保留的最大行数，超过后溢写到磁盘')
+    parser.add_argument('--spill-dir', help='合并和会话聚合时的溢写目录')
+    
+    # 索引选项
+    parser.add_argument('--index', action='store_true', help='为每个对象写入 IP 索引 sidecar (S3 对象写到 ipidx/<key>.ipidx)，供 search 子命令使用')
+    parser.add_argument('--index-fp-rate', type=float, default=0.01, help='IP 索引 Bloom 过滤器的假阳性率，越小 sidecar 越大')
+    
+    # 验证选项
+    parser.add_argument('--validate', action='store_true', help='只校验文件格式 (字段数、数值、version、时间、IP、枚举)，不解析记录')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='验证模式的并行进程数')
+    parser.add_argument('--samples', type=int, default=3, help='验证报告中每个错误类别保留的样例行数')
+    
+    # 抽样选项
+    parser.add_argument('--sample', type=fraction_arg, metavar='FRACTION', help='抽样统计: 随机抽取的对象比例，报告估计值和置信区间')
+    parser.add_argument('--sample-rows', type=fraction_arg, default=1.0, help='抽中对象内的伯努利行抽样比例')
+    parser.add_argument('--reservoir', type=positive_int_arg, help='抽中对象内用蓄水池抽样保留的行数 (代替 --sample-rows)')
+    parser.add_argument('--seed', type=int, help='抽样随机种子 (默认按当前时间生成并在报告中给出)')
+    parser.add_argument('--confidence', type=confidence_arg, default=0.95, help='置信区间的置信水平')
+    
+    # 会话选项
+    parser.add_argument('--conversations', action='store_true', help='按规范化的 5 元组聚合双向会话，输出完整会话表 (csv/parquet)')
+    parser.add_argument('--memory-mb', type=int, default=512, help='会话聚合的内存上限 (MB)，超过后按哈希分区溢写到 --spill-dir')
+    parser.add_argument('--partitions', type=int, default=64, help='会话聚合溢写时的哈希分区数')
+    parser.add_argument('--top', type=int, default=20, help='打印流量最大的会话数')
+    
+    # 并行解析选项
+    parser.add_argument('--parse-workers', type=int, default=1, help='单个文件内的并行解析进程数 (大于 1 时按分块并行解析)')
+    parser.add_argument('--chunk-mb', type=int, default=16, help='文件内并行解析的分块大小 (MB，按解压后大小)')
     
     args = parser.parse_args()
+    if args.conversations and args.format == 'json':
+        parser.error('--conversations 仅支持 csv 或 parquet 输出格式')
+    if args.format is None:
+        args.format = 'parquet' if args.conversations else 'json'
     
     parser_tool = FlowLogParser()
+    parser_tool.parse_workers = args.parse_workers
+    parser_tool.chunk_bytes = args.chunk_mb * 1024 * 1024
     all_records = []
+    table = None
     
     try:
+        if args.compact:
+            run_compaction(args, parser_tool)
+            return
+        if args.index:
+            run_indexing(args, parser_tool)
+            return
+        if args.validate:
+            validator = run_validation(args, parser_tool)
+            if validator.invalid_lines:
+                sys.exit(1)
+            return
+        if args.sample is not None:
+            run_sampling(args, parser_tool)
+            return
+        if args.conversations:
+            run_conversations(args, parser_tool)
+            return
+        
         # 处理输入
-        if args.local_file:
+        if args.cache_dir:
+            table = load_cached_inputs(args, parser_tool)
+            files_to_process = []
+            is_local = True
+        elif args.local_file:
             files_to_process = [args.local_file]
             is_local = True
         elif args.s3_file:
@@ -244,12 +2649,16 @@ def main():
             for s3_key in s3_files[:10]:  # 限制处理前10个文件
                 local_file = parser_tool.download_from_s3(bucket, s3_key)
                 files_to_process.append(local_file)
+        elif args.local_dir:
+            files_to_process = sorted(str(path) for path in Path(args.local_dir).rglob('*.gz'))
+            is_local = True
         
         # 解析文件
         for file_path in files_to_process:
             logger.info(f"处理文件: {file_path}")
             
-            for record in parser_tool.parse_file(file_path):
+            # 文件内并行解析时按批次逐条还原记录，达到记录限制后停止解析
+            for record in parser_tool.iter_records(file_path):
                 all_records.append(record)
                 
                 if args.limit and len(all_records) >= args.limit:
@@ -259,11 +2668,12 @@ def main():
             if args.limit and len(all_records) >= args.limit:
                 break
         
-        logger.info(f"总共解析了 {len(all_records)} 条记录")
+        total_records = table.num_rows if table is not None else len(all_records)
+        logger.info(f"总共解析了 {total_records} 条记录")
         
         # 生成统计报告
         if args.stats or args.stats_only:
-            stats = parser_tool.generate_stats(all_records)
+            stats = parser_tool.generate_table_stats(table) if table is not None else parser_tool.generate_stats(all_records)
             stats_output = args.output.replace('.json', '_stats.json') if args.output else 'flow_log_stats.json'
             
             with open(stats_output, 'w', encoding='utf-8') as f:
@@ -290,10 +2700,12 @@ def main():
                     print(f"  {protocol}: {count:,}")
         
         # 保存解析结果
-        if not args.stats_only and all_records:
+        if not args.stats_only and total_records:
             output_path = args.output or f'flow_logs.{args.format}'
             
-            if args.format == 'json':
+            if table is not None:
+                parser_tool.save_table(table, output_path, args.format)
+            elif args.format == 'json':
                 parser_tool.save_as_json(all_records, output_path)
             elif args.format == 'csv':
                 parser_tool.save_as_csv(all_records, output_path)
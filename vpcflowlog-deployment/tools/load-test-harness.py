@@ -0,0 +1,659 @@
+#!/usr/bin/env python3
+"""
+VPC Flow Logs 处理链路的端到端回放压测工具
+
+在本地用进程内的 S3/SQS 替身回放一个目录中的 Flow Log 文件 (.gz / .parquet)，
+按指定速率注入 S3 事件通知 (可选 SNS 包装)，驱动以下两种处理器并报告持续吞吐、
+端到端延迟分位数和内存占用，不需要真实的 AWS 资源:
+
+1. dashboard-script/lambda-sqs-processor.py 的 lambda_handler (模拟 SQS 事件源映射)
+2. dashboard-script/sqs-message-processor.py 的 VPCFlowLogsProcessor 并发/多进程轮询器
+
+S3 和 SQS 替身支持注入固定延迟、随机抖动和带宽限制，用于模拟不同的网络条件。
+
+使用方法:
+    python3 load-test-harness.py --data-dir /tmp/flow-load --generate 200 --records-per-file 20000
+    python3 load-test-harness.py --data-dir /tmp/flow-load --target processor --workers 8 --rate 20 --notifications 1000
+    python3 load-test-harness.py --data-dir /tmp/flow-load --target lambda --lambda-concurrency 4 --sns --s3-latency-ms 30
+    python3 load-test-harness.py --data-dir /tmp/flow-load --target processor --processes 4 --s3-bandwidth-mbps 200
+
+依赖:
+    pip install boto3 pandas pyarrow
+"""
+
+import os
+import io
+import sys
+import json
+import gzip
+import time
+import random
+import argparse
+import contextlib
+import resource
+import threading
+import functools
+import multiprocessing
+import importlib.util
+import heapq
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote_plus
+import logging
+from pathlib import Path
+
+import pandas as pd
+from botocore.exceptions import ClientError
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('load-test-harness')
+
+DASHBOARD_SCRIPT_DIR = Path(__file__).resolve().parent.parent / 'dashboard-script'
+
+def load_script(module_name: str, file_name: str):
+    """按文件路径加载 dashboard-script 中的脚本 (文件名含连字符，不能直接 import)"""
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(module_name, DASHBOARD_SCRIPT_DIR / file_name)
+    module = importlib.util.module_from_spec(spec)
+    # 先登记到 sys.modules，多进程模式下子进程才能按模块名找到其中的类
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+class LatencyModel:
+    """网络条件模型: 每次调用的固定延迟 + 均匀分布的抖动 + 按带宽计算的传输时间"""
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, bandwidth_mbps: float = 0):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.bytes_per_second = bandwidth_mbps * 1000 * 1000 / 8 if bandwidth_mbps else 0
+
+    def delay(self, size: int = 0):
+        seconds = self.latency + random.uniform(0, self.jitter)
+        if self.bytes_per_second:
+            seconds += size / self.bytes_per_second
+        if seconds > 0:
+            time.sleep(seconds)
+
+class LocalS3:
+    """
+    进程内的 S3 替身，把本地目录作为一个存储桶提供 get_object/head_object
+
+    目录下的相对路径即对象 key。请求计数使用共享内存，fork 出的 worker 进程中的请求同样计入。
+    """
+
+    def __init__(self, root: str, bucket: str, latency: Optional[LatencyModel] = None):
+        self.root = os.path.abspath(root)
+        self.bucket = bucket
+        self.latency = latency or LatencyModel()
+        self._requests = multiprocessing.Value('q', 0)
+        self._bytes_sent = multiprocessing.Value('q', 0)
+
+    @property
+    def requests(self) -> int:
+        return self._requests.value
+
+    @property
+    def bytes_sent(self) -> int:
+        return self._bytes_sent.value
+
+    def _count(self, size: int = 0):
+        with self._requests.get_lock():
+            self._requests.value += 1
+            self._bytes_sent.value += size
+
+    def _path(self, bucket: str, key: str, operation: str) -> str:
+        if bucket != self.bucket:
+            raise ClientError({'Error': {'Code': 'NoSuchBucket', 'Message': bucket}}, operation)
+        path = os.path.join(self.root, key)
+        if not os.path.isfile(path):
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': key}}, operation)
+        return path
+
+    @staticmethod
+    def etag(path: str) -> str:
+        stat = os.stat(path)
+        return f'"{stat.st_size:x}{stat.st_mtime_ns:x}"'
+
+    def get_object(self, Bucket: str, Key: str, **kwargs) -> Dict:
+        path = self._path(Bucket, Key, 'GetObject')
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.latency.delay(len(data))
+        self._count(len(data))
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data), 'ETag': self.etag(path)}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> Dict:
+        path = self._path(Bucket, Key, 'HeadObject')
+        self.latency.delay()
+        self._count()
+        return {'ContentLength': os.path.getsize(path), 'ETag': self.etag(path)}
+
+    def read_parquet(self, path, *args, **kwargs):
+        """代替 s3fs 读取 s3:// 路径 (lambda 的 Parquet 分支直接调用 pd.read_parquet)，其他路径照常读取"""
+        if not str(path).startswith('s3://'):
+            return _read_parquet(path, *args, **kwargs)
+        bucket, _, key = path[len('s3://'):].partition('/')
+        body = self.get_object(Bucket=bucket, Key=key)['Body']
+        return _read_parquet(body, *args, **kwargs)
+
+_read_parquet = pd.read_parquet
+
+@contextlib.contextmanager
+def local_read_parquet(s3: LocalS3):
+    """
+    在 with 块内把 pd.read_parquet 换成从本地 S3 替身读取，退出 (包括异常) 时恢复
+
+    lambda 在函数内 import pandas，模块中没有可以单独替换的引用，只能替换 pandas 上的函数。
+    """
+    original = pd.read_parquet
+    pd.read_parquet = s3.read_parquet
+    try:
+        yield
+    finally:
+        pd.read_parquet = original
+
+class LocalSQS:
+    """
+    进程内的 SQS 替身
+
+    支持长轮询、可见性超时 (超时未删除的消息重新可见)、批量删除和可见性续期；
+    记录每条消息从发送到删除的端到端延迟，以及队列积压的峰值。
+    """
+
+    def __init__(self, latency: Optional[LatencyModel] = None):
+        self.latency = latency or LatencyModel()
+        self._cond = threading.Condition()
+        self._messages: Dict[str, Dict] = {}
+        self._ready = deque()
+        # (重新可见的时间, 消息 ID, 接收次数)
+        self._invisible: List[Tuple[float, str, int]] = []
+        self._next_id = 0
+
+        self.sent = 0
+        self.deleted = 0
+        self.redelivered = 0
+        self.max_backlog = 0
+        self.latencies: List[float] = []
+        self.first_sent: Optional[float] = None
+        self.last_deleted: Optional[float] = None
+
+    @property
+    def outstanding(self) -> int:
+        """已发送但尚未删除的消息数"""
+        with self._cond:
+            return len(self._messages)
+
+    def _release_expired(self, now: float):
+        while self._invisible and self._invisible[0][0] <= now:
+            _, message_id, receive_count = heapq.heappop(self._invisible)
+            message = self._messages.get(message_id)
+            # 期间被续期或删除的消息忽略旧的条目
+            if message is not None and message['receive_count'] == receive_count and message['visible_at'] <= now:
+                self._ready.append(message_id)
+                self.redelivered += 1
+
+    def send_message(self, QueueUrl: str, MessageBody: str, **kwargs) -> Dict:
+        self.latency.delay(len(MessageBody))
+        with self._cond:
+            message_id = f"{self._next_id:012d}"
+            self._next_id += 1
+            now = time.monotonic()
+            self._messages[message_id] = {'body': MessageBody, 'sent_at': now, 'visible_at': now, 'receive_count': 0}
+            self._ready.append(message_id)
+            self.sent += 1
+            self.first_sent = self.first_sent or now
+            self.max_backlog = max(self.max_backlog, len(self._ready))
+            self._cond.notify()
+        return {'MessageId': message_id}
+
+    def receive_message(self, QueueUrl: str, MaxNumberOfMessages: int = 1, WaitTimeSeconds: int = 0,
+                        VisibilityTimeout: int = 30, **kwargs) -> Dict:
+        self.latency.delay()
+        deadline = time.monotonic() + WaitTimeSeconds
+        messages = []
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._release_expired(now)
+                while self._ready and len(messages) < MaxNumberOfMessages:
+                    message_id = self._ready.popleft()
+                    message = self._messages.get(message_id)
+                    if message is None:
+                        continue
+                    message['receive_count'] += 1
+                    message['visible_at'] = now + VisibilityTimeout
+                    heapq.heappush(self._invisible, (message['visible_at'], message_id, message['receive_count']))
+                    messages.append({
+                        'MessageId': message_id,
+                        'ReceiptHandle': f"{message_id}:{message['receive_count']}",
+                        'Body': message['body'],
+                        'Attributes': {'ApproximateReceiveCount': str(message['receive_count'])},
+                    })
+                if messages or now >= deadline:
+                    break
+                wake = min(deadline, self._invisible[0][0]) if self._invisible else deadline
+                self._cond.wait(max(wake - now, 0.001))
+        return {'Messages': messages} if messages else {}
+
+    def _delete(self, receipt_handle: str) -> bool:
+        message_id, _, receive_count = receipt_handle.partition(':')
+        message = self._messages.get(message_id)
+        if message is None or str(message['receive_count']) != receive_count:
+            return False
+        del self._messages[message_id]
+        now = time.monotonic()
+        self.latencies.append(now - message['sent_at'])
+        self.deleted += 1
+        self.last_deleted = now
+        return True
+
+    def delete_message(self, QueueUrl: str, ReceiptHandle: str, **kwargs) -> Dict:
+        self.latency.delay()
+        with self._cond:
+            if not self._delete(ReceiptHandle):
+                raise ClientError({'Error': {'Code': 'ReceiptHandleIsInvalid', 'Message': ReceiptHandle}}, 'DeleteMessage')
+        return {}
+
+    def delete_message_batch(self, QueueUrl: str, Entries: List[Dict], **kwargs) -> Dict:
+        self.latency.delay()
+        successful, failed = [], []
+        with self._cond:
+            for entry in Entries:
+                if self._delete(entry['ReceiptHandle']):
+                    successful.append({'Id': entry['Id']})
+                else:
+                    failed.append({'Id': entry['Id'], 'Code': 'ReceiptHandleIsInvalid', 'SenderFault': True})
+        return {'Successful': successful, 'Failed': failed}
+
+    def change_message_visibility(self, QueueUrl: str, ReceiptHandle: str, VisibilityTimeout: int, **kwargs) -> Dict:
+        self.latency.delay()
+        message_id, _, receive_count = ReceiptHandle.partition(':')
+        with self._cond:
+            message = self._messages.get(message_id)
+            if message is None or str(message['receive_count']) != receive_count:
+                raise ClientError({'Error': {'Code': 'ReceiptHandleIsInvalid', 'Message': ReceiptHandle}}, 'ChangeMessageVisibility')
+            message['visible_at'] = time.monotonic() + VisibilityTimeout
+            heapq.heappush(self._invisible, (message['visible_at'], message_id, message['receive_count']))
+        return {}
+
+    def get_queue_attributes(self, QueueUrl: str, AttributeNames: List[str], **kwargs) -> Dict:
+        self.latency.delay()
+        with self._cond:
+            self._release_expired(time.monotonic())
+            visible = len(self._ready)
+            return {'Attributes': {
+                'ApproximateNumberOfMessages': str(visible),
+                'ApproximateNumberOfMessagesNotVisible': str(len(self._messages) - visible),
+            }}
+
+class NotificationInjector:
+    """按固定速率向队列发送 S3 ObjectCreated 事件通知，文件不够时循环使用"""
+
+    def __init__(self, sqs: LocalSQS, queue_url: str, bucket: str, objects: List[Tuple[str, int, str]],
+                 total: int, rate: float = 0, sns: bool = False):
+        self.sqs = sqs
+        self.queue_url = queue_url
+        self.bucket = bucket
+        self.objects = objects
+        self.total = total
+        self.rate = rate
+        self.sns = sns
+        self.done = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def build_message(self, index: int) -> str:
+        key, size, etag = self.objects[index % len(self.objects)]
+        event = {'Records': [{
+            'eventVersion': '2.1',
+            'eventSource': 'aws:s3',
+            'awsRegion': 'us-east-1',
+            'eventTime': datetime.now(timezone.utc).isoformat(),
+            'eventName': 'ObjectCreated:Put',
+            's3': {
+                'bucket': {'name': self.bucket, 'arn': f'arn:aws:s3:::{self.bucket}'},
+                # 每次注入使用不同的 sequencer，循环使用文件时不会被当作重复通知
+                'object': {'key': quote_plus(key), 'size': size, 'eTag': etag.strip('"'), 'sequencer': f'{index:016X}'},
+            },
+        }]}
+        if self.sns:
+            return json.dumps({
+                'Type': 'Notification',
+                'MessageId': f'sns-{index}',
+                'TopicArn': 'arn:aws:sns:us-east-1:123456789012:vpc-flow-logs-notifications',
+                'Message': json.dumps(event),
+            })
+        return json.dumps(event)
+
+    def _run(self):
+        started = time.monotonic()
+        for index in range(self.total):
+            if self.rate:
+                wait = started + index / self.rate - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+            self.sqs.send_message(QueueUrl=self.queue_url, MessageBody=self.build_message(index))
+        self.done.set()
+        logger.info(f"已注入 {self.total} 条通知，用时 {time.monotonic() - started:.1f} 秒")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='notification-injector', daemon=True)
+        self._thread.start()
+
+class MemorySampler:
+    """定期采样当前进程的 RSS"""
+
+    def __init__(self, interval: float = 0.2):
+        self.interval = interval
+        self.start_rss = self.rss()
+        self.peak_rss = self.start_rss
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='memory-sampler', daemon=True)
+
+    @staticmethod
+    def rss() -> int:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, self.rss())
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+def generate_dataset(data_dir: str, files: int, records_per_file: int, parquet_ratio: float = 0.0, seed: int = 0):
+    """
+    生成与 CDK 配置格式一致的 Flow Log 文件 (Text 带表头，Parquet 使用 AWS 投递的列名 start/end/log_status)
+
+    投递前缀按投递时间划分，记录的开始时间可能早于所在的小时: 约 1/7 的记录落在前一个小时。
+    """
+    rng = random.Random(seed)
+    header = ('version account-id interface-id srcaddr dstaddr srcport dstport protocol packets bytes start end '
+              'action log-status vpc-id subnet-id instance-id tcp-flags type pkt-srcaddr pkt-dstaddr region az-id '
+              'sublocation-type sublocation-id pkt-src-aws-service pkt-dst-aws-service flow-direction traffic-path')
+    columns = [name.replace('-', '_') for name in header.split(' ')]
+
+    base = 1705312800
+    for index in range(files):
+        hour = base + index * 300 // 3600 * 3600
+        moment = datetime.fromtimestamp(hour, timezone.utc)
+        directory = Path(data_dir) / f"vpc-flow-logs/year={moment:%Y}/month={moment:%m}/day={moment:%d}/hour={moment:%H}"
+        directory.mkdir(parents=True, exist_ok=True)
+
+        lines = []
+        for _ in range(records_per_file):
+            src = f"10.0.{rng.randrange(16)}.{rng.randrange(256)}"
+            dst = f"10.1.{rng.randrange(16)}.{rng.randrange(256)}"
+            start = hour + rng.randrange(-600, 3600)
+            lines.append(
+                f"5 123456789012 eni-{rng.randrange(64):08x} {src} {dst} {rng.randrange(1024, 65536)} "
+                f"{rng.choice((22, 80, 443, 3306, 5432))} {rng.choice((6, 6, 6, 17, 1))} {rng.randrange(1, 500)} "
+                f"{rng.randrange(40, 1500000)} {start} {start + rng.randrange(60)} "
+                f"{'ACCEPT' if rng.random() < 0.9 else 'REJECT'} OK vpc-0123 subnet-{rng.randrange(4)} "
+                f"i-{rng.randrange(32):08x} 2 IPv4 {src} {dst} us-east-1 use1-az1 - - - - "
+                f"{rng.choice(('ingress', 'egress'))} 1"
+            )
+
+        name = f"123456789012_vpcflowlogs_us-east-1_fl-0123_{moment:%Y%m%dT%H%M}Z_{index:06d}"
+        if rng.random() < parquet_ratio:
+            rows = [line.split(' ') for line in lines]
+            df = pd.DataFrame(rows, columns=columns).replace('-', None)
+            for column in ('version', 'srcport', 'dstport', 'protocol', 'packets', 'bytes',
+                           'start', 'end', 'tcp_flags', 'traffic_path'):
+                df[column] = pd.to_numeric(df[column])
+            df.to_parquet(directory / f"{name}.parquet", index=False)
+        else:
+            with gzip.open(directory / f"{name}.log.gz", 'wt', encoding='utf-8') as f:
+                f.write(header + '\n' + '\n'.join(lines) + '\n')
+
+    logger.info(f"已在 {data_dir} 生成 {files} 个文件 (每个 {records_per_file} 条记录)")
+
+def list_objects(data_dir: str) -> List[Tuple[str, int, str]]:
+    """列出目录中的 Flow Log 文件: (key, 大小, ETag)"""
+    objects = []
+    for path in sorted(Path(data_dir).rglob('*')):
+        if path.is_file() and (path.name.endswith('.gz') or path.name.endswith('.parquet')):
+            objects.append((str(path.relative_to(data_dir)), path.stat().st_size, LocalS3.etag(str(path))))
+    return objects
+
+def wait_for_drain(injector: NotificationInjector, sqs: LocalSQS, timeout: float) -> bool:
+    """等待通知全部注入且全部被删除，超时返回 False"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if injector.done.is_set() and sqs.outstanding == 0:
+            return True
+        time.sleep(0.05)
+    return False
+
+def drive_processor(args, s3: LocalS3, sqs: LocalSQS, injector: NotificationInjector) -> Dict:
+    """用 VPCFlowLogsProcessor 的并发/多进程轮询器消费队列"""
+    module = load_script('sqs_message_processor', 'sqs-message-processor.py')
+    metrics = module.PollerMetrics()
+    processor = module.VPCFlowLogsProcessor(args.queue_url, sqs_client=sqs, s3_client=s3, metrics=metrics)
+
+    common = dict(receivers=args.receivers, wait_time=1, visibility_timeout=args.visibility_timeout)
+    if args.processes:
+        # fork 启动的子进程继承已加载的脚本模块，worker 中的处理器同样读取本地 S3 替身
+        factory = functools.partial(module.VPCFlowLogsProcessor, args.queue_url, s3_client=s3, sqs_client=sqs)
+        poller = module.ProcessPoolSQSPoller(processor, processes=args.processes, processor_factory=factory,
+                                             mp_context='fork', **common)
+    else:
+        poller = module.ConcurrentSQSPoller(processor, workers=args.workers, **common)
+
+    poller.start()
+    injector.start()
+    drained = wait_for_drain(injector, sqs, args.timeout)
+    poller.stop()
+    poller.join()
+
+    return {
+        'drained': drained,
+        'files': metrics.counter('files_processed_total'),
+        'records': metrics.counter('records_processed_total'),
+        'failed_messages': poller.stats['failed'],
+    }
+
+def drive_lambda(args, s3: LocalS3, sqs: LocalSQS, injector: NotificationInjector) -> Dict:
+    """模拟 SQS 事件源映射: 按批接收消息调用 lambda_handler，成功后删除整批消息"""
+    module = load_script('lambda_sqs_processor', 'lambda-sqs-processor.py')
+    module.s3_client = s3
+
+    totals = {'files': 0, 'records': 0, 'failed_files': 0, 'invocations': 0, 'failed_invocations': 0}
+    durations: List[float] = []
+    lock = threading.Lock()
+    stopping = threading.Event()
+
+    class Context:
+        function_name = 'vpc-flow-logs-processor'
+        memory_limit_in_mb = 512
+
+        @staticmethod
+        def get_remaining_time_in_millis() -> int:
+            return 300000
+
+    def invoke_loop():
+        while not stopping.is_set():
+            response = sqs.receive_message(QueueUrl=args.queue_url, MaxNumberOfMessages=args.batch_size,
+                                           WaitTimeSeconds=1, VisibilityTimeout=args.visibility_timeout)
+            messages = response.get('Messages', [])
+            if not messages:
+                continue
+
+            event = {'Records': [{
+                'messageId': message['MessageId'],
+                'receiptHandle': message['ReceiptHandle'],
+                'body': message['Body'],
+                'eventSource': 'aws:sqs',
+                'eventSourceARN': 'arn:aws:sqs:us-east-1:123456789012:vpc-flow-logs-notifications',
+            } for message in messages]}
+
+            started = time.perf_counter()
+            result = module.lambda_handler(event, Context())
+            elapsed = time.perf_counter() - started
+            body = json.loads(result['body'])
+
+            with lock:
+                durations.append(elapsed)
+                totals['invocations'] += 1
+                if result['statusCode'] != 200:
+                    totals['failed_invocations'] += 1
+                    continue
+                totals['files'] += body['successful']
+                totals['failed_files'] += body['failed']
+                totals['records'] += sum(item.get('records_count', 0) for item in body['results'])
+
+            # 调用成功时事件源映射删除整批消息，失败时等待可见性超时后重试
+            sqs.delete_message_batch(QueueUrl=args.queue_url, Entries=[
+                {'Id': str(i), 'ReceiptHandle': message['ReceiptHandle']} for i, message in enumerate(messages)
+            ])
+
+    # lambda 的 Parquet 分支通过 pd.read_parquet('s3://...') 读取，只在回放期间改为从本地替身读取
+    with local_read_parquet(s3):
+        threads = [threading.Thread(target=invoke_loop, name=f'lambda-{i}') for i in range(args.lambda_concurrency)]
+        for thread in threads:
+            thread.start()
+        try:
+            injector.start()
+            drained = wait_for_drain(injector, sqs, args.timeout)
+        finally:
+            stopping.set()
+            for thread in threads:
+                thread.join()
+
+    totals['drained'] = drained
+    totals['invocation_ms'] = percentiles(durations)
+    return totals
+
+def percentiles(values: List[float]) -> Dict:
+    """毫秒单位的延迟分位数"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000, 1)
+
+    return {'p50': pick(0.5), 'p90': pick(0.9), 'p99': pick(0.99), 'max': round(ordered[-1] * 1000, 1)}
+
+def run(args) -> Dict:
+    """执行一次压测并汇总结果"""
+    objects = list_objects(args.data_dir)
+    if not objects:
+        raise SystemExit(f"{args.data_dir} 中没有 .gz 或 .parquet 文件，可以先用 --generate 生成")
+
+    s3 = LocalS3(args.data_dir, args.bucket, LatencyModel(args.s3_latency_ms, args.s3_jitter_ms, args.s3_bandwidth_mbps))
+    sqs = LocalSQS(LatencyModel(args.sqs_latency_ms, args.sqs_jitter_ms))
+    injector = NotificationInjector(sqs, args.queue_url, args.bucket, objects,
+                                    total=args.notifications or len(objects), rate=args.rate, sns=args.sns)
+
+    memory = MemorySampler()
+    memory.start()
+    if args.target == 'lambda':
+        result = drive_lambda(args, s3, sqs, injector)
+    else:
+        result = drive_processor(args, s3, sqs, injector)
+    memory.stop()
+
+    elapsed = (sqs.last_deleted or time.monotonic()) - (sqs.first_sent or time.monotonic())
+    result.update({
+        'target': args.target,
+        'notifications': injector.total,
+        'completed': sqs.deleted,
+        'redelivered': sqs.redelivered,
+        'max_backlog': sqs.max_backlog,
+        'elapsed_seconds': round(elapsed, 2),
+        'files_per_second': round(result['files'] / elapsed, 2) if elapsed > 0 else 0,
+        'records_per_second': round(result['records'] / elapsed, 1) if elapsed > 0 else 0,
+        'end_to_end_ms': percentiles(sqs.latencies),
+        's3_requests': s3.requests,
+        's3_bytes': s3.bytes_sent,
+        'rss_start_mb': round(memory.start_rss / 1048576, 1),
+        'rss_peak_mb': round(memory.peak_rss / 1048576, 1),
+    })
+    if args.processes and args.target == 'processor':
+        result['children_max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+    return result
+
+def print_report(result: Dict):
+    print(f"\n=== 压测结果 ({result['target']}) ===")
+    print(f"注入通知: {result['notifications']:,}, 完成: {result['completed']:,}, "
+          f"重新投递: {result['redelivered']:,}, 队列积压峰值: {result['max_backlog']:,}")
+    if not result['drained']:
+        print("警告: 超时前队列未排空，吞吐按已完成的消息计算")
+    print(f"持续时间: {result['elapsed_seconds']} 秒")
+    print(f"文件/秒: {result['files_per_second']:,}")
+    print(f"记录/秒: {result['records_per_second']:,}")
+    latency = result['end_to_end_ms']
+    if latency:
+        print(f"端到端延迟 (ms): p50 {latency['p50']}, p90 {latency['p90']}, p99 {latency['p99']}, max {latency['max']}")
+    if result.get('invocation_ms'):
+        invocation = result['invocation_ms']
+        print(f"Lambda 调用耗时 (ms): p50 {invocation['p50']}, p99 {invocation['p99']}, 调用次数 {result['invocations']:,}")
+    print(f"S3 请求: {result['s3_requests']:,}, 传输 {result['s3_bytes'] / 1048576:,.1f} MB")
+    print(f"内存 RSS: 起始 {result['rss_start_mb']} MB, 峰值 {result['rss_peak_mb']} MB"
+          + (f", 子进程峰值 {result['children_max_rss_mb']} MB" if 'children_max_rss_mb' in result else ''))
+
+def main():
+    parser = argparse.ArgumentParser(description='VPC Flow Logs 处理链路的本地回放压测')
+
+    # 数据
+    parser.add_argument('--data-dir', required=True, help='回放的 Flow Log 文件目录 (相对路径作为 S3 key)')
+    parser.add_argument('--generate', type=int, help='先在目录中生成 N 个样例文件')
+    parser.add_argument('--records-per-file', type=int, default=10000, help='生成文件的记录数')
+    parser.add_argument('--parquet-ratio', type=float, default=0.0, help='生成 Parquet 文件的比例 (0-1)')
+    parser.add_argument('--bucket', default='vpc-flow-logs-loadtest', help='模拟的存储桶名')
+    parser.add_argument('--queue-url', default='https://sqs.us-east-1.amazonaws.com/123456789012/vpc-flow-logs-loadtest',
+                        help='模拟的队列 URL')
+
+    # 负载
+    parser.add_argument('--target', choices=['processor', 'lambda'], default='processor', help='被测处理器')
+    parser.add_argument('--notifications', type=int, help='注入的通知数 (默认每个文件一条，超过文件数时循环使用)')
+    parser.add_argument('--rate', type=float, default=0, help='每秒注入的通知数 (0 表示一次性全部注入)')
+    parser.add_argument('--sns', action='store_true', help='通知使用 SNS 包装')
+    parser.add_argument('--timeout', type=float, default=600, help='等待队列排空的最长时间 (秒)')
+    parser.add_argument('--visibility-timeout', type=int, default=300, help='消息可见性超时 (秒)')
+
+    # 处理器参数
+    parser.add_argument('--receivers', type=int, default=1, help='processor: 接收线程数')
+    parser.add_argument('--workers', type=int, default=4, help='processor: 处理线程数')
+    parser.add_argument('--processes', type=int, default=0, help='processor: worker 进程数 (大于 0 时使用多进程模式)')
+    parser.add_argument('--lambda-concurrency', type=int, default=1, help='lambda: 并发调用数')
+    parser.add_argument('--batch-size', type=int, default=10, help='lambda: 事件源映射的批大小')
+
+    # 网络条件
+    parser.add_argument('--s3-latency-ms', type=float, default=0, help='S3 每次请求的固定延迟')
+    parser.add_argument('--s3-jitter-ms', type=float, default=0, help='S3 请求延迟的随机抖动上限')
+    parser.add_argument('--s3-bandwidth-mbps', type=float, default=0, help='S3 下载带宽 (Mbit/s，0 表示不限)')
+    parser.add_argument('--sqs-latency-ms', type=float, default=0, help='SQS 每次 API 调用的固定延迟')
+    parser.add_argument('--sqs-jitter-ms', type=float, default=0, help='SQS 调用延迟的随机抖动上限')
+
+    parser.add_argument('--report', help='结果 JSON 输出路径')
+    parser.add_argument('--log-level', default='WARNING', help='被测处理器的日志级别')
+
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_dataset(args.data_dir, args.generate, args.records_per_file, args.parquet_ratio)
+
+    # 被测脚本逐条消息记录 INFO 日志，压测时默认只保留告警
+    logging.getLogger().setLevel(getattr(logging, args.log_level.upper()))
+    logger.setLevel(logging.INFO)
+
+    result = run(args)
+    print_report(result)
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        logger.info(f"压测结果已保存到: {args.report}")
+
+if __name__ == '__main__':
+    main()